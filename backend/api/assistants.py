@@ -1,18 +1,23 @@
 """Assistant management endpoints"""
-import json
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from models.database import get_db, User, UserAssistant, FileMetadata
+from models.database import get_db, User, UserAssistant, FileMetadata, ThreadedSession
 from api.auth import get_current_user
-from utils.config import settings
+from utils.openai_client import get_openai_client
+from utils.openai_governor import openai_http_error
+from utils.assistant_cache import assistant_cache
+from utils.tool_resources import tool_resources_reconciler
+from utils.assistant_files import (
+    get_assistant_file_ids, get_file_ids_by_assistant, get_assistant_files,
+    attach_files, detach_files, is_file_attached_elsewhere
+)
+from utils.user_stats import update_user_stats, refresh_last_assistant, invalidate_profile_stats, assistant_usage
 
 router = APIRouter()
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 # Available models
 AVAILABLE_MODELS = [
@@ -78,21 +83,29 @@ async def get_available_models():
 @router.get("/", response_model=List[AssistantResponse])
 async def list_assistants(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """List user's assistants"""
-    assistants = db.query(UserAssistant).filter(
+    assistants = await db.query(UserAssistant).filter(
         UserAssistant.user_id == current_user.id
     ).all()
 
+    # Remote state comes from the shared cache; misses are fetched concurrently
+    openai_assistants = await assistant_cache.get_many(client, [a.assistant_id for a in assistants])
+    # Attachments for every assistant in one query
+    file_ids_by_assistant = await get_file_ids_by_assistant(db, [a.id for a in assistants])
+
     result = []
     for a in assistants:
         # Get current file_ids from database
-        db_file_ids = json.loads(a.file_ids) if a.file_ids else []
+        db_file_ids = file_ids_by_assistant[a.id]
 
         # Sync with OpenAI to get the actual attached files
         try:
-            openai_assistant = client.beta.assistants.retrieve(a.assistant_id)
+            openai_assistant = openai_assistants.get(a.assistant_id)
+            if openai_assistant is None:
+                raise LookupError("assistant state unavailable")
             openai_file_ids = []
             if hasattr(openai_assistant, 'tool_resources') and openai_assistant.tool_resources:
                 if hasattr(openai_assistant.tool_resources, 'code_interpreter') and openai_assistant.tool_resources.code_interpreter:
@@ -132,10 +145,11 @@ async def list_assistants(
 async def get_assistant(
     assistant_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Get a specific assistant by its ID."""
-    db_assistant = db.query(UserAssistant).filter(
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -148,7 +162,7 @@ async def get_assistant(
     
     # Get actual OpenAI assistant data to retrieve tool_resources
     try:
-        openai_assistant = client.beta.assistants.retrieve(assistant_id)
+        openai_assistant = await assistant_cache.get(client, assistant_id)
 
         # Extract vector store IDs from tool_resources if they exist
         vector_store_ids = []
@@ -179,7 +193,7 @@ async def get_assistant(
         description=db_assistant.description,
         instructions=db_assistant.instructions,
         model=db_assistant.model,
-        file_ids=json.loads(db_assistant.file_ids) if db_assistant.file_ids else [],
+        file_ids=await get_assistant_file_ids(db, db_assistant.id),
         thread_id=db_assistant.thread_id,
         tools=tools_config,
         conversation_count=conversation_count,
@@ -191,7 +205,8 @@ async def get_assistant(
 async def create_assistant(
     assistant_data: AssistantCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Create new assistant and automatically create a thread for it."""
     try:
@@ -201,7 +216,7 @@ async def create_assistant(
         tool_resources_file_ids = []
 
         if unique_file_ids:
-            db_files = db.query(FileMetadata).filter(
+            db_files = await db.query(FileMetadata).filter(
                 FileMetadata.file_id.in_(unique_file_ids),
                 FileMetadata.uploaded_by == current_user.id
             ).all()
@@ -216,9 +231,10 @@ async def create_assistant(
         if tool_resources_file_ids:
             assistant_params["tool_resources"] = {"code_interpreter": {"file_ids": tool_resources_file_ids}}
 
-        openai_assistant = client.beta.assistants.create(**assistant_params)
+        openai_assistant = await client.beta.assistants.create(**assistant_params)
+        await assistant_cache.set(openai_assistant.id, openai_assistant)
         
-        thread = client.beta.threads.create()
+        thread = await client.beta.threads.create()
         
         db_assistant = UserAssistant(
             user_id=current_user.id,
@@ -227,12 +243,14 @@ async def create_assistant(
             description=assistant_data.description,
             instructions=assistant_data.instructions,
             model=assistant_data.model,
-            file_ids=json.dumps(unique_file_ids),
             thread_id=thread.id
         )
         db.add(db_assistant)
-        db.commit()
-        db.refresh(db_assistant)
+        await db.flush()
+        await attach_files(db, db_assistant.id, unique_file_ids)
+        await update_user_stats(db, current_user.id, assistants=1, active_threads=1, last_assistant=db_assistant)
+        await db.commit()
+        await db.refresh(db_assistant)
         
         # Conversation count is 1 since we just created a thread
         return AssistantResponse(
@@ -250,21 +268,19 @@ async def create_assistant(
         )
         
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to create assistant: {str(e)}"
-        )
+        raise openai_http_error(e, f"Failed to create assistant: {str(e)}")
 
 @router.put("/{assistant_id}", response_model=AssistantResponse)
 async def update_assistant(
     assistant_id: str,
     assistant_update: AssistantUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Update assistant"""
     # Get assistant from database
-    db_assistant = db.query(UserAssistant).filter(
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -289,63 +305,40 @@ async def update_assistant(
             db_assistant.model = assistant_update.model
         if assistant_update.description is not None:
             db_assistant.description = assistant_update.description
+        if assistant_update.file_ids is not None:
+            update_data["tools"] = [{"type": "code_interpreter"}]
         
         # Update basic assistant fields if provided
         if update_data:
             try:
                 print(f"DEBUG: Updating assistant {assistant_id} basic fields: {update_data}")
-                client.beta.assistants.update(assistant_id, **update_data)
+                updated = await client.beta.assistants.update(assistant_id, **update_data)
+                await assistant_cache.set(assistant_id, updated)
                 print(f"DEBUG: Successfully updated assistant {assistant_id} basic fields")
             except Exception as e:
                 print(f"DEBUG: Failed to update assistant {assistant_id}: {str(e)}")
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Failed to update assistant: {str(e)}"
-                )
+                raise openai_http_error(e, f"Failed to update assistant: {str(e)}")
 
         # Update file IDs by merging old and new lists
         if assistant_update.file_ids is not None:
-            # Get existing files and merge with new ones, ensuring no duplicates
-            existing_file_ids = json.loads(db_assistant.file_ids) if db_assistant.file_ids else []
-            updated_file_ids = list(set(existing_file_ids + assistant_update.file_ids))
+            # New attachments join the existing ones; duplicates are ignored
+            await attach_files(db, db_assistant.id, assistant_update.file_ids)
 
-            tools = [{"type": "code_interpreter"}]
-
-            # Separate files by purpose for tool_resources
-            db_files = db.query(FileMetadata).filter(
-                FileMetadata.file_id.in_(updated_file_ids),
-                FileMetadata.uploaded_by == current_user.id
-            ).all()
-
-            tool_resources_file_ids = [
-                f.file_id for f in db_files if f.purpose == 'assistants'
-            ]
+            # Only the assistant's own 'assistants' files go into tool_resources
+            db_files = await get_assistant_files(db, db_assistant, purpose='assistants')
+            tool_resources_file_ids = [f.file_id for f in db_files]
 
             # Update assistant with the complete list of tool files
             try:
                 print(f"DEBUG: Updating assistant {assistant_id} file attachments: {tool_resources_file_ids}")
-                client.beta.assistants.update(
-                    assistant_id,
-                    tools=tools,
-                    tool_resources={
-                        "code_interpreter": {
-                            "file_ids": tool_resources_file_ids
-                        }
-                    } if tool_resources_file_ids else {}
-                )
+                await tool_resources_reconciler.add_files(client, assistant_id, tool_resources_file_ids)
                 print(f"DEBUG: Successfully updated assistant {assistant_id} file attachments")
             except Exception as e:
                 print(f"DEBUG: Failed to update assistant file attachments: {str(e)}")
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Failed to update assistant files: {str(e)}"
-                )
-
-            # Save the complete, merged list of all file IDs to the database
-            db_assistant.file_ids = json.dumps(updated_file_ids)
+                raise openai_http_error(e, f"Failed to update assistant files: {str(e)}")
         
-        db.commit()
-        db.refresh(db_assistant)
+        await db.commit()
+        await db.refresh(db_assistant)
         
         # Simple conversation count: 1 if thread exists, 0 otherwise
         conversation_count = 1 if db_assistant.thread_id else 0
@@ -357,27 +350,27 @@ async def update_assistant(
             description=db_assistant.description,
             instructions=db_assistant.instructions,
             model=db_assistant.model,
-            file_ids=json.loads(db_assistant.file_ids) if db_assistant.file_ids else [],
+            file_ids=await get_assistant_file_ids(db, db_assistant.id),
             tools={"file_search": False, "code_interpreter": True, "vector_store_ids": []},
             conversation_count=conversation_count,
             created_at=db_assistant.created_at.isoformat() if db_assistant.created_at else ""
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to update assistant: {str(e)}"
-        )
+        raise openai_http_error(e, f"Failed to update assistant: {str(e)}")
 
 @router.delete("/{assistant_id}")
 async def delete_assistant(
     assistant_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Delete assistant"""
     # Get assistant from database
-    db_assistant = db.query(UserAssistant).filter(
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -390,32 +383,38 @@ async def delete_assistant(
     
     try:
         # Delete from OpenAI
-        client.beta.assistants.delete(assistant_id)
+        await client.beta.assistants.delete(assistant_id)
+        await assistant_cache.invalidate(assistant_id)
         
-        # Delete from database
-        db.delete(db_assistant)
-        db.commit()
+        # Delete from database; its conversations go with it, so their usage leaves the counters too
+        messages_today, tokens = await assistant_usage(db, db_assistant.id)
+        await db.delete(db_assistant)
+        await update_user_stats(
+            db, current_user.id, assistants=-1, active_threads=-1 if db_assistant.thread_id else 0,
+            messages_today=-messages_today, tokens=-tokens
+        )
+        await db.flush()
+        await refresh_last_assistant(db, current_user.id)
+        await db.commit()
         
         return {"message": "Assistant deleted successfully"}
         
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to delete assistant: {str(e)}"
-        )
+        raise openai_http_error(e, f"Failed to delete assistant: {str(e)}")
 
 @router.delete("/{assistant_id}/files/{file_id}")
 async def remove_file_from_assistant(
     assistant_id: str,
     file_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Detach and delete a file from an assistant and storage."""
     print(f"DEBUG: Attempting to remove file {file_id} from assistant {assistant_id}")
     
     # Verify user owns the assistant
-    db_assistant = db.query(UserAssistant).filter(
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -423,7 +422,7 @@ async def remove_file_from_assistant(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assistant not found")
 
     # Verify user owns the file metadata
-    db_file_meta = db.query(FileMetadata).filter(
+    db_file_meta = await db.query(FileMetadata).filter(
         FileMetadata.file_id == file_id,
         FileMetadata.uploaded_by == current_user.id
     ).first()
@@ -432,48 +431,25 @@ async def remove_file_from_assistant(
 
     try:
         # Step 1: Update the assistant to remove the file association
-        current_file_ids = json.loads(db_assistant.file_ids) if db_assistant.file_ids else []
-        print(f"DEBUG: Current file_ids before removal: {current_file_ids}")
-        
-        if file_id in current_file_ids:
-            current_file_ids.remove(file_id)
-            print(f"DEBUG: File {file_id} removed from list. Remaining files: {current_file_ids}")
-            
-            # We still need to separate by purpose for the tool_resources update
-            db_files = db.query(FileMetadata).filter(
-                FileMetadata.file_id.in_(current_file_ids),
-                FileMetadata.uploaded_by == current_user.id
-            ).all()
-            tool_resources_file_ids = [f.file_id for f in db_files if f.purpose == 'assistants']
-            print(f"DEBUG: Files to keep in tool_resources: {tool_resources_file_ids}")
-
-            # Update OpenAI assistant's tool_resources
-            if tool_resources_file_ids:
-                print(f"DEBUG: Updating assistant with {len(tool_resources_file_ids)} files")
-                client.beta.assistants.update(
-                    assistant_id=assistant_id,
-                    tool_resources={"code_interpreter": {"file_ids": tool_resources_file_ids}}
-                )
-                print(f"DEBUG: Successfully updated assistant tool_resources")
-            else:
-                # When no files left, pass empty list explicitly
-                print(f"DEBUG: No files remaining, setting empty tool_resources")
-                client.beta.assistants.update(
-                    assistant_id=assistant_id,
-                    tool_resources={"code_interpreter": {"file_ids": []}}
-                )
-                print(f"DEBUG: Successfully cleared assistant tool_resources")
-            
-            # Update database
-            db_assistant.file_ids = json.dumps(current_file_ids)
-            print(f"DEBUG: Updated database file_ids to: {current_file_ids}")
+        # Detach just this file so concurrent attachments are preserved (no-op if not attached)
+        await tool_resources_reconciler.remove_files(client, assistant_id, [file_id])
+        print(f"DEBUG: Successfully updated assistant tool_resources")
+
+        if await detach_files(db, db_assistant.id, [file_id]):
+            print(f"DEBUG: File {file_id} removed from assistant's file list")
         else:
             print(f"DEBUG: File {file_id} was not in assistant's file list")
 
+        # Deduplicated uploads can be shared; keep the file if another assistant still uses it
+        if await is_file_attached_elsewhere(db, current_user.id, file_id, db_assistant.id):
+            print(f"DEBUG: File {file_id} is still attached to another assistant, keeping it in storage")
+            await db.commit()
+            return {"message": "File removed successfully"}
+
         # Step 2: Delete the file from OpenAI storage
         try:
             print(f"DEBUG: Attempting to delete file {file_id} from OpenAI storage")
-            client.files.delete(file_id)
+            await client.files.delete(file_id)
             print(f"DEBUG: Successfully deleted file {file_id} from OpenAI storage")
         except openai.NotFoundError:
             print(f"DEBUG: File {file_id} not found in OpenAI storage (already deleted or never existed)")
@@ -486,10 +462,11 @@ async def remove_file_from_assistant(
 
         # Step 3: Delete the file metadata from our database
         print(f"DEBUG: Deleting file metadata for {file_id} from database")
-        db.delete(db_file_meta)
+        await db.delete(db_file_meta)
         
         print(f"DEBUG: Committing all database changes")
-        db.commit()
+        await db.commit()
+        invalidate_profile_stats(current_user.id)
         print(f"DEBUG: Database commit successful")
         
         print(f"DEBUG: File {file_id} removed successfully from assistant {assistant_id}")
@@ -498,8 +475,8 @@ async def remove_file_from_assistant(
     except Exception as e:
         print(f"DEBUG: Exception occurred during file deletion: {str(e)}")
         print(f"DEBUG: Rolling back database changes")
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"An error occurred: {str(e)}"
+        await db.rollback()
+        raise openai_http_error(
+            e, f"An error occurred: {str(e)}",
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
\ No newline at end of file
@@ -2,28 +2,38 @@
 from datetime import datetime, timedelta
 from typing import Optional
 import secrets
+import time
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import make_transient_to_detached
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 
-from models.database import get_db, User
+from models.database import get_db, ThreadedSession, User
 from utils.config import settings
+from utils.ttl_cache import TTLCache
+from utils.shared_cache import shared_cache
+from utils.rate_limit import check_rate_limit
+from utils.openai_governor import set_openai_user
+from utils.passwords import hash_password, verify_and_update
+from utils.user_stats import profile_stats_cache, invalidate_profile_stats
 
 router = APIRouter()
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
+# Decoded tokens (token -> (username, user_id)) and user rows (username -> column snapshot)
+token_cache = TTLCache(settings.AUTH_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+user_cache = TTLCache(settings.AUTH_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+
+USER_INVALIDATION_CHANNEL = "user-invalidate"
+shared_cache.subscribe(USER_INVALIDATION_CHANNEL, lambda message: user_cache.pop(message["username"]))
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -40,14 +50,7 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    """Hash password"""
-    return pwd_context.hash(password)
+    user_id: Optional[int] = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT token"""
@@ -60,25 +63,109 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get current user from JWT token"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def decode_access_token(token: str) -> Optional[TokenData]:
+    """Decode and validate a JWT access token, caching the result until it expires"""
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+            return None
+        token_data = TokenData(username=username, user_id=payload.get("uid"))
     except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.username == token_data.username).first()
+        return None
+
+    ttl = payload["exp"] - time.time() if payload.get("exp") else None
+    token_cache.set(token, token_data, ttl=ttl)
+    return token_data
+
+# Kept out of snapshots so password hashes never reach the shared cache; loaded on access instead
+UNCACHED_USER_COLUMNS = {"password_hash"}
+
+def user_snapshot(user: User) -> dict:
+    """JSON-safe copy of a user's cacheable columns"""
+    snapshot = {}
+    for column in User.__table__.columns:
+        if column.key in UNCACHED_USER_COLUMNS:
+            continue
+        value = getattr(user, column.key)
+        snapshot[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return snapshot
+
+def user_from_snapshot(snapshot: dict) -> User:
+    values = dict(snapshot)
+    for key in ("created_at", "updated_at"):
+        if values.get(key):
+            values[key] = datetime.fromisoformat(values[key])
+    return User(**values)
+
+async def cache_user(user: User):
+    """Remember a freshly loaded user's columns for later requests on every instance"""
+    snapshot = user_snapshot(user)
+    user_cache.set(user.username, snapshot)
+    await shared_cache.set_json(f"user:{user.username}", snapshot, settings.AUTH_CACHE_TTL_SECONDS)
+
+async def invalidate_user(username: str):
+    """Drop a cached user everywhere after its row is updated or deleted"""
+    user_cache.pop(username)
+    await shared_cache.delete(f"user:{username}")
+    await shared_cache.publish(USER_INVALIDATION_CHANNEL, {"username": username})
+
+async def get_user_from_token(token: str, db: ThreadedSession) -> Optional[User]:
+    """Resolve a JWT access token to its user, or None if it is invalid"""
+    token_data = decode_access_token(token)
+    if token_data is None:
+        return None
+
+    snapshot = user_cache.get(token_data.username)
+    if snapshot is None:
+        snapshot = await shared_cache.get_json(f"user:{token_data.username}")
+        if snapshot is not None:
+            user_cache.set(token_data.username, snapshot)
+    if snapshot is not None:
+        # Attach the cached row to this session without a SELECT so handlers can still modify it
+        user = user_from_snapshot(snapshot)
+        make_transient_to_detached(user)
+        return db.sync_session.merge(user, load=False)  # No I/O with load=False
+
+    if token_data.user_id is not None:
+        user = await db.get(User, token_data.user_id)
+        if user is not None and user.username != token_data.username:
+            user = None
+    else:
+        user = await db.query(User).filter(User.username == token_data.username).first()
+
+    if user is not None:
+        await cache_user(user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: ThreadedSession = Depends(get_db)):
+    """Get current user from JWT token"""
+    user = await get_user_from_token(token, db)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    set_openai_user(user.id)  # OpenAI calls made for this request share the user's fair share
+    return user
+
+async def authenticate_user(db: ThreadedSession, username: str, password: str) -> Optional[User]:
+    """Check credentials, upgrading the stored hash if its work factor is outdated"""
+    user = await db.query(User).filter(User.username == username).first()
+    if not user:
+        return None
+
+    valid, new_hash = await verify_and_update(password, user.password_hash)
+    if not valid:
+        return None
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+        await invalidate_user(user.username)
     return user
 
 class RegisterRequest(BaseModel):
@@ -93,7 +180,7 @@ class AuthResponse(BaseModel):
     error: Optional[dict] = None
 
 @router.post("/register")
-async def register(register_data: RegisterRequest, db: Session = Depends(get_db)):
+async def register(register_data: RegisterRequest, db: ThreadedSession = Depends(get_db)):
     """Register new user"""
     # Validate passwords match
     if register_data.password != register_data.confirmPassword:
@@ -103,7 +190,7 @@ async def register(register_data: RegisterRequest, db: Session = Depends(get_db)
         )
     
     # Check if user exists
-    db_user = db.query(User).filter(User.username == register_data.email).first()
+    db_user = await db.query(User).filter(User.username == register_data.email).first()
     if db_user:
         return AuthResponse(
             success=False,
@@ -111,16 +198,16 @@ async def register(register_data: RegisterRequest, db: Session = Depends(get_db)
         )
     
     # Create new user
-    hashed_password = get_password_hash(register_data.password)
+    hashed_password = await hash_password(register_data.password)
     db_user = User(username=register_data.email, password_hash=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # Create token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": db_user.username}, expires_delta=access_token_expires
+        data={"sub": db_user.username, "uid": db_user.id}, expires_delta=access_token_expires
     )
     
     return AuthResponse(
@@ -140,10 +227,11 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/login")
-async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
+async def login(login_data: LoginRequest, db: ThreadedSession = Depends(get_db)):
     """Login user"""
-    user = db.query(User).filter(User.username == login_data.email).first()
-    if not user or not verify_password(login_data.password, user.password_hash):
+    await check_rate_limit("login", login_data.email.lower(), settings.LOGIN_RATE_LIMIT)
+    user = await authenticate_user(db, login_data.email, login_data.password)
+    if not user:
         return AuthResponse(
             success=False,
             error={"message": "Invalid email or password"}
@@ -151,7 +239,7 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     
     return AuthResponse(
@@ -167,10 +255,11 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     )
 
 @router.post("/token", response_model=Token)
-async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: ThreadedSession = Depends(get_db)):
     """OAuth2 token endpoint for Swagger UI"""
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    await check_rate_limit("login", form_data.username.lower(), settings.LOGIN_RATE_LIMIT)
+    user = await authenticate_user(db, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -179,7 +268,7 @@ async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -198,10 +287,12 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
     )
 
 @router.delete("/account")
-async def delete_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_account(current_user: User = Depends(get_current_user), db: ThreadedSession = Depends(get_db)):
     """Delete user account"""
-    db.delete(current_user)
-    db.commit()
+    await db.delete(current_user)
+    await db.commit()
+    await invalidate_user(current_user.username)
+    invalidate_profile_stats(current_user.id)
     return {"message": "Account deleted successfully"}
 
 # Temporary endpoint for testing - remove in production
@@ -307,11 +398,11 @@ async def send_password_reset_email(email: str, reset_url: str, background_tasks
 async def forgot_password(
     request: ForgotPasswordRequest,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """Request password reset"""
     # Check if user exists
-    user = db.query(User).filter(User.username == request.email).first()
+    user = await db.query(User).filter(User.username == request.email).first()
 
     # Always return success to prevent email enumeration
     if user:
@@ -333,7 +424,7 @@ async def forgot_password(
 @router.post("/reset-password")
 async def reset_password(
     request: ResetPasswordRequest,
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """Reset password with token"""
     print(f"DEBUG: Reset password request received")
@@ -351,7 +442,7 @@ async def reset_password(
     print(f"DEBUG: Token verified for email: {email}")
 
     # Find user
-    user = db.query(User).filter(User.username == email).first()
+    user = await db.query(User).filter(User.username == email).first()
     if not user:
         print(f"DEBUG: User not found for email: {email}")
         raise HTTPException(
@@ -362,8 +453,9 @@ async def reset_password(
     print(f"DEBUG: User found: {user.id}, updating password")
 
     # Update password
-    user.password_hash = get_password_hash(request.password)
-    db.commit()
+    user.password_hash = await hash_password(request.password)
+    await db.commit()
+    await invalidate_user(user.username)
 
     print(f"DEBUG: Password updated successfully for user: {email}")
 
@@ -373,24 +465,29 @@ async def reset_password(
     )
 
 @router.delete("/reset-all-users-test-only")
-async def reset_all_users(db: Session = Depends(get_db)):
+async def reset_all_users(db: ThreadedSession = Depends(get_db)):
     """Delete all users and related data - FOR TESTING ONLY"""
     try:
-        from models.database import UserAssistant, Assistant, Conversation, ConversationMessage, FileMetadata
+        from models.database import UserAssistant, AssistantFile, UserStats, ChatJob, Assistant, Conversation, ConversationMessage, FileMetadata
 
         # Get count before deletion
-        user_count = db.query(User).count()
+        user_count = await db.query(User).count()
 
         # Delete in order to respect foreign key constraints
-        db.query(ConversationMessage).delete()
-        db.query(Conversation).delete()
-        db.query(FileMetadata).delete()
-        db.query(Assistant).delete()
-        db.query(UserAssistant).delete()
-        db.query(User).delete()
-
-        db.commit()
+        await db.query(ConversationMessage).delete()
+        await db.query(Conversation).delete()
+        await db.query(ChatJob).delete()
+        await db.query(FileMetadata).delete()
+        await db.query(Assistant).delete()
+        await db.query(AssistantFile).delete()
+        await db.query(UserAssistant).delete()
+        await db.query(UserStats).delete()
+        await db.query(User).delete()
+
+        await db.commit()
+        user_cache.clear()
+        profile_stats_cache.clear()
         return {"success": True, "message": f"Deleted {user_count} users and all related data"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return {"success": False, "error": str(e)}
\ No newline at end of file
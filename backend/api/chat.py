@@ -1,18 +1,34 @@
-"Chat endpoints for non-streaming HTTP communication"
-import json
+"Chat endpoints for HTTP and server-sent event (SSE) communication"
 import asyncio
-from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import json
+import weakref
+from typing import Optional, List, Set
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Query, Header
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from models.database import get_db, User, UserAssistant, FileMetadata
-from api.auth import get_current_user
+from models.database import get_db, new_session, User, UserAssistant, ChatJob, ThreadedSession
+from api.auth import get_current_user, get_user_from_token
+from utils.openai_client import get_openai_client
+from utils.websocket import manager
+from utils.user_stats import update_user_stats
+from utils.rate_limit import check_rate_limit
+from utils.idempotency import run_idempotent, request_fingerprint
+from utils.openai_governor import set_openai_user, openai_http_error, busy_error
 from utils.config import settings
+from utils.message_store import (
+    get_or_create_conversation, ensure_synced, get_message_page, format_message, DEFAULT_PAGE_SIZE
+)
+from utils.thread_runs import Turn, submit_user_message
+from utils.chat_jobs import create_chat_job, format_job, chat_job_queue
 
 router = APIRouter()
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+ws_router = APIRouter()
+
+# Turns submitted over WebSockets, and the tasks relaying their events (kept so they are not collected)
+_websocket_turns: "weakref.WeakSet[Turn]" = weakref.WeakSet()
+_websocket_relays: Set[asyncio.Task] = set()
 
 class ChatMessage(BaseModel):
     content: str
@@ -28,15 +44,15 @@ class ChatResponse(BaseModel):
     content: str
     attachments: Optional[List[ImageAttachment]] = None
 
-@router.post("/message")
-async def send_message(
-    message: ChatMessage,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_assistant_thread(
+    assistant_id: str,
+    current_user: User,
+    db: ThreadedSession,
+    client: AsyncOpenAI
 ):
-    """Send message to assistant (non-streaming) - MMACTEMP Pattern"""
-    db_assistant = db.query(UserAssistant).filter(
-        UserAssistant.assistant_id == message.assistant_id,
+    """Look up the user's assistant and make sure it has a thread"""
+    db_assistant = await db.query(UserAssistant).filter(
+        UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
     
@@ -49,185 +65,171 @@ async def send_message(
     thread_id = db_assistant.thread_id
     if not thread_id:
         try:
-            thread = client.beta.threads.create()
+            thread = await client.beta.threads.create()
             thread_id = thread.id
             db_assistant.thread_id = thread_id
-            db.commit()
+            await update_user_stats(db, current_user.id, active_threads=1)
+            await db.commit()
         except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to create thread: {str(e)}"
+            raise openai_http_error(
+                e, f"Failed to create thread: {str(e)}",
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    try:
-        # Correctly initialize lists
-        message_content = [{"type": "text", "text": message.content}]
-        image_file_ids = []
-        file_ids_for_code_interpreter = []
-        
-        all_assistant_file_ids = json.loads(db_assistant.file_ids) if db_assistant.file_ids else []
-        combined_file_ids = list(set(all_assistant_file_ids + (message.file_ids or [])))
-
-        # Track new assistant files that need to be attached to the OpenAI assistant
-        new_assistant_files = []
-        if message.file_ids:
-            for file_id in message.file_ids:
-                if file_id not in all_assistant_file_ids:
-                    new_assistant_files.append(file_id)
-
-        if combined_file_ids:
-            db_files = db.query(FileMetadata).filter(
-                FileMetadata.file_id.in_(combined_file_ids),
-                FileMetadata.uploaded_by == current_user.id
-            ).all()
-            for f in db_files:
-                is_image = (f.mime_type and f.mime_type.startswith('image/')) or f.purpose == 'vision'
-                if is_image:
-                    if f.file_id not in image_file_ids:
-                         image_file_ids.append(f.file_id)
-                elif f.purpose == 'assistants':
-
-                    if f.file_id not in file_ids_for_code_interpreter:
-                        file_ids_for_code_interpreter.append(f.file_id)
-        
-        # Update OpenAI assistant with new files (attach to code_interpreter tool_resources)
-        if new_assistant_files:
-            new_assistant_db_files = db.query(FileMetadata).filter(
-                FileMetadata.file_id.in_(new_assistant_files),
-                FileMetadata.uploaded_by == current_user.id,
-                FileMetadata.purpose == 'assistants'
-            ).all()
-            
-            if new_assistant_db_files:
-                try:
-                    # Get current assistant file_ids from OpenAI
-                    openai_assistant = client.beta.assistants.retrieve(message.assistant_id)
-                    current_openai_file_ids = []
-                    if (hasattr(openai_assistant, 'tool_resources') and openai_assistant.tool_resources and 
-                        hasattr(openai_assistant.tool_resources, 'code_interpreter') and 
-                        openai_assistant.tool_resources.code_interpreter and
-                        hasattr(openai_assistant.tool_resources.code_interpreter, 'file_ids')):
-                        current_openai_file_ids = openai_assistant.tool_resources.code_interpreter.file_ids or []
-                    
-                    # Add new assistant files to OpenAI assistant
-                    assistant_file_ids_to_add = [f.file_id for f in new_assistant_db_files 
-                                               if f.file_id not in current_openai_file_ids]
-                    
-                    if assistant_file_ids_to_add:
-                        updated_file_ids = list(set(current_openai_file_ids + assistant_file_ids_to_add))
-                        client.beta.assistants.update(
-                            assistant_id=message.assistant_id,
-                            tool_resources={"code_interpreter": {"file_ids": updated_file_ids}}
-                        )
-                        print(f"DEBUG: Added {len(assistant_file_ids_to_add)} new files to assistant {message.assistant_id}")
-                        
-                        # Update database to track the new files
-                        updated_all_file_ids = list(set(all_assistant_file_ids + [f.file_id for f in new_assistant_db_files]))
-                        db_assistant.file_ids = json.dumps(updated_all_file_ids)
-                        db.commit()
-                        
-                except Exception as e:
-                    print(f"DEBUG: Failed to update assistant with new files: {str(e)}")
-                    # Continue with the chat even if file attachment fails
-        
-        for image_file_id in image_file_ids:
-            if message.file_ids and image_file_id in message.file_ids:
-                message_content.append({"type": "image_file", "image_file": {"file_id": image_file_id}})
-        
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message_content
-        )
-        
-        # Note: tool_resources parameter is not supported in current OpenAI client
-        # Code interpreter files are managed at the assistant level, not run level
-        print(f"DEBUG: Creating run for thread {thread_id} with assistant {message.assistant_id}")
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=message.assistant_id
+    return db_assistant, thread_id
+
+@router.post("/message")
+async def send_message(
+    message: ChatMessage,
+    background: bool = Query(False, description="Queue the run and return a job id instead of waiting for the reply"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """Send message to assistant (non-streaming) - MMACTEMP Pattern
+
+    With ``background=true`` the run is executed by a job worker; poll
+    ``/jobs/{job_id}`` or listen on the assistant's WebSocket for the reply.
+    A retry with the same ``Idempotency-Key`` gets the first attempt's
+    result instead of posting the message and starting another run.
+    """
+    return await run_idempotent(
+        "chat-message", current_user.id, idempotency_key,
+        request_fingerprint(message.dict(), background),
+        lambda: _send_message(message, background, current_user, db, client)
+    )
+
+async def _send_message(
+    message: ChatMessage,
+    background: bool,
+    current_user: User,
+    db: ThreadedSession,
+    client: AsyncOpenAI
+):
+    await check_rate_limit("chat", current_user.id, settings.CHAT_RATE_LIMIT)
+    db_assistant, thread_id = await get_assistant_thread(message.assistant_id, current_user, db, client)
+    
+    if background:
+        job = None
+        try:
+            job = await create_chat_job(db, db_assistant, message.content, message.file_ids)
+            await chat_job_queue.enqueue(job.id)
+        except Exception as e:
+            if job is not None:
+                job.status = "failed"
+                job.error = f"Failed to queue run: {str(e)}"
+                await db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Failed to send message: {str(e)}"
+            )
+        print(f"DEBUG: Queued chat job {job.id} for thread {thread_id}")
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"success": True, "data": format_job(job)}
         )
-        print(f"DEBUG: Run created successfully: {run.id}")
-        
-        while True:
-            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-            if run.status in ("completed", "failed", "cancelled", "expired"):
-                break
-            await asyncio.sleep(0.5)
-        
-        if run.status == "completed":
-            # Retrieve more messages to handle multi-part responses
-            messages = client.beta.threads.messages.list(thread_id=thread_id, limit=20)
-            
-            # Find the assistant's response messages after the user's message
-            assistant_messages = []
-            for msg in messages.data:
-                if msg.role == 'assistant':
-                    assistant_messages.append(msg)
-                    # Stop at the first assistant message for this run
-                    if len(assistant_messages) == 1:
-                        break
-            
-            if assistant_messages:
-                # Aggregate all content from the assistant's response
-                all_content_parts = []
-                all_image_attachments = []
-                total_chars = 0
-                
-                for assistant_msg in assistant_messages:
-                    for content in assistant_msg.content:
-                        if content.type == 'text':
-                            text_value = content.text.value
-                            all_content_parts.append(text_value)
-                            total_chars += len(text_value)
-                        elif content.type == 'image_file':
-                            all_image_attachments.append(ImageAttachment(
-                                file_id=content.image_file.file_id,
-                                type="image"
-                            ))
-                
-                # Log response size for monitoring
-                aggregated_content = '\n'.join(all_content_parts)
-                print(f"DEBUG: Response size - Messages: {len(assistant_messages)}, "
-                      f"Parts: {len(all_content_parts)}, "
-                      f"Total chars: {total_chars}, "
-                      f"Images: {len(all_image_attachments)}")
-                
-                # Log if response is particularly large
-                if total_chars > 10000:
-                    print(f"INFO: Large response generated - {total_chars} characters for thread {thread_id}")
-                
-                return {
-                    "success": True,
-                    "data": ChatResponse(
-                        message_id=assistant_messages[0].id,
-                        content=aggregated_content,
-                        attachments=all_image_attachments or None
-                    ).dict()
-                }
-        
+
+    # Waits behind any run already active on the thread and may share the next one
+    # with other messages sent meanwhile
+    print(f"DEBUG: Queueing message for thread {thread_id} with assistant {message.assistant_id}")
+    turn = submit_user_message(client, db_assistant, message.content, message.file_ids)
+    final = await turn.wait()
+    if final.get("retry_after"):
+        raise busy_error(final["retry_after"])
+    if final["type"] != "complete":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Run failed with status: {run.status}"
+            detail=final["message"]
         )
-        
-    except Exception as e:
+    if not final["message_id"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to send message: {str(e)}"
+            detail="Run completed without a reply"
         )
 
+    # Log response size for monitoring
+    attachments = final["attachments"] or []
+    total_chars = len(final["content"])
+    print(f"DEBUG: Response size - Total chars: {total_chars}, Images: {len(attachments)}")
+
+    # Log if response is particularly large
+    if total_chars > 10000:
+        print(f"INFO: Large response generated - {total_chars} characters for thread {thread_id}")
+
+    return {
+        "success": True,
+        "data": ChatResponse(
+            message_id=final["message_id"],
+            content=final["content"],
+            attachments=[ImageAttachment(**a) for a in attachments] or None
+        ).dict()
+    }
+
+def format_sse(event: dict) -> str:
+    """Format a chat event as a server-sent event frame"""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@router.post("/message/stream")
+async def send_message_stream(
+    message: ChatMessage,
+    current_user: User = Depends(get_current_user),
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """Send message to assistant and stream the reply as server-sent events"""
+    await check_rate_limit("chat", current_user.id, settings.CHAT_RATE_LIMIT)
+    db_assistant, thread_id = await get_assistant_thread(message.assistant_id, current_user, db, client)
+
+    # The message is posted once the thread is free; failures arrive as an error event
+    turn = submit_user_message(client, db_assistant, message.content, message.file_ids, stream=True)
+
+    async def event_stream():
+        async for event in turn.events():
+            yield format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable nginx response buffering
+        }
+    )
+
 class NewThreadRequest(BaseModel):
     assistant_id: str
 
+@router.get("/jobs/{job_id}")
+async def get_chat_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: ThreadedSession = Depends(get_db)
+):
+    """Get a background chat run's status, and the reply once it has completed"""
+    job = await db.query(ChatJob).filter(
+        ChatJob.id == job_id,
+        ChatJob.user_id == current_user.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return {"success": True, "data": format_job(job)}
+
 @router.get("/messages/{assistant_id}")
 async def get_thread_messages(
     assistant_id: str,
+    before: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
-    """Fetch message history for an assistant's thread."""
-    db_assistant = db.query(UserAssistant).filter(
+    """Fetch message history for an assistant's thread from the local store.
+
+    Returns the newest ``limit`` messages (oldest first); pass the returned
+    ``next_cursor`` as ``before`` to page back through older history.
+    """
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -241,68 +243,42 @@ async def get_thread_messages(
             "success": True,
             "data": {
                 "thread_id": None,
-                "messages": []
+                "messages": [],
+                "next_cursor": None
             }
         }
 
     try:
-        # Fetch messages from OpenAI thread
-        messages = client.beta.threads.messages.list(
-            thread_id=db_assistant.thread_id,
-            limit=50,  # Fetch last 50 messages
-            order="asc"  # Oldest first for chronological display
-        )
+        conversation = await get_or_create_conversation(db, db_assistant)
+        # Threads created before the local store existed are backfilled once
+        await ensure_synced(db, client, conversation)
 
-        # Format messages for frontend
-        formatted_messages = []
-        for msg in messages.data:
-            message_content = ""
-            image_attachments = []
-
-            # Extract text and image content
-            for content in msg.content:
-                if content.type == 'text':
-                    message_content += content.text.value
-                elif content.type == 'image_file':
-                    image_attachments.append({
-                        "file_id": content.image_file.file_id,
-                        "type": "image"
-                    })
-
-            # Convert Unix timestamp to ISO string for frontend
-            from datetime import datetime
-            created_at_iso = datetime.fromtimestamp(msg.created_at).isoformat()
-
-            formatted_messages.append({
-                "id": msg.id,
-                "role": msg.role,
-                "content": message_content,
-                "created_at": created_at_iso,
-                "attachments": image_attachments if image_attachments else None
-            })
+        rows, next_cursor = await get_message_page(db, conversation, before=before, limit=limit)
 
         return {
             "success": True,
             "data": {
                 "thread_id": db_assistant.thread_id,
-                "messages": formatted_messages
+                "messages": [format_message(row) for row in rows],
+                "next_cursor": next_cursor
             }
         }
     except Exception as e:
         print(f"DEBUG: Failed to fetch thread messages: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to fetch messages: {str(e)}"
+        raise openai_http_error(
+            e, f"Failed to fetch messages: {str(e)}",
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
 @router.post("/new-thread")
 async def create_new_thread(
     request: NewThreadRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Create a new thread for a specific assistant."""
-    db_assistant = db.query(UserAssistant).filter(
+    db_assistant = await db.query(UserAssistant).filter(
         UserAssistant.assistant_id == request.assistant_id,
         UserAssistant.user_id == current_user.id
     ).first()
@@ -311,9 +287,11 @@ async def create_new_thread(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assistant not found")
 
     try:
-        thread = client.beta.threads.create()
+        thread = await client.beta.threads.create()
+        if not db_assistant.thread_id:
+            await update_user_stats(db, current_user.id, active_threads=1)
         db_assistant.thread_id = thread.id
-        db.commit()
+        await db.commit()
 
         return {
             "success": True,
@@ -322,4 +300,103 @@ async def create_new_thread(
             "message": "New thread created successfully"
         }
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create new thread: {str(e)}")
+        raise openai_http_error(e, f"Failed to create new thread: {str(e)}")
+
+@ws_router.websocket("/chat/{assistant_id}")
+async def chat_websocket(
+    websocket: WebSocket,
+    assistant_id: str,
+    token: str = Query(...),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """Chat over a WebSocket, streaming run events to every tab open on the assistant.
+
+    The JWT is passed as a ``token`` query parameter (browsers cannot set
+    headers on WebSocket upgrades) and validated once on connect. Clients send
+    ``{"type": "send-message", "content": ..., "file_ids": [...]}`` and
+    ``{"type": "ping"}``; run events use the same shapes as the SSE endpoint.
+    """
+    db = new_session()
+    try:
+        current_user = await get_user_from_token(token, db)
+        db_assistant = None
+        if current_user:
+            db_assistant = await db.query(UserAssistant).filter(
+                UserAssistant.assistant_id == assistant_id,
+                UserAssistant.user_id == current_user.id
+            ).first()
+        user_id = current_user.id if current_user else None
+        thread_id = db_assistant.thread_id if db_assistant else None
+    finally:
+        await db.close()
+
+    if not db_assistant:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await manager.connect(websocket, assistant_id)
+    await manager.send_json_message({
+        "type": "connection",
+        "status": "connected",
+        "assistant_id": assistant_id,
+        "thread_id": thread_id
+    }, websocket)
+
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") == "ping":
+                await manager.send_json_message({"type": "pong"}, websocket)
+            elif data.get("type") == "send-message":
+                message = ChatMessage(
+                    content=data.get("content", ""),
+                    assistant_id=assistant_id,
+                    file_ids=data.get("file_ids")
+                )
+                await manager.broadcast_to_conversation(assistant_id, {
+                    "type": "user_message",
+                    "content": message.content,
+                    "file_ids": message.file_ids
+                })
+                # Submitted in order here, then relayed in the background so messages sent
+                # during a run can join the next one
+                turn = await _submit_websocket_message(message, user_id, client)
+                if turn is not None:
+                    relay = asyncio.create_task(_relay_websocket_turn(assistant_id, turn))
+                    _websocket_relays.add(relay)
+                    relay.add_done_callback(_websocket_relays.discard)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"DEBUG: WebSocket error for assistant {assistant_id}: {str(e)}")
+    finally:
+        manager.disconnect(websocket, assistant_id)
+
+async def _submit_websocket_message(message: ChatMessage, user_id: int, client: AsyncOpenAI) -> Optional[Turn]:
+    """Queue a WebSocket chat message for its thread's next run; None if it was rejected"""
+    assistant_id = message.assistant_id
+    # Use a short-lived session per message instead of pinning a pooled connection to the socket
+    db = new_session()
+    try:
+        await check_rate_limit("chat", user_id, settings.CHAT_RATE_LIMIT)
+        set_openai_user(user_id)
+        current_user = await db.query(User).filter(User.id == user_id).first()
+        db_assistant, thread_id = await get_assistant_thread(assistant_id, current_user, db, client)
+        turn = submit_user_message(client, db_assistant, message.content, message.file_ids, stream=True)
+        _websocket_turns.add(turn)
+    except HTTPException as e:
+        await manager.broadcast_to_conversation(assistant_id, {"type": "error", "message": e.detail})
+        return None
+    except Exception as e:
+        await manager.broadcast_to_conversation(assistant_id, {"type": "error", "message": f"Failed to send message: {str(e)}"})
+        return None
+    finally:
+        await db.close()
+    return turn
+
+async def _relay_websocket_turn(assistant_id: str, turn: Turn):
+    """Fan a WebSocket message's run events out to the conversation"""
+    async for event in turn.events():
+        # Every tab gets a shared run's events, so only its first WebSocket turn relays them
+        if next((t for t in turn.batch if t in _websocket_turns), turn) is turn:
+            await manager.broadcast_to_conversation(assistant_id, event)
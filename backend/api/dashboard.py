@@ -1,55 +1,43 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
 from typing import Any, List, Dict
 
-from models.database import get_db, User, UserAssistant
+from models.database import get_db, User, ThreadedSession
 from api.auth import get_current_user
+from utils.user_stats import load_user_stats, utc_today
 
 router = APIRouter()
 
 @router.get("/stats")
-async def get_dashboard_stats(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_dashboard_stats(db: ThreadedSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
-    Get dashboard statistics for the current user using the legacy UserAssistant model.
+    Get dashboard statistics for the current user from the user_stats counters row.
     """
-    user_id = current_user.id
+    stats = await load_user_stats(db, current_user.id)
 
-    # Get total assistants from the legacy table
-    total_assistants = db.query(UserAssistant).filter(UserAssistant.user_id == user_id).count()
-
-    # Count assistants with active threads (conversation_count > 0)
-    active_assistants = db.query(UserAssistant).filter(
-        UserAssistant.user_id == user_id,
-        UserAssistant.thread_id.isnot(None)
-    ).count()
-
-    # Placeholder values for other stats
-    messages_today = 0
-    api_usage = "N/A"
+    # The counter is only reset by the next message, so a stale day means none today
+    messages_today = stats.messages_today if stats.messages_day == utc_today() else 0
 
     # Get recent activity
     recent_activity: List[Dict[str, Any]] = []
-    
-    # Find the last assistant created from the legacy table
-    last_assistant = db.query(UserAssistant).filter(UserAssistant.user_id == user_id).order_by(desc(UserAssistant.created_at)).first()
-    if last_assistant:
+
+    # The last assistant created from the legacy table
+    if stats.last_assistant_id is not None:
         recent_activity.append({
-            "id": f"asst-{last_assistant.id}",
+            "id": f"asst-{stats.last_assistant_id}",
             "title": "New assistant created",
-            "description": f"Created \"{last_assistant.name}\"",
-            "timestamp": last_assistant.created_at.isoformat(),
+            "description": f"Created \"{stats.last_assistant_name}\"",
+            "timestamp": stats.last_assistant_created_at.isoformat() if stats.last_assistant_created_at else "",
         })
-        
+
     # Sort activity by timestamp descending
     recent_activity.sort(key=lambda x: x['timestamp'], reverse=True)
 
     return {
         "stats": {
-            "totalAssistants": total_assistants,
-            "activeChats": active_assistants,  # Count of assistants with active threads
+            "totalAssistants": stats.assistant_count,
+            "activeChats": stats.active_thread_count,  # Count of assistants with active threads
             "messagesToday": messages_today,
-            "apiUsage": api_usage,
+            "apiUsage": f"{stats.tokens_used:,} tokens",
         },
         "recentActivity": recent_activity[:5], # Return latest 5 activities
     }
@@ -1,22 +1,28 @@
 """File management endpoints with image upload support"""
 import os
-import io
-import uuid
-import json
+import asyncio
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Response
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Header, Request, Response
+from fastapi.responses import FileResponse as DiskFileResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from openai import OpenAI
+from starlette.concurrency import run_in_threadpool
+from openai import AsyncOpenAI
 from PIL import Image
 import base64
 
-from models.database import get_db, User, FileMetadata, UserAssistant
+from models.database import get_db, User, FileMetadata, FilePreview, UserAssistant, ThreadedSession
 from api.auth import get_current_user
+from utils.openai_client import get_openai_client
+from utils.tool_resources import tool_resources_reconciler
+from utils.assistant_files import attach_files, detach_files, get_assistants_with_file
+from utils.blob_cache import blob_cache, etag_matches, parse_byte_range, iter_file_range, RangeNotSatisfiable
 from utils.config import settings
+from utils.thumbnails import generate_thumbnail, copy_to_temp_file
+from utils.uploads import upload_size, check_upload_size, upload_sha256, upload_to_openai
+from utils.user_stats import invalidate_profile_stats
+from utils.idempotency import run_idempotent, request_fingerprint
 
 router = APIRouter()
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 # Supported image formats
 SUPPORTED_IMAGE_TYPES = {
@@ -50,17 +56,71 @@ class ImageAttachmentResponse(BaseModel):
     height: Optional[int] = None
     uploaded_at: str
 
+async def find_duplicate_file(
+    db: ThreadedSession,
+    user_id: int,
+    content_hash: str,
+    purpose: str
+) -> Optional[FileMetadata]:
+    """Find a file the user already uploaded with the same content and purpose"""
+    return await db.query(FileMetadata).filter(
+        FileMetadata.uploaded_by == user_id,
+        FileMetadata.content_hash == content_hash,
+        FileMetadata.purpose == purpose
+    ).first()
 
+async def start_thumbnail(file: UploadFile, file_size: int) -> Optional[asyncio.Future]:
+    """Start rendering a thumbnail for an image upload in the background.
+
+    The spool file is copied to disk in chunks before returning, so the
+    worker can open the image itself and the OpenAI upload can read the
+    spool file afterwards without the two readers moving each other's offset.
+    """
+    if file.content_type not in SUPPORTED_IMAGE_TYPES or file_size > settings.THUMBNAIL_MAX_SOURCE_BYTES:
+        return None
+    image_path = await run_in_threadpool(copy_to_temp_file, file.file)
+    return asyncio.ensure_future(generate_thumbnail(image_path, delete=True))
+
+async def attach_thumbnail(db_file: FileMetadata, thumbnail_task: Optional[asyncio.Future]):
+    """Record image dimensions and store the preview bytes on a new FileMetadata row"""
+    if thumbnail_task is None:
+        return
+    thumbnail = await thumbnail_task
+    if thumbnail is None:
+        return
+    db_file.width = thumbnail.width
+    db_file.height = thumbnail.height
+    db_file.preview = FilePreview(media_type=thumbnail.media_type, data=thumbnail.data)
 
 @router.post("/upload-for-assistant", response_model=FileResponse)
 async def upload_file_for_assistant(
     file: UploadFile = File(...),
     purpose: Optional[str] = Form(None),  # Accept purpose from frontend
     assistant_id: Optional[str] = Form(None),  # Assistant to attach file to
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """Upload file for assistant use (images and documents) - MMACTEMP pattern
+
+    A retry with the same ``Idempotency-Key`` gets the first attempt's result
+    instead of uploading the file again.
+    """
+    return await run_idempotent(
+        "upload-for-assistant", current_user.id, idempotency_key,
+        request_fingerprint(file.filename, file.content_type, upload_size(file), purpose, assistant_id),
+        lambda: _upload_file_for_assistant(file, purpose, assistant_id, current_user, db, client)
+    )
+
+async def _upload_file_for_assistant(
+    file: UploadFile,
+    purpose: Optional[str],
+    assistant_id: Optional[str],
+    current_user: User,
+    db: ThreadedSession,
+    client: AsyncOpenAI
 ):
-    """Upload file for assistant use (images and documents) - MMACTEMP pattern"""
     # Determine file types
     is_image = file.content_type in SUPPORTED_IMAGE_TYPES
     is_document = file.content_type in SUPPORTED_DOCUMENT_TYPES
@@ -78,94 +138,62 @@ async def upload_file_for_assistant(
     # Log for debugging
     print(f"DEBUG: Assistant file upload - filename: {file.filename}, purpose: {purpose}, content_type: {file.content_type}, assistant_id: {assistant_id}")
     
-    # Read file contents
-    contents = await file.read()
-    file_size = len(contents)
+    # The body is already spooled to disk; validate its size without reading it
+    file_size = upload_size(file)
+    check_upload_size(file_size)
     
-    # Validate file size (25MB limit like MMACTEMP)
-    max_size = 25 * 1024 * 1024  # 25MB
-    if file_size > max_size:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="File size exceeds 25MB limit"
-        )
+    # Reuse an identical file this user already uploaded instead of creating another copy
+    file_hash = await upload_sha256(file)
+    existing_file = await find_duplicate_file(db, current_user.id, file_hash, purpose)
     
     try:
-        # Create file-like object for OpenAI upload
-        file_obj = io.BytesIO(contents)
-        file_obj.name = file.filename or f"file_{uuid.uuid4().hex}"
-
-        # Upload to OpenAI Files API with correct purpose
-        # Images use 'vision' (allows downloading), documents use 'assistants' (for code_interpreter)
-        openai_purpose = 'vision' if is_image else 'assistants'
-        openai_file = client.files.create(
-            file=file_obj,
-            purpose=openai_purpose
-        )
-        print(f"DEBUG: File uploaded to OpenAI - file_id: {openai_file.id}, filename: {openai_file.filename}")
-        
-        # Save metadata to database (minimal metadata for assistant files)
-        db_file = FileMetadata(
-            file_id=openai_file.id,
-            original_name=file.filename,
-            size=file_size,
-            mime_type=file.content_type,
-            purpose=purpose,
-            uploaded_by=current_user.id
-        )
-        db.add(db_file)
-        db.commit()
+        if existing_file:
+            openai_file_id = existing_file.file_id
+            print(f"DEBUG: Reusing existing OpenAI file {openai_file_id} with identical content")
+        else:
+            # Render the thumbnail in a worker process while the upload is in flight
+            thumbnail_task = await start_thumbnail(file, file_size)
+
+            # Upload to OpenAI Files API with correct purpose
+            # Images use 'vision' (allows downloading), documents use 'assistants' (for code_interpreter)
+            openai_purpose = 'vision' if is_image else 'assistants'
+            openai_file = await upload_to_openai(client, file, openai_purpose, file_size)
+            openai_file_id = openai_file.id
+            print(f"DEBUG: File uploaded to OpenAI - file_id: {openai_file.id}, filename: {openai_file.filename}")
+            
+            # Save metadata to database (minimal metadata for assistant files)
+            db_file = FileMetadata(
+                file_id=openai_file.id,
+                original_name=file.filename,
+                size=file_size,
+                mime_type=file.content_type,
+                purpose=purpose,
+                content_hash=file_hash,
+                uploaded_by=current_user.id
+            )
+            await attach_thumbnail(db_file, thumbnail_task)
+            db.add(db_file)
+            await db.commit()
+            invalidate_profile_stats(current_user.id)
         
         # Attach file to assistant tool_resources.code_interpreter.file_ids (CRITICAL for assistant to access files)
         if assistant_id and purpose == 'assistants':
             try:
                 # Verify user owns the assistant
-                db_assistant = db.query(UserAssistant).filter(
+                db_assistant = await db.query(UserAssistant).filter(
                     UserAssistant.assistant_id == assistant_id,
                     UserAssistant.user_id == current_user.id
                 ).first()
 
                 if db_assistant:
-                    # Get current assistant file_ids from OpenAI
-                    try:
-                        print(f"DEBUG: Retrieving assistant {assistant_id} to get current file_ids")
-                        openai_assistant = client.beta.assistants.retrieve(assistant_id)
-                        current_openai_file_ids = []
-                        if (hasattr(openai_assistant, 'tool_resources') and openai_assistant.tool_resources and
-                            hasattr(openai_assistant.tool_resources, 'code_interpreter') and
-                            openai_assistant.tool_resources.code_interpreter and
-                            hasattr(openai_assistant.tool_resources.code_interpreter, 'file_ids')):
-                            current_openai_file_ids = openai_assistant.tool_resources.code_interpreter.file_ids or []
-                        print(f"DEBUG: Current assistant file_ids: {current_openai_file_ids}")
-                    except Exception as e:
-                        print(f"DEBUG: Failed to retrieve assistant {assistant_id}: {str(e)}")
-                        # If we can't retrieve the assistant, assume no existing files
-                        current_openai_file_ids = []
-
-                    # Add new file to OpenAI assistant if not already there
-                    if openai_file.id not in current_openai_file_ids:
-                        updated_file_ids = current_openai_file_ids + [openai_file.id]
-                        print(f"DEBUG: Updating assistant {assistant_id} tool_resources with file_ids: {updated_file_ids}")
-                        try:
-                            client.beta.assistants.update(
-                                assistant_id=assistant_id,
-                                tool_resources={"code_interpreter": {"file_ids": updated_file_ids}}
-                            )
-                            print(f"DEBUG: Successfully updated assistant {assistant_id} with file {openai_file.id}")
-                        except Exception as e:
-                            print(f"DEBUG: Failed to update assistant {assistant_id} tool_resources: {str(e)}")
-                            raise
-
-                        # Update database to track the new file
-                        db_file_ids = json.loads(db_assistant.file_ids) if db_assistant.file_ids else []
-                        if openai_file.id not in db_file_ids:
-                            updated_db_file_ids = db_file_ids + [openai_file.id]
-                            db_assistant.file_ids = json.dumps(updated_db_file_ids)
-                            db.commit()
-
-                        print(f"DEBUG: Attached file {openai_file.id} to assistant {assistant_id}")
-                    else:
-                        print(f"DEBUG: File {openai_file.id} already attached to assistant {assistant_id}")
+                    # Coalesced with concurrent changes to this assistant; no-op if already attached
+                    await tool_resources_reconciler.add_files(client, assistant_id, [openai_file_id])
+
+                    # Update database to track the new file
+                    await attach_files(db, db_assistant.id, [openai_file_id])
+                    await db.commit()
+
+                    print(f"DEBUG: Attached file {openai_file_id} to assistant {assistant_id}")
                 else:
                     print(f"DEBUG: Assistant {assistant_id} not found or not owned by user")
 
@@ -174,46 +202,172 @@ async def upload_file_for_assistant(
                 # Don't fail the upload if assistant attachment fails
         
         return FileResponse(
-            file_id=openai_file.id,
+            file_id=openai_file_id,
             filename=file.filename or "unknown",
             size=file_size,
             purpose=purpose
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Failed to upload file: {str(e)}"
         )
 
+class BatchUploadFailure(BaseModel):
+    filename: str
+    error: str
+
+class BatchUploadResponse(BaseModel):
+    files: List[FileResponse]
+    failed: List[BatchUploadFailure]
+    attached_to_assistant: bool = False
+
+@router.post("/upload-batch-for-assistant", response_model=BatchUploadResponse)
+async def upload_files_for_assistant(
+    files: List[UploadFile] = File(...),
+    assistant_id: Optional[str] = Form(None),  # Assistant to attach the documents to
+    current_user: User = Depends(get_current_user),
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """Upload several files concurrently and attach them with a single assistant update"""
+    if len(files) > settings.UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.UPLOAD_BATCH_MAX_FILES} files can be uploaded at once"
+        )
+    for file in files:
+        if file.content_type not in SUPPORTED_IMAGE_TYPES and file.content_type not in SUPPORTED_DOCUMENT_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported file type for {file.filename}: {file.content_type}. Supported: images and documents"
+            )
+    sizes = [upload_size(file) for file in files]
+    for size in sizes:
+        check_upload_size(size)
+
+    db_assistant = None
+    if assistant_id:
+        db_assistant = await db.query(UserAssistant).filter(
+            UserAssistant.assistant_id == assistant_id,
+            UserAssistant.user_id == current_user.id
+        ).first()
+        if not db_assistant:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assistant not found")
+
+    print(f"DEBUG: Batch upload - {len(files)} files, assistant_id: {assistant_id}")
+
+    # Purpose follows file type: images use 'vision', documents use 'assistants' (for code_interpreter)
+    purposes = ["vision" if file.content_type in SUPPORTED_IMAGE_TYPES else "assistants" for file in files]
+    hashes = await asyncio.gather(*(upload_sha256(file) for file in files))
+    existing_files = {
+        (f.content_hash, f.purpose): f
+        for f in await db.query(FileMetadata).filter(
+            FileMetadata.uploaded_by == current_user.id,
+            FileMetadata.content_hash.in_(set(hashes))
+        ).all()
+    }
+
+    semaphore = asyncio.Semaphore(settings.UPLOAD_BATCH_CONCURRENCY)
+    new_files: List[FileMetadata] = []
+
+    async def upload_one(file: UploadFile, size: int, file_hash: str, purpose: str) -> str:
+        existing_file = existing_files.get((file_hash, purpose))
+        if existing_file:
+            print(f"DEBUG: Reusing existing OpenAI file {existing_file.file_id} for {file.filename}")
+            return existing_file.file_id
+        async with semaphore:
+            thumbnail_task = await start_thumbnail(file, size)
+            openai_file = await upload_to_openai(client, file, purpose, size)
+        db_file = FileMetadata(
+            file_id=openai_file.id,
+            original_name=file.filename,
+            size=size,
+            mime_type=file.content_type,
+            purpose=purpose,
+            content_hash=file_hash,
+            uploaded_by=current_user.id
+        )
+        await attach_thumbnail(db_file, thumbnail_task)
+        new_files.append(db_file)
+        return openai_file.id
+
+    # Identical files within the batch share one upload
+    uploads = {}
+    for file, size, file_hash, purpose in zip(files, sizes, hashes, purposes):
+        if (file_hash, purpose) not in uploads:
+            uploads[(file_hash, purpose)] = asyncio.ensure_future(upload_one(file, size, file_hash, purpose))
+    results = await asyncio.gather(
+        *(uploads[(file_hash, purpose)] for file_hash, purpose in zip(hashes, purposes)),
+        return_exceptions=True
+    )
+
+    uploaded, failed = [], []
+    for file, size, purpose, result in zip(files, sizes, purposes, results):
+        if isinstance(result, BaseException):
+            print(f"DEBUG: Failed to upload {file.filename}: {str(result)}")
+            failed.append(BatchUploadFailure(filename=file.filename or "unknown", error=str(result)))
+        else:
+            uploaded.append(FileResponse(file_id=result, filename=file.filename or "unknown", size=size, purpose=purpose))
+
+    try:
+        # All new metadata rows in one transaction
+        db.add_all(new_files)
+        await db.commit()
+        invalidate_profile_stats(current_user.id)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Failed to save file metadata: {str(e)}"
+        )
+
+    attached = False
+    document_ids = list(dict.fromkeys(f.file_id for f in uploaded if f.purpose == "assistants"))
+    if db_assistant and document_ids:
+        try:
+            await tool_resources_reconciler.add_files(client, assistant_id, document_ids)
+
+            await attach_files(db, db_assistant.id, document_ids)
+            await db.commit()
+            attached = True
+            print(f"DEBUG: Attached {len(document_ids)} files to assistant {assistant_id}")
+        except Exception as e:
+            await db.rollback()
+            print(f"DEBUG: Failed to attach files to assistant: {str(e)}")
+            # Don't fail the upload if assistant attachment fails
+
+    return BatchUploadResponse(files=uploaded, failed=failed, attached_to_assistant=attached)
+
 @router.post("/upload-legacy", response_model=FileResponse)
 async def upload_file_legacy(
     file: UploadFile = File(...),
     purpose: str = "assistants",
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Legacy file upload endpoint"""
-    # Validate file size (25MB limit)
-    contents = await file.read()
-    file_size = len(contents)
-    if file_size > 25 * 1024 * 1024:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="File size exceeds 25MB limit"
+    # Validate file size
+    file_size = upload_size(file)
+    check_upload_size(file_size)
+    
+    file_hash = await upload_sha256(file)
+    existing_file = await find_duplicate_file(db, current_user.id, file_hash, purpose)
+    if existing_file:
+        return FileResponse(
+            file_id=existing_file.file_id,
+            filename=file.filename,
+            size=file_size,
+            purpose=purpose
         )
     
+    thumbnail_task = await start_thumbnail(file, file_size)
     try:
-        # Create temporary file-like object for OpenAI upload
-        file_obj = io.BytesIO(contents)
-        file_obj.name = file.filename or f"file_{uuid.uuid4().hex}"
-        
         # Upload to OpenAI
-        openai_file = client.files.create(
-            file=file_obj,
-            purpose=purpose
-        )
+        openai_file = await upload_to_openai(client, file, purpose, file_size)
         
         # Save metadata to database
         db_file = FileMetadata(
@@ -222,10 +376,13 @@ async def upload_file_legacy(
             size=file_size,
             mime_type=file.content_type,
             purpose=purpose,
+            content_hash=file_hash,
             uploaded_by=current_user.id
         )
+        await attach_thumbnail(db_file, thumbnail_task)
         db.add(db_file)
-        db.commit()
+        await db.commit()
+        invalidate_profile_stats(current_user.id)
         
         return FileResponse(
             file_id=openai_file.id,
@@ -235,7 +392,7 @@ async def upload_file_legacy(
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Failed to upload file: {str(e)}"
@@ -244,10 +401,10 @@ async def upload_file_legacy(
 @router.get("/", response_model=List[FileResponse])
 async def list_files(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """List user's uploaded files"""
-    files = db.query(FileMetadata).filter(
+    files = await db.query(FileMetadata).filter(
         FileMetadata.uploaded_by == current_user.id
     ).all()
     
@@ -264,10 +421,10 @@ async def list_files(
 @router.get("/by-purpose")
 async def get_files_by_purpose(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """Get files organized by purpose (MMACTEMP pattern)"""
-    files = db.query(FileMetadata).filter(
+    files = await db.query(FileMetadata).filter(
         FileMetadata.uploaded_by == current_user.id
     ).all()
     
@@ -288,13 +445,13 @@ class FileDetailsRequest(BaseModel):
 async def get_file_details(
     request: FileDetailsRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """Get details for a specific list of file IDs."""
     if not request.file_ids:
         return []
     
-    files = db.query(FileMetadata).filter(
+    files = await db.query(FileMetadata).filter(
         FileMetadata.file_id.in_(request.file_ids),
         FileMetadata.uploaded_by == current_user.id
     ).all()
@@ -313,11 +470,12 @@ async def get_file_details(
 async def get_file_content(
     file_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Get file content from OpenAI Files API"""
     # Check if user has access to this file
-    db_file = db.query(FileMetadata).filter(
+    db_file = await db.query(FileMetadata).filter(
         FileMetadata.file_id == file_id,
         FileMetadata.uploaded_by == current_user.id
     ).first()
@@ -330,7 +488,7 @@ async def get_file_content(
     
     try:
         # Get file content from OpenAI
-        file_response = client.files.content(file_id)
+        file_response = await client.files.content(file_id)
         content = file_response.content
         
         # Return appropriate response based on file type
@@ -355,30 +513,37 @@ async def get_file_content(
 async def get_file_preview(
     file_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db)
 ):
     """Get image preview/thumbnail"""
-    # Check if user has access to this file
-    db_file = db.query(FileMetadata).filter(
+    # Check if user has access to this file, loading its stored preview in the same query
+    row = await db.query(FileMetadata, FilePreview).outerjoin(
+        FilePreview, FilePreview.file_metadata_id == FileMetadata.id
+    ).filter(
         FileMetadata.file_id == file_id,
         FileMetadata.uploaded_by == current_user.id
     ).first()
     
-    if not db_file:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
+    db_file, preview = row
     
-    if not db_file.preview_data:
+    if preview is None and not db_file.preview_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Preview not available"
         )
     
     try:
-        # Extract base64 data from data URL
-        if db_file.preview_data.startswith('data:'):
+        if preview is not None:
+            # Stored as raw bytes; no decoding needed
+            preview_bytes = preview.data
+            media_type = preview.media_type
+        elif db_file.preview_data.startswith('data:'):
+            # Legacy base64 data URL
             header, encoded = db_file.preview_data.split(',', 1)
             media_type = header.split(';')[0].split(':')[1]
             preview_bytes = base64.b64decode(encoded)
@@ -405,11 +570,12 @@ async def get_file_preview(
 async def delete_file(
     file_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Delete file"""
     # Check if user owns the file
-    db_file = db.query(FileMetadata).filter(
+    db_file = await db.query(FileMetadata).filter(
         FileMetadata.file_id == file_id,
         FileMetadata.uploaded_by == current_user.id
     ).first()
@@ -421,17 +587,24 @@ async def delete_file(
         )
     
     try:
+        # Deduplicated uploads can be shared, so take the file off every assistant using it first
+        for db_assistant in await get_assistants_with_file(db, current_user.id, file_id):
+            print(f"DEBUG: Detaching file {file_id} from assistant {db_assistant.assistant_id} before deleting it")
+            await tool_resources_reconciler.remove_files(client, db_assistant.assistant_id, [file_id])
+            await detach_files(db, db_assistant.id, [file_id])
+
         # Delete from OpenAI
-        client.files.delete(file_id)
+        await client.files.delete(file_id)
         
         # Delete from database
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
+        invalidate_profile_stats(current_user.id)
         
         return {"message": "File deleted successfully"}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Failed to delete file: {str(e)}"
@@ -439,7 +612,9 @@ async def delete_file(
 
 @router.get("/openai/{file_id}")
 async def get_openai_file_content(
-    file_id: str
+    file_id: str,
+    request: Request,
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Serve OpenAI file content (images from assistant responses) - MMACTEMP pattern
 
@@ -447,41 +622,44 @@ async def get_openai_file_content(
     - File IDs are secure random tokens from OpenAI
     - Images need to be displayable in <img> tags (which don't send auth headers)
     - No sensitive user data is exposed through file content
+
+    Content is served from the on-disk blob cache, with ETag and Range support.
     """
     try:
-        # Get file content from OpenAI
-        file_response = client.files.content(file_id)
-        file_content = file_response.read()
-        
-        # Get file metadata to determine content type
-        try:
-            file_info = client.files.retrieve(file_id)
-            filename = getattr(file_info, 'filename', f'{file_id}.png')
-            
-            # Determine content type from filename
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-                content_type = f"image/{filename.split('.')[-1].lower()}"
-                if content_type == "image/jpg":
-                    content_type = "image/jpeg"
-            else:
-                content_type = "application/octet-stream"
-                
-        except Exception:
-            # Default to PNG if we can't get file info
-            content_type = "image/png"
-            filename = f"{file_id}.png"
-        
-        return Response(
-            content=file_content,
-            media_type=content_type,
-            headers={
-                "Content-Disposition": f"inline; filename={filename}",
-                "Cache-Control": "public, max-age=3600"  # Cache for 1 hour
-            }
-        )
-        
+        blob = await blob_cache.get(client, file_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Failed to retrieve file: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+    headers = {
+        "Content-Disposition": f"inline; filename={blob.filename}",
+        "Cache-Control": "public, max-age=86400, immutable",  # Content never changes for a file id
+        "ETag": blob.etag,
+        "Accept-Ranges": "bytes"
+    }
+    if etag_matches(request.headers.get("if-none-match"), blob.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), blob.size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{blob.size}"}
+        )
+
+    path = blob_cache.path_for(file_id)
+    if byte_range is None:
+        return DiskFileResponse(path, media_type=blob.content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=blob.content_type,
+        headers=headers
+    )
@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field, validator
 from typing import Optional
 from datetime import datetime
-import bcrypt
 import re
 
-from models.database import get_db, User
-from api.auth import get_current_user
+from sqlalchemy import func, select
+
+from models.database import get_db, User, ThreadedSession
+from api.auth import get_current_user, invalidate_user
+from utils.passwords import hash_password, verify_password
+from utils.user_stats import profile_stats_cache, invalidate_profile_stats
 
 router = APIRouter()
 
@@ -64,14 +66,14 @@ async def get_profile(
 @router.put("/profile", response_model=UserProfile)
 async def update_profile(
     request: UpdateProfileRequest,
-    db: Session = Depends(get_db),
+    db: ThreadedSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Update user profile information."""
 
     # Check if username is being changed and if it's already in use
     if request.username and request.username != current_user.username:
-        existing_user = db.query(User).filter(User.username == request.username).first()
+        existing_user = await db.query(User).filter(User.username == request.username).first()
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -79,16 +81,18 @@ async def update_profile(
             )
 
     # Update fields if provided
+    previous_username = current_user.username
     if request.username is not None:
         current_user.username = request.username
 
     current_user.updated_at = datetime.utcnow()
 
     try:
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        await invalidate_user(previous_username)
+        await db.refresh(current_user)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update profile: {str(e)}"
@@ -104,33 +108,33 @@ async def update_profile(
 @router.post("/profile/change-password")
 async def change_password(
     request: ChangePasswordRequest,
-    db: Session = Depends(get_db),
+    db: ThreadedSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Change user password."""
 
+    # Users rebuilt from the cache have no hash; load it here rather than lazily on the event loop
+    await db.refresh(current_user, ["password_hash"])
+
     # Verify current password
-    if not bcrypt.checkpw(request.current_password.encode('utf-8'),
-                         current_user.password_hash.encode('utf-8')):
+    if not await verify_password(request.current_password, current_user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
 
     # Hash new password
-    new_password_hash = bcrypt.hashpw(
-        request.new_password.encode('utf-8'),
-        bcrypt.gensalt()
-    ).decode('utf-8')
+    new_password_hash = await hash_password(request.new_password)
 
     # Update password
     current_user.password_hash = new_password_hash
     current_user.updated_at = datetime.utcnow()
 
     try:
-        db.commit()
+        await db.commit()
+        await invalidate_user(current_user.username)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to change password: {str(e)}"
@@ -140,73 +144,84 @@ async def change_password(
 
 @router.get("/profile/stats", response_model=UserStats)
 async def get_user_stats(
-    db: Session = Depends(get_db),
+    db: ThreadedSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get user statistics and usage information."""
     from models.database import UserAssistant, Conversation, ConversationMessage, FileMetadata
 
-    # Count assistants
-    total_assistants = db.query(UserAssistant).filter(
-        UserAssistant.user_id == current_user.id
-    ).count()
-
-    # Count conversations (if using the new model)
-    total_conversations = db.query(Conversation).filter(
-        Conversation.user_id == current_user.id
-    ).count()
-
-    # Count messages
-    total_messages = 0
-    if total_conversations > 0:
-        conversations = db.query(Conversation).filter(
-            Conversation.user_id == current_user.id
-        ).all()
-        conversation_ids = [c.id for c in conversations]
-        total_messages = db.query(ConversationMessage).filter(
-            ConversationMessage.conversation_id.in_(conversation_ids)
-        ).count()
-
-    # Calculate storage used (in MB)
-    files = db.query(FileMetadata).filter(
-        FileMetadata.uploaded_by == current_user.id
-    ).all()
-    storage_used_bytes = sum(f.size for f in files if f.size)
-    storage_used_mb = round(storage_used_bytes / (1024 * 1024), 2)
+    cached = profile_stats_cache.get(current_user.id)
+    if cached is not None:
+        return cached
+
+    # All four totals in one round trip, aggregated by the database
+    user_id = current_user.id
+    totals = select(
+        select(func.count(UserAssistant.id)).where(
+            UserAssistant.user_id == user_id
+        ).scalar_subquery(),
+        select(func.count(Conversation.id)).where(
+            Conversation.user_id == user_id
+        ).scalar_subquery(),
+        select(func.count(ConversationMessage.id)).join(
+            Conversation, ConversationMessage.conversation_id == Conversation.id
+        ).where(Conversation.user_id == user_id).scalar_subquery(),
+        select(func.coalesce(func.sum(FileMetadata.size), 0)).where(
+            FileMetadata.uploaded_by == user_id
+        ).scalar_subquery()
+    )
+    result = await db.execute(totals)
+    total_assistants, total_conversations, total_messages, storage_used_bytes = result.one()
 
-    return UserStats(
+    stats = UserStats(
         total_assistants=total_assistants,
         total_conversations=total_conversations,
         total_messages=total_messages,
-        storage_used_mb=storage_used_mb
+        storage_used_mb=round(int(storage_used_bytes) / (1024 * 1024), 2)
     )
+    profile_stats_cache.set(current_user.id, stats)
+    return stats
 
 @router.delete("/profile")
 async def delete_account(
-    db: Session = Depends(get_db),
+    db: ThreadedSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Delete user account and all associated data."""
-    from models.database import UserAssistant, Conversation, FileMetadata
+    from models.database import UserAssistant, AssistantFile, UserStats, ChatJob, Conversation, ConversationMessage, FileMetadata
 
     try:
-        # Delete all user's assistants
-        db.query(UserAssistant).filter(UserAssistant.user_id == current_user.id).delete()
+        # Delete all user's conversations and their mirrored messages
+        conversation_ids = select(Conversation.id).where(Conversation.user_id == current_user.id)
+        await db.query(ConversationMessage).filter(
+            ConversationMessage.conversation_id.in_(conversation_ids)
+        ).delete(synchronize_session=False)
+        await db.query(Conversation).filter(Conversation.user_id == current_user.id).delete()
 
-        # Delete all user's conversations
-        db.query(Conversation).filter(Conversation.user_id == current_user.id).delete()
+        await db.query(ChatJob).filter(ChatJob.user_id == current_user.id).delete()
+
+        # Delete all user's assistants and their file attachments
+        user_assistant_ids = select(UserAssistant.id).where(UserAssistant.user_id == current_user.id)
+        await db.query(AssistantFile).filter(
+            AssistantFile.user_assistant_id.in_(user_assistant_ids)
+        ).delete(synchronize_session=False)
+        await db.query(UserAssistant).filter(UserAssistant.user_id == current_user.id).delete()
 
         # Delete all user's files metadata
-        db.query(FileMetadata).filter(FileMetadata.uploaded_by == current_user.id).delete()
+        await db.query(FileMetadata).filter(FileMetadata.uploaded_by == current_user.id).delete()
+
+        await db.query(UserStats).filter(UserStats.user_id == current_user.id).delete()
 
         # Delete the user
-        db.delete(current_user)
+        await db.delete(current_user)
 
-        db.commit()
+        await db.commit()
+        await invalidate_user(current_user.username)
+        invalidate_profile_stats(current_user.id)
 
         return {"message": "Account deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete account: {str(e)}"
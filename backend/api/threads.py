@@ -1,15 +1,13 @@
 """Thread management endpoints"""
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from models.database import get_db, User
-from api.auth import get_current_user
-from utils.config import settings
+from models.database import get_db, User, ThreadedSession
+from api.auth import get_current_user, invalidate_user
+from utils.openai_client import get_openai_client
 
 router = APIRouter()
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 class ThreadResponse(BaseModel):
     thread_id: str
@@ -17,16 +15,18 @@ class ThreadResponse(BaseModel):
 @router.post("/", response_model=ThreadResponse)
 async def create_thread(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Create new thread"""
     try:
         # Create OpenAI thread
-        thread = client.beta.threads.create()
+        thread = await client.beta.threads.create()
         
         # Update user's thread ID
         current_user.thread_id = thread.id
-        db.commit()
+        await db.commit()
+        await invalidate_user(current_user.username)
         
         return ThreadResponse(thread_id=thread.id)
         
@@ -52,21 +52,23 @@ async def get_current_thread(
 @router.delete("/current")
 async def delete_current_thread(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: ThreadedSession = Depends(get_db),
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """Delete current thread and create new one"""
     if current_user.thread_id:
         try:
             # Delete old thread from OpenAI
-            client.beta.threads.delete(current_user.thread_id)
+            await client.beta.threads.delete(current_user.thread_id)
         except:
             pass  # Thread might already be deleted
     
     try:
         # Create new thread
-        thread = client.beta.threads.create()
+        thread = await client.beta.threads.create()
         current_user.thread_id = thread.id
-        db.commit()
+        await db.commit()
+        await invalidate_user(current_user.username)
         
         return ThreadResponse(thread_id=thread.id)
         
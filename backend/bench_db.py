@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark database access strategies for async routes.
+
+Runs N concurrent ``SELECT SLEEP(x)`` queries while a ticker task measures
+event-loop lag, comparing:
+
+  blocking   - sync Session called directly on the event loop (the old get_db)
+  threadpool - ThreadedSession on the DB threadpool (the current get_db)
+  aiomysql   - async SQLAlchemy engine on aiomysql, if installed
+
+Usage: python bench_db.py [--concurrency 20] [--sleep 0.05] [--rounds 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+
+from models.database import SessionLocal, new_session
+from utils.config import settings
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Return the worst delay seen between expected and actual ticker wakeups"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+async def blocking_query(sleep: float):
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT SLEEP(:s)"), {"s": sleep})
+    finally:
+        db.close()
+
+async def threadpool_query(sleep: float):
+    db = new_session()
+    try:
+        await db.execute(text("SELECT SLEEP(:s)"), {"s": sleep})
+    finally:
+        await db.close()
+
+def make_aiomysql_query():
+    try:
+        import aiomysql  # noqa: F401
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError:
+        return None, None
+
+    engine = create_async_engine(
+        f"mysql+aiomysql://{settings.DB_USER}:{settings.DB_PASS}@{settings.DB_HOST}/{settings.DB_NAME}",
+        pool_size=5,
+        max_overflow=10,
+    )
+
+    async def aiomysql_query(sleep: float):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT SLEEP(:s)"), {"s": sleep})
+
+    return aiomysql_query, engine
+
+async def run_strategy(name: str, query, concurrency: int, sleep: float, rounds: int):
+    for i in range(rounds):
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(measure_loop_lag(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(query(sleep) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        lag = await ticker
+        print(f"{name:<11} round {i + 1}: total {elapsed * 1000:8.1f} ms, "
+              f"max loop lag {lag * 1000:8.1f} ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sleep", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    # Warm the pools so connection setup is not part of the measurement
+    await threadpool_query(0)
+
+    await run_strategy("blocking", blocking_query, args.concurrency, args.sleep, args.rounds)
+    await run_strategy("threadpool", threadpool_query, args.concurrency, args.sleep, args.rounds)
+
+    aiomysql_query, engine = make_aiomysql_query()
+    if aiomysql_query is None:
+        print("aiomysql    skipped (pip install aiomysql to include it)")
+        return
+    if settings.USE_CLOUD_SQL:
+        print("aiomysql    note: bypasses the Cloud SQL connector, which only supports pymysql for MySQL")
+    try:
+        await aiomysql_query(0)
+        await run_strategy("aiomysql", aiomysql_query, args.concurrency, args.sleep, args.rounds)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""
+Celery worker for background chat runs (CHAT_JOB_BACKEND=celery)
+
+Run with: celery -A celery_worker worker --concurrency=4
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from models.database import init_connector, close_connector
+from utils.chat_jobs import CHAT_JOB_TASK, execute_chat_job
+from utils.config import settings
+from utils.openai_client import close_openai_client
+
+logger = logging.getLogger(__name__)
+
+celery_app = Celery("chat_jobs", broker=settings.CELERY_BROKER_URL or settings.REDIS_URL)
+celery_app.conf.update(
+    # Redeliver jobs whose worker died; the job's status claim stops a second run
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+)
+
+# One loop per worker process so the pooled OpenAI client is reused across tasks
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    init_connector()
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    if _loop is not None:
+        _loop.run_until_complete(close_openai_client())
+        _loop.close()
+    close_connector()
+
+@celery_app.task(name=CHAT_JOB_TASK)
+def run_chat_job(job_id: str):
+    logger.info(f"Running chat job {job_id}")
+    _get_loop().run_until_complete(execute_chat_job(job_id))
@@ -5,14 +5,24 @@ Provides API endpoints for OpenAI assistant management
 import os
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 from api import auth, assistants, threads, files, chat, dashboard, profile
-from models.database import init_db
+from api.auth import get_current_user
+from models.database import init_db, init_connector, close_connector, get_pool_stats, engine, db_executor, run_db
 from utils.config import settings
+from utils.openai_client import close_openai_client
+from utils.run_poller import run_poller
+from utils.openai_governor import openai_governor
+from utils.user_stats import stats_reconciler
+from utils.shared_cache import shared_cache
+from utils.chat_jobs import chat_job_queue
+from utils.passwords import shutdown_password_executor
+from utils.thumbnails import shutdown_thumbnail_executor
+from utils.uploads import UploadSizeLimitMiddleware
 
 # Load environment variables
 load_dotenv()
@@ -30,14 +40,31 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up...")
     try:
-        init_db()
-        logger.info("Database initialized successfully")
+        init_connector()
+        if settings.RUN_MIGRATIONS_ON_STARTUP:
+            await run_db(init_db)
+            logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         logger.warning("Application starting without database - some features may not work")
+    await shared_cache.start()
+    if settings.STATS_RECONCILE_ENABLED:
+        stats_reconciler.start()
+    await chat_job_queue.start()
     yield
     # Shutdown
     logger.info("Shutting down...")
+    await chat_job_queue.stop()
+    await run_poller.stop()
+    await openai_governor.stop()
+    await stats_reconciler.stop()
+    await shared_cache.stop()
+    await close_openai_client()
+    shutdown_password_executor()
+    shutdown_thumbnail_executor()
+    db_executor.shutdown(wait=False, cancel_futures=True)
+    engine.dispose()
+    close_connector()
 
 # Create FastAPI app
 app = FastAPI(
@@ -58,6 +85,9 @@ elif "887330536517.us-central1.run.app" in settings.FRONTEND_URL:
     # Add the legacy URL format
     allowed_origins.append("https://vue-multiagent-frontend-d6mqo7ynsq-uc.a.run.app")
 
+# Reject oversized uploads while the body streams in (added before CORS so errors keep CORS headers)
+app.add_middleware(UploadSizeLimitMiddleware, path_prefix="/api/files/upload")
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -78,6 +108,7 @@ app.include_router(assistants.router, prefix="/api/assistants", tags=["assistant
 app.include_router(threads.router, prefix="/api/threads", tags=["threads"])
 app.include_router(files.router, prefix="/api/files", tags=["files"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(chat.ws_router, prefix="/ws", tags=["chat"])
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["dashboard"])
 app.include_router(profile.router, prefix="/api", tags=["profile"])
 
@@ -97,17 +128,21 @@ async def health_check():
     """Health check endpoint for Google Cloud Run"""
     return {"status": "healthy"}
 
-@app.get("/test-db")
+# Diagnostics expose connection details, so they need a logged-in user
+@app.get("/test-db", dependencies=[Depends(get_current_user)])
 async def test_database():
     """Test database connection"""
     import os
-    from models.database import engine
     from sqlalchemy import text
+
+    def select_one():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
     try:
         # Test connection
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT 1"))
-            return {
+        await run_db(select_one)
+        return {
                 "status": "connected",
                 "db_host": os.getenv("DB_HOST"),
                 "db_user": os.getenv("DB_USER"),
@@ -125,6 +160,11 @@ async def test_database():
             "db_pass_length": len(os.getenv("DB_PASS", ""))
         }
 
+@app.get("/db-pool", dependencies=[Depends(get_current_user)])
+async def database_pool_stats():
+    """Connection pool occupancy and checkout/connect timings"""
+    return get_pool_stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,67 @@
+"""Alembic environment: runs migrations against the application's engine"""
+from logging.config import fileConfig
+import os
+import sys
+
+from alembic import context
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import Base, engine
+
+config = context.config
+
+# When run from init_db the application has already configured logging
+if config.config_file_name is not None and not config.attributes.get("embedded"):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# Serializes migrations when several instances start at once
+MIGRATION_LOCK_NAME = "multiagent_alembic_upgrade"
+MIGRATION_LOCK_TIMEOUT_SECONDS = 300
+
+def run_migrations_offline():
+    """Emit SQL for the migrations instead of running them (alembic upgrade --sql)"""
+    # The engine connects through a creator function, so only the dialect matters here
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url") or str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    mysql = connection.dialect.name == "mysql"
+    if mysql:
+        acquired = connection.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT_SECONDS}
+        ).scalar()
+        if acquired != 1:
+            raise RuntimeError("Timed out waiting for another instance to finish migrating")
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if mysql:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK_NAME})
+
+def run_migrations_online():
+    # Callers such as bench_query_plans.py may hand over their own connection
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations(connection)
+        return
+    with engine.connect() as connection:
+        run_migrations(connection)
+        connection.commit()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
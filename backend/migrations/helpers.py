@@ -0,0 +1,40 @@
+"""Schema checks shared by revisions.
+
+Databases created before migrations existed were built by
+``Base.metadata.create_all`` at whatever model version was deployed, so a
+revision may find some of its objects already in place. These helpers let
+revisions skip those instead of failing, which means ``alembic upgrade head``
+adopts such a database without a manual ``alembic stamp``.
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+def has_table(table: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return _inspector().has_table(table)
+
+def has_column(table: str, column: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return any(c["name"] == column for c in _inspector().get_columns(table))
+
+def has_index(table: str, index: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return any(i["name"] == index for i in _inspector().get_indexes(table))
+
+def create_table_if_missing(table: str, *columns, **kwargs):
+    if not has_table(table):
+        op.create_table(table, *columns, **kwargs)
+
+def create_index_if_missing(index: str, table: str, columns, **kwargs):
+    if not has_index(table, index):
+        op.create_index(index, table, columns, **kwargs)
+
+def drop_index_if_present(index: str, table: str):
+    if context.is_offline_mode() or has_index(table, index):
+        op.drop_index(index, table_name=table)
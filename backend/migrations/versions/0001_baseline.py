@@ -0,0 +1,116 @@
+"""Baseline schema, as previously created by Base.metadata.create_all
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_table_if_missing, create_index_if_missing
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    create_table_if_missing(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(255), nullable=False),
+        sa.Column("password_hash", sa.Text(), nullable=False),
+        sa.Column("thread_id", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    create_index_if_missing("ix_users_id", "users", ["id"])
+    create_index_if_missing("ix_users_username", "users", ["username"], unique=True)
+
+    create_table_if_missing(
+        "user_assistants",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("assistant_id", sa.String(255), nullable=False),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("instructions", sa.Text(), nullable=True),
+        sa.Column("file_ids", sa.Text(), nullable=True),
+        sa.Column("model", sa.String(50), nullable=True),
+        sa.Column("thread_id", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    create_index_if_missing("ix_user_assistants_id", "user_assistants", ["id"])
+    create_index_if_missing("ix_user_assistants_assistant_id", "user_assistants", ["assistant_id"])
+
+    create_table_if_missing(
+        "file_metadata",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("file_id", sa.String(255), nullable=False),
+        sa.Column("original_name", sa.String(255), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("mime_type", sa.String(100), nullable=True),
+        sa.Column("purpose", sa.String(50), nullable=False),
+        sa.Column("uploaded_by", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=True),
+        sa.Column("height", sa.Integer(), nullable=True),
+        sa.Column("preview_data", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    create_index_if_missing("ix_file_metadata_id", "file_metadata", ["id"])
+    create_index_if_missing("ix_file_metadata_file_id", "file_metadata", ["file_id"], unique=True)
+
+    create_table_if_missing(
+        "assistants",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("assistant_id", sa.String(255), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("instructions", sa.Text(), nullable=True),
+        sa.Column("model", sa.String(50), nullable=True),
+        sa.Column("tools", sa.Text(), nullable=True),
+        sa.Column("tool_resources", sa.Text(), nullable=True),
+        sa.Column("assistant_metadata", sa.Text(), nullable=True),
+        sa.Column("temperature", sa.String(10), nullable=True),
+        sa.Column("top_p", sa.String(10), nullable=True),
+        sa.Column("response_format", sa.String(50), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    create_index_if_missing("ix_assistants_id", "assistants", ["id"])
+    create_index_if_missing("ix_assistants_assistant_id", "assistants", ["assistant_id"], unique=True)
+
+    create_table_if_missing(
+        "conversations",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("assistant_id", sa.Integer(), sa.ForeignKey("assistants.id"), nullable=False),
+        sa.Column("title", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    create_index_if_missing("ix_conversations_id", "conversations", ["id"])
+
+    create_table_if_missing(
+        "conversation_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id"), nullable=False),
+        sa.Column("message_id", sa.String(255), nullable=True),
+        sa.Column("role", sa.String(50), nullable=False),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("attachments", sa.Text(), nullable=True),
+        sa.Column("message_metadata", sa.Text(), nullable=True),
+        sa.Column("token_count", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    create_index_if_missing("ix_conversation_messages_id", "conversation_messages", ["id"])
+
+def downgrade():
+    op.drop_table("conversation_messages")
+    op.drop_table("conversations")
+    op.drop_table("assistants")
+    op.drop_table("file_metadata")
+    op.drop_table("user_assistants")
+    op.drop_table("users")
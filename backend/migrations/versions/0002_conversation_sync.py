@@ -0,0 +1,56 @@
+"""Mirror OpenAI threads into conversations and conversation_messages
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_column, create_index_if_missing
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("conversations") as batch_op:
+        # Mirrored threads belong to a UserAssistant, not a modern Assistant
+        batch_op.alter_column("assistant_id", existing_type=sa.Integer(), nullable=True)
+        if not has_column("conversations", "user_assistant_id"):
+            batch_op.add_column(sa.Column("user_assistant_id", sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(
+                "fk_conversations_user_assistant_id", "user_assistants", ["user_assistant_id"], ["id"]
+            )
+        if not has_column("conversations", "thread_id"):
+            batch_op.add_column(sa.Column("thread_id", sa.String(255), nullable=True))
+        if not has_column("conversations", "last_message_id"):
+            batch_op.add_column(sa.Column("last_message_id", sa.String(255), nullable=True))
+        if not has_column("conversations", "last_synced_at"):
+            batch_op.add_column(sa.Column("last_synced_at", sa.DateTime(timezone=True), nullable=True))
+
+    create_index_if_missing("ix_conversations_user_assistant_id", "conversations", ["user_assistant_id"])
+    create_index_if_missing("ix_conversations_thread_id", "conversations", ["thread_id"])
+    create_index_if_missing("ix_conversation_messages_conversation_id", "conversation_messages", ["conversation_id"])
+    create_index_if_missing("ix_conversation_messages_message_id", "conversation_messages", ["message_id"])
+
+def downgrade():
+    # Mirrored conversations have no modern Assistant and cannot satisfy the old NOT NULL
+    conversations = sa.table("conversations", sa.column("id"), sa.column("assistant_id"))
+    messages = sa.table("conversation_messages", sa.column("conversation_id"))
+    mirrored = sa.select(conversations.c.id).where(conversations.c.assistant_id.is_(None))
+    op.execute(messages.delete().where(messages.c.conversation_id.in_(mirrored)))
+    op.execute(conversations.delete().where(conversations.c.assistant_id.is_(None)))
+
+    op.drop_index("ix_conversation_messages_message_id", table_name="conversation_messages")
+    op.drop_index("ix_conversation_messages_conversation_id", table_name="conversation_messages")
+    op.drop_index("ix_conversations_thread_id", table_name="conversations")
+    op.drop_index("ix_conversations_user_assistant_id", table_name="conversations")
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_constraint("fk_conversations_user_assistant_id", type_="foreignkey")
+        batch_op.drop_column("last_synced_at")
+        batch_op.drop_column("last_message_id")
+        batch_op.drop_column("thread_id")
+        batch_op.drop_column("user_assistant_id")
+        batch_op.alter_column("assistant_id", existing_type=sa.Integer(), nullable=False)
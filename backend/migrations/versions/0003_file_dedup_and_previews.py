@@ -0,0 +1,37 @@
+"""Content hashes for upload deduplication and binary thumbnails in file_previews
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_column, create_table_if_missing, create_index_if_missing
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not has_column("file_metadata", "content_hash"):
+        op.add_column("file_metadata", sa.Column("content_hash", sa.String(64), nullable=True))
+    create_index_if_missing("ix_file_metadata_content_hash", "file_metadata", ["content_hash"])
+
+    create_table_if_missing(
+        "file_previews",
+        sa.Column(
+            "file_metadata_id", sa.Integer(),
+            sa.ForeignKey("file_metadata.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("media_type", sa.String(50), nullable=False),
+        sa.Column("data", sa.LargeBinary(length=2**24 - 1), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table("file_previews")
+    op.drop_index("ix_file_metadata_content_hash", table_name="file_metadata")
+    with op.batch_alter_table("file_metadata") as batch_op:
+        batch_op.drop_column("content_hash")
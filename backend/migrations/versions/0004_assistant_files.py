@@ -0,0 +1,82 @@
+"""Move UserAssistant.file_ids JSON into the assistant_files association table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+import json
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from migrations.helpers import create_table_if_missing, create_index_if_missing
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+user_assistants = sa.table(
+    "user_assistants",
+    sa.column("id", sa.Integer()),
+    sa.column("file_ids", sa.Text()),
+)
+assistant_files = sa.table(
+    "assistant_files",
+    sa.column("user_assistant_id", sa.Integer()),
+    sa.column("file_id", sa.String(255)),
+)
+
+def upgrade():
+    create_table_if_missing(
+        "assistant_files",
+        sa.Column(
+            "user_assistant_id", sa.Integer(),
+            sa.ForeignKey("user_assistants.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("file_id", sa.String(255), primary_key=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    create_index_if_missing("ix_assistant_files_file_id", "assistant_files", ["file_id", "user_assistant_id"])
+
+    if not context.is_offline_mode():
+        backfill_assistant_files()
+
+def backfill_assistant_files():
+    """Insert a row for every file id in the legacy JSON that is not there yet"""
+    bind = op.get_bind()
+    existing = set(bind.execute(sa.select(assistant_files.c.user_assistant_id, assistant_files.c.file_id)))
+    rows = []
+    for user_assistant_id, file_ids_json in bind.execute(
+        sa.select(user_assistants.c.id, user_assistants.c.file_ids).where(user_assistants.c.file_ids.isnot(None))
+    ):
+        try:
+            file_ids = json.loads(file_ids_json) or []
+        except ValueError:
+            print(f"Skipping assistant {user_assistant_id}: unreadable file_ids {file_ids_json!r}")
+            continue
+        for file_id in dict.fromkeys(file_ids):
+            if (user_assistant_id, file_id) not in existing:
+                existing.add((user_assistant_id, file_id))
+                rows.append({"user_assistant_id": user_assistant_id, "file_id": file_id})
+    if rows:
+        op.bulk_insert(assistant_files, rows)
+    print(f"Created {len(rows)} assistant_files rows")
+
+def downgrade():
+    if not context.is_offline_mode():
+        # The JSON column has not been written since this revision; restore it from the table
+        bind = op.get_bind()
+        file_ids = {}
+        for user_assistant_id, file_id in bind.execute(
+            sa.select(assistant_files.c.user_assistant_id, assistant_files.c.file_id)
+        ):
+            file_ids.setdefault(user_assistant_id, []).append(file_id)
+        for user_assistant_id, ids in file_ids.items():
+            bind.execute(
+                user_assistants.update()
+                .where(user_assistants.c.id == user_assistant_id)
+                .values(file_ids=json.dumps(ids))
+            )
+    op.drop_index("ix_assistant_files_file_id", table_name="assistant_files")
+    op.drop_table("assistant_files")
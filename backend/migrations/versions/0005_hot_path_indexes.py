@@ -0,0 +1,45 @@
+"""Composite indexes for the per-user lookups every router makes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+from migrations.helpers import create_index_if_missing, drop_index_if_present
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Ownership checks filter on both columns; listing uses the user_id prefix
+    create_index_if_missing("ix_user_assistants_user_id_assistant_id", "user_assistants", ["user_id", "assistant_id"])
+    create_index_if_missing("ix_user_assistants_user_id_created_at", "user_assistants", ["user_id", "created_at"])
+
+    create_index_if_missing("ix_file_metadata_uploaded_by_file_id", "file_metadata", ["uploaded_by", "file_id"])
+    # Deduplication always looks hashes up within one user's files, so this replaces the bare hash index
+    create_index_if_missing(
+        "ix_file_metadata_uploaded_by_content_hash", "file_metadata", ["uploaded_by", "content_hash", "purpose"]
+    )
+    drop_index_if_present("ix_file_metadata_content_hash", "file_metadata")
+
+    create_index_if_missing("ix_conversations_user_id_created_at", "conversations", ["user_id", "created_at"])
+    create_index_if_missing(
+        "ix_conversation_messages_conversation_id_created_at", "conversation_messages", ["conversation_id", "created_at"]
+    )
+
+def downgrade():
+    # MySQL drops its implicit foreign key index once a composite index covers the column,
+    # so plain ones must exist before the composites can go
+    create_index_if_missing("ix_user_assistants_user_id", "user_assistants", ["user_id"])
+    create_index_if_missing("ix_file_metadata_uploaded_by", "file_metadata", ["uploaded_by"])
+    create_index_if_missing("ix_conversations_user_id", "conversations", ["user_id"])
+    op.drop_index("ix_conversation_messages_conversation_id_created_at", table_name="conversation_messages")
+    op.drop_index("ix_conversations_user_id_created_at", table_name="conversations")
+    op.create_index("ix_file_metadata_content_hash", "file_metadata", ["content_hash"])
+    op.drop_index("ix_file_metadata_uploaded_by_content_hash", table_name="file_metadata")
+    op.drop_index("ix_file_metadata_uploaded_by_file_id", table_name="file_metadata")
+    op.drop_index("ix_user_assistants_user_id_created_at", table_name="user_assistants")
+    op.drop_index("ix_user_assistants_user_id_assistant_id", table_name="user_assistants")
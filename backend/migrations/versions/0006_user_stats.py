@@ -0,0 +1,36 @@
+"""Per-user dashboard counters
+
+Rows are created on first dashboard read and recomputed nightly, so no
+backfill is needed here.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_table_if_missing
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    create_table_if_missing(
+        "user_stats",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("assistant_count", sa.Integer(), nullable=False),
+        sa.Column("active_thread_count", sa.Integer(), nullable=False),
+        sa.Column("messages_today", sa.Integer(), nullable=False),
+        sa.Column("messages_day", sa.Date(), nullable=True),
+        sa.Column("tokens_used", sa.BigInteger(), nullable=False),
+        sa.Column("last_assistant_id", sa.Integer(), nullable=True),
+        sa.Column("last_assistant_name", sa.String(255), nullable=True),
+        sa.Column("last_assistant_created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("reconciled_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+def downgrade():
+    op.drop_table("user_stats")
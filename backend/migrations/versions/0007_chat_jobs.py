@@ -0,0 +1,43 @@
+"""Background chat runs
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_table_if_missing, create_index_if_missing
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    create_table_if_missing(
+        "chat_jobs",
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column(
+            "user_assistant_id", sa.Integer(),
+            sa.ForeignKey("user_assistants.id", ondelete="CASCADE"), nullable=False
+        ),
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.Column("assistant_id", sa.String(255), nullable=False),
+        sa.Column("thread_id", sa.String(255), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("run_id", sa.String(255), nullable=True),
+        sa.Column("message_id", sa.String(255), nullable=True),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("attachments", sa.Text(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    create_index_if_missing("ix_chat_jobs_user_id_created_at", "chat_jobs", ["user_id", "created_at"])
+    create_index_if_missing("ix_chat_jobs_status", "chat_jobs", ["status"])
+
+def downgrade():
+    op.drop_table("chat_jobs")
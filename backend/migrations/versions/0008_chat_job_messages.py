@@ -0,0 +1,27 @@
+"""Background chat jobs carry their message
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_column
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("chat_jobs") as batch_op:
+        if not has_column("chat_jobs", "message"):
+            batch_op.add_column(sa.Column("message", sa.Text(), nullable=True))
+        if not has_column("chat_jobs", "file_ids"):
+            batch_op.add_column(sa.Column("file_ids", sa.Text(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("chat_jobs") as batch_op:
+        batch_op.drop_column("file_ids")
+        batch_op.drop_column("message")
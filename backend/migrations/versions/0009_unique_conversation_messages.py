@@ -0,0 +1,32 @@
+"""One row per OpenAI message in a conversation
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_index
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+INDEX = "ux_conversation_messages_conversation_id_message_id"
+
+def upgrade():
+    if has_index("conversation_messages", INDEX):
+        return
+    # Overlapping syncs could both store a message before this index existed; keep the first copy.
+    # The derived table lets MySQL delete from the table the subquery reads.
+    op.execute(sa.text(
+        "DELETE FROM conversation_messages WHERE message_id IS NOT NULL AND id NOT IN ("
+        "SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM conversation_messages "
+        "WHERE message_id IS NOT NULL GROUP BY conversation_id, message_id) AS kept)"
+    ))
+    op.create_index(INDEX, "conversation_messages", ["conversation_id", "message_id"], unique=True)
+
+def downgrade():
+    op.drop_index(INDEX, table_name="conversation_messages")
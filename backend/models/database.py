@@ -1,11 +1,17 @@
 """Database models and connection setup"""
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import exc, create_engine, Column, Integer, String, Text, ForeignKey, DateTime, Date, Boolean, LargeBinary, BigInteger, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, Session, Query
 from sqlalchemy.sql import func
+from concurrent.futures import ThreadPoolExecutor
 from utils.config import settings
+import asyncio
+import functools
+import os
 import pymysql
 
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # Create base class for models
 Base = declarative_base()
 
@@ -32,7 +38,7 @@ class UserAssistant(Base):
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     instructions = Column(Text, nullable=True)
-    file_ids = Column(Text, nullable=True)  # JSON string
+    file_ids = Column(Text, nullable=True)  # Legacy JSON string; attachments live in assistant_files
     model = Column(String(50), default="gpt-4o")  # Default to vision-capable model
     thread_id = Column(String(255), nullable=True)  # Assistant-specific thread ID
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -40,6 +46,24 @@ class UserAssistant(Base):
     
     # Relationships
     user = relationship("User", back_populates="legacy_assistants")
+    conversations = relationship("Conversation", back_populates="user_assistant", cascade="all, delete-orphan")
+    files = relationship("AssistantFile", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_user_assistants_user_id_assistant_id", "user_id", "assistant_id"),
+        Index("ix_user_assistants_user_id_created_at", "user_id", "created_at"),
+    )
+
+class AssistantFile(Base):
+    """Files attached to a UserAssistant, one row per (assistant, file)"""
+    __tablename__ = "assistant_files"
+
+    user_assistant_id = Column(Integer, ForeignKey("user_assistants.id", ondelete="CASCADE"), primary_key=True)
+    file_id = Column(String(255), primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # The primary key serves per-assistant lookups; this one serves "which assistants use file X"
+    __table_args__ = (Index("ix_assistant_files_file_id", "file_id", "user_assistant_id"),)
 
 class FileMetadata(Base):
     __tablename__ = "file_metadata"
@@ -50,15 +74,46 @@ class FileMetadata(Base):
     size = Column(Integer, nullable=False)
     mime_type = Column(String(100), nullable=True)
     purpose = Column(String(50), nullable=False)  # assistants or vision
+    content_hash = Column(String(64), nullable=True)  # SHA-256 hex digest, for deduplication
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     # Image-specific fields
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
-    preview_data = Column(Text, nullable=True)  # Base64 encoded thumbnail
+    preview_data = Column(Text, nullable=True)  # Legacy base64 thumbnail; new previews live in file_previews
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     uploader = relationship("User")
+    preview = relationship("FilePreview", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_file_metadata_uploaded_by_file_id", "uploaded_by", "file_id"),
+        Index("ix_file_metadata_uploaded_by_content_hash", "uploaded_by", "content_hash", "purpose"),
+    )
+
+class FilePreview(Base):
+    """Thumbnail bytes, kept apart from FileMetadata so listing files never loads them"""
+    __tablename__ = "file_previews"
+
+    file_metadata_id = Column(Integer, ForeignKey("file_metadata.id", ondelete="CASCADE"), primary_key=True)
+    media_type = Column(String(50), nullable=False)
+    data = Column(LargeBinary(length=2**24 - 1), nullable=False)  # MEDIUMBLOB on MySQL
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserStats(Base):
+    """Per-user dashboard counters, updated in the same transactions as the rows they count"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    assistant_count = Column(Integer, nullable=False, default=0)
+    active_thread_count = Column(Integer, nullable=False, default=0)  # Assistants with a thread
+    messages_today = Column(Integer, nullable=False, default=0)
+    messages_day = Column(Date, nullable=True)  # UTC day messages_today counts; older means 0
+    tokens_used = Column(BigInteger, nullable=False, default=0)
+    last_assistant_id = Column(Integer, nullable=True)
+    last_assistant_name = Column(String(255), nullable=True)
+    last_assistant_created_at = Column(DateTime(timezone=True), nullable=True)
+    reconciled_at = Column(DateTime(timezone=True), nullable=True)
 
 # Modern database models for Responses API (required by auth.py imports)
 class Assistant(Base):
@@ -89,7 +144,11 @@ class Conversation(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    assistant_id = Column(Integer, ForeignKey("assistants.id"), nullable=False)
+    assistant_id = Column(Integer, ForeignKey("assistants.id"), nullable=True)
+    user_assistant_id = Column(Integer, ForeignKey("user_assistants.id"), nullable=True, index=True)
+    thread_id = Column(String(255), nullable=True, index=True)  # OpenAI thread mirrored by this conversation
+    last_message_id = Column(String(255), nullable=True)  # Newest OpenAI message stored locally (sync cursor)
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
     title = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -97,14 +156,17 @@ class Conversation(Base):
     # Relationships
     user = relationship("User")
     assistant = relationship("Assistant", back_populates="conversations")
+    user_assistant = relationship("UserAssistant", back_populates="conversations")
     messages = relationship("ConversationMessage", back_populates="conversation", cascade="all, delete-orphan")
 
+    __table_args__ = (Index("ix_conversations_user_id_created_at", "user_id", "created_at"),)
+
 class ConversationMessage(Base):
     __tablename__ = "conversation_messages"
     
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
-    message_id = Column(String(255), nullable=True)  # OpenAI message ID
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False, index=True)
+    message_id = Column(String(255), nullable=True, index=True)  # OpenAI message ID
     role = Column(String(50), nullable=False)  # user, assistant, system
     content = Column(Text, nullable=False)
     attachments = Column(Text, nullable=True)  # JSON string for file attachments
@@ -115,27 +177,88 @@ class ConversationMessage(Base):
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_conversation_messages_conversation_id_created_at", "conversation_id", "created_at"),
+        Index("ux_conversation_messages_conversation_id_message_id", "conversation_id", "message_id", unique=True),
+    )
+
+class ChatJob(Base):
+    """A chat run executed in the background; the request that queued it returns the id"""
+    __tablename__ = "chat_jobs"
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_assistant_id = Column(Integer, ForeignKey("user_assistants.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(Integer, nullable=True)
+    assistant_id = Column(String(255), nullable=False)  # OpenAI assistant ID
+    thread_id = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    message = Column(Text, nullable=True)  # The user's message, posted when the job runs
+    file_ids = Column(Text, nullable=True)  # JSON list of files sent with the message
+    run_id = Column(String(255), nullable=True)
+    message_id = Column(String(255), nullable=True)  # The assistant's reply
+    content = Column(Text, nullable=True)
+    attachments = Column(Text, nullable=True)  # JSON string for image attachments
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_chat_jobs_user_id_created_at", "user_id", "created_at"),
+        Index("ix_chat_jobs_status", "status"),
+    )
+
 from google.cloud.sql.connector import Connector, IPTypes
+from sqlalchemy.pool import QueuePool
+from typing import Optional
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Process-wide Cloud SQL connector; it caches certificates and refreshes them in the
+# background, so new pool connections only pay for the TCP/TLS handshake
+_connector: Optional[Connector] = None
+_connector_lock = threading.Lock()
+
+def init_connector() -> Optional[Connector]:
+    """Create the shared Cloud SQL connector (called from the app lifespan)"""
+    global _connector
+    if not settings.USE_CLOUD_SQL:
+        return None
+    with _connector_lock:
+        if _connector is None:
+            logger.info("Creating Cloud SQL connector...")
+            _connector = Connector()
+        return _connector
+
+def close_connector():
+    """Close the shared Cloud SQL connector"""
+    global _connector
+    with _connector_lock:
+        if _connector is not None:
+            _connector.close()
+            _connector = None
+
 def get_conn() -> pymysql.connections.Connection:
     """Initializes a connection based on the environment."""
     if settings.USE_CLOUD_SQL:
         logger.info("Connecting to Cloud SQL...")
         try:
             ip_type = IPTypes.PRIVATE if settings.DB_HOST and settings.DB_HOST.startswith("10.") else IPTypes.PUBLIC
-            with Connector() as connector:
-                return connector.connect(
-                    settings.INSTANCE_CONNECTION_NAME,
-                    "pymysql",
-                    user=settings.DB_USER,
-                    password=settings.DB_PASS,
-                    db=settings.DB_NAME,
-                    ip_type=ip_type,
-                    connect_timeout=30,
-                )
+            # Scripts that never run the lifespan get a connector on first use
+            connector = _connector or init_connector()
+            return connector.connect(
+                settings.INSTANCE_CONNECTION_NAME,
+                "pymysql",
+                user=settings.DB_USER,
+                password=settings.DB_PASS,
+                db=settings.DB_NAME,
+                ip_type=ip_type,
+                connect_timeout=30,
+            )
         except Exception as e:
             logger.error(f"Failed to connect to Cloud SQL: {e}")
             raise
@@ -154,28 +277,197 @@ def get_conn() -> pymysql.connections.Connection:
             logger.error(f"Failed to connect to local database: {e}")
             raise
 
+class PoolStats:
+    """Thread-safe counters for connection pool activity"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.connect_seconds_total = 0.0
+        self.connect_seconds_max = 0.0
+        self.waits = 0  # Checkouts that had to wait more than 1 ms for a connection
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def record_checkout(self, wait_seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            if wait_seconds > 0.001:
+                self.waits += 1
+                self.wait_seconds_total += wait_seconds
+                self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_connect(self, seconds: float):
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds_total += seconds
+            self.connect_seconds_max = max(self.connect_seconds_max, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_ms_avg": round(self.wait_seconds_total / self.waits * 1000, 2) if self.waits else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 2),
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "connect_ms_avg": round(self.connect_seconds_total / self.connects * 1000, 2) if self.connects else 0.0,
+                "connect_ms_max": round(self.connect_seconds_max * 1000, 2),
+            }
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited and how long new connections took"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        conn = super()._create_connection()
+        pool_stats.record_connect(time.perf_counter() - start)
+        return conn
+
 # Create engine with connection pool settings for Cloud Run
 engine = create_engine(
     "mysql+pymysql://",
     creator=get_conn,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
-    pool_timeout=30,
-    pool_recycle=1800,
+    poolclass=InstrumentedQueuePool,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
 )
 
+def get_pool_stats() -> dict:
+    """Current pool occupancy plus cumulative checkout/connect statistics"""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        **pool_stats.snapshot(),
+    }
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# One thread per pooled connection: blocking DB I/O runs here instead of on the event loop
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+    thread_name_prefix="db",
+)
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking database call on the DB threadpool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+
+class ThreadedQuery:
+    """Query wrapper whose result-producing methods are awaitable.
+
+    Building methods (filter, order_by, ...) return a new ThreadedQuery;
+    methods that hit the database run on the DB threadpool.
+    """
+
+    def __init__(self, query: Query):
+        self.query = query
+
+    def __getattr__(self, name):
+        attr = getattr(self.query, name)
+        if name in ("all", "first", "one", "one_or_none", "scalar", "count", "delete", "update"):
+            return lambda *args, **kwargs: run_db(attr, *args, **kwargs)
+        if callable(attr):
+            def build(*args, **kwargs):
+                result = attr(*args, **kwargs)
+                return ThreadedQuery(result) if isinstance(result, Query) else result
+            return build
+        return attr
+
+class ThreadedSession:
+    """Session wrapper for async routes that runs blocking I/O on the DB threadpool.
+
+    Objects are not expired on commit, so reading attributes after a commit
+    never triggers a hidden refresh on the event loop. ``sync_session`` is
+    the underlying Session for calls known not to do I/O.
+    """
+
+    def __init__(self, sync_session: Session):
+        self.sync_session = sync_session
+
+    def query(self, *entities) -> ThreadedQuery:
+        return ThreadedQuery(self.sync_session.query(*entities))
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def get(self, entity, ident):
+        return await run_db(self.sync_session.get, entity, ident)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_db(self.sync_session.execute, statement, *args, **kwargs)
+
+    async def flush(self):
+        await run_db(self.sync_session.flush)
+
+    async def commit(self):
+        await run_db(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_db(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_db(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance):
+        # Cascades may lazy-load related rows, so this runs on the threadpool too
+        await run_db(self.sync_session.delete, instance)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn(session, *args, **kwargs)`` on the threadpool for multi-step blocking work"""
+        return await run_db(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        await run_db(self.sync_session.close)
+
+def new_session() -> ThreadedSession:
+    """Create a threaded session outside of request dependencies"""
+    return ThreadedSession(SessionLocal(expire_on_commit=False))
+
 def init_db():
-    """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+    """Bring the database schema up to the latest Alembic revision"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.attributes["embedded"] = True  # Keep the application's logging configuration
+    command.upgrade(config, "head")
 
-def get_db():
+async def get_db():
     """Get database session"""
-    db = SessionLocal()
+    db = new_session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
\ No newline at end of file
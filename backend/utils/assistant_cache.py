@@ -0,0 +1,135 @@
+"""Two-level cache of remote OpenAI assistant state"""
+from typing import Dict, Iterable, Optional
+import asyncio
+import logging
+
+from openai import AsyncOpenAI
+from openai.types.beta import Assistant
+
+from utils.config import settings
+from utils.shared_cache import shared_cache
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "assistant-invalidate"
+
+class AssistantStateCache:
+    """TTL/LRU cache of ``assistants.retrieve`` results.
+
+    Local misses fall through to the shared cache, so one instance's fetch
+    serves the others. Concurrent local misses for the same assistant share
+    one in-flight request (singleflight), and batch fetches are limited to
+    ``max_concurrency`` requests at a time. Callers that mutate an assistant
+    must call ``set`` or ``invalidate``; both notify the other instances.
+    """
+
+    def __init__(
+        self,
+        ttl: float = settings.ASSISTANT_CACHE_TTL_SECONDS,
+        max_entries: int = settings.ASSISTANT_CACHE_MAX_ENTRIES,
+        max_concurrency: int = settings.ASSISTANT_FETCH_CONCURRENCY
+    ):
+        self.max_concurrency = max_concurrency
+        self._entries = TTLCache(ttl, max_entries)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._generations: Dict[str, int] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        shared_cache.subscribe(INVALIDATION_CHANNEL, lambda message: self.drop_local(message["assistant_id"]))
+
+    async def get(self, client: AsyncOpenAI, assistant_id: str):
+        """Get an assistant, fetching it from OpenAI on a miss"""
+        assistant = self._entries.get(assistant_id)
+        if assistant is not None:
+            return assistant
+
+        future = self._in_flight.get(assistant_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(client, assistant_id))
+            self._in_flight[assistant_id] = future
+            future.add_done_callback(lambda f: self._forget_in_flight(assistant_id, f))
+        return await asyncio.shield(future)
+
+    async def get_many(self, client: AsyncOpenAI, assistant_ids: Iterable[str]) -> Dict[str, object]:
+        """Get several assistants concurrently; failed lookups map to None"""
+        assistant_ids = list(dict.fromkeys(assistant_ids))
+
+        async def fetch_one(assistant_id: str):
+            try:
+                return await self.get(client, assistant_id)
+            except Exception as e:
+                logger.warning(f"Failed to get OpenAI assistant {assistant_id}: {e}")
+                return None
+
+        results = await asyncio.gather(*(fetch_one(a) for a in assistant_ids))
+        return dict(zip(assistant_ids, results))
+
+    async def set(self, assistant_id: str, assistant):
+        """Store fresh assistant state, e.g. the result of assistants.update"""
+        self.drop_local(assistant_id)
+        self._entries.set(assistant_id, assistant)
+        await self._set_shared(assistant_id, assistant)
+        await shared_cache.publish(INVALIDATION_CHANNEL, {"assistant_id": assistant_id})
+
+    async def invalidate(self, assistant_id: str):
+        """Drop cached state for the assistant on every instance"""
+        self.drop_local(assistant_id)
+        await shared_cache.delete(self._shared_key(assistant_id))
+        await shared_cache.publish(INVALIDATION_CHANNEL, {"assistant_id": assistant_id})
+
+    def drop_local(self, assistant_id: str):
+        """Drop this instance's copy and detach any in-flight fetch, so the next read goes to the shared cache"""
+        self._entries.pop(assistant_id)
+        self._in_flight.pop(assistant_id, None)
+        self._generations[assistant_id] = self._generations.get(assistant_id, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+        self._in_flight.clear()
+        self._generations.clear()
+
+    async def _fetch(self, client: AsyncOpenAI, assistant_id: str):
+        generation = self._generations.get(assistant_id, 0)
+        assistant = await self._get_shared(assistant_id)
+        if assistant is None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            async with self._semaphore:
+                assistant = await client.beta.assistants.retrieve(assistant_id)
+            if self._generations.get(assistant_id, 0) == generation:
+                await self._set_shared(assistant_id, assistant)
+        # Skip storing if the assistant was mutated while this request was in flight
+        if self._generations.get(assistant_id, 0) == generation:
+            self._entries.set(assistant_id, assistant)
+        return assistant
+
+    @staticmethod
+    def _shared_key(assistant_id: str) -> str:
+        return f"assistant:{assistant_id}"
+
+    async def _get_shared(self, assistant_id: str) -> Optional[Assistant]:
+        data = await shared_cache.get_json(self._shared_key(assistant_id))
+        if data is None:
+            return None
+        try:
+            return Assistant.model_validate(data)
+        except Exception as e:
+            # Written by an instance running a different openai version
+            logger.warning(f"Ignoring undecodable shared state for assistant {assistant_id}: {e}")
+            return None
+
+    async def _set_shared(self, assistant_id: str, assistant):
+        try:
+            data = assistant.model_dump(mode="json")
+        except Exception as e:
+            logger.warning(f"Not sharing state for assistant {assistant_id}: {e}")
+            return
+        await shared_cache.set_json(self._shared_key(assistant_id), data, self._entries.ttl)
+
+    def _forget_in_flight(self, assistant_id: str, future: asyncio.Future):
+        if self._in_flight.get(assistant_id) is future:
+            del self._in_flight[assistant_id]
+        if not future.cancelled():
+            future.exception()  # Mark as retrieved; waiters re-raise it themselves
+
+assistant_cache = AssistantStateCache()
@@ -0,0 +1,90 @@
+"""Queries over the assistant_files association table"""
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, insert, select
+
+from models.database import AssistantFile, FileMetadata, ThreadedSession, UserAssistant
+
+async def get_assistant_file_ids(db: ThreadedSession, user_assistant_id: int) -> List[str]:
+    """File ids attached to one assistant, in attachment order"""
+    result = await db.execute(
+        select(AssistantFile.file_id)
+        .where(AssistantFile.user_assistant_id == user_assistant_id)
+        .order_by(AssistantFile.created_at, AssistantFile.file_id)
+    )
+    return list(result.scalars())
+
+async def get_file_ids_by_assistant(db: ThreadedSession, user_assistant_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """File ids for many assistants in a single query, keyed by UserAssistant.id"""
+    file_ids = {user_assistant_id: [] for user_assistant_id in user_assistant_ids}
+    if not file_ids:
+        return file_ids
+    result = await db.execute(
+        select(AssistantFile.user_assistant_id, AssistantFile.file_id)
+        .where(AssistantFile.user_assistant_id.in_(list(file_ids)))
+        .order_by(AssistantFile.created_at, AssistantFile.file_id)
+    )
+    for user_assistant_id, file_id in result:
+        file_ids[user_assistant_id].append(file_id)
+    return file_ids
+
+async def get_assistant_files(db: ThreadedSession, db_assistant: UserAssistant, purpose: Optional[str] = None) -> List[FileMetadata]:
+    """Metadata of the owner's files attached to an assistant, optionally of one purpose"""
+    query = db.query(FileMetadata).join(
+        AssistantFile, AssistantFile.file_id == FileMetadata.file_id
+    ).filter(
+        AssistantFile.user_assistant_id == db_assistant.id,
+        FileMetadata.uploaded_by == db_assistant.user_id
+    )
+    if purpose is not None:
+        query = query.filter(FileMetadata.purpose == purpose)
+    return await query.all()
+
+async def attach_files(db: ThreadedSession, user_assistant_id: int, file_ids: Iterable[str]):
+    """Record attachments, ignoring ones that already exist. The caller commits."""
+    rows = [{"user_assistant_id": user_assistant_id, "file_id": file_id} for file_id in dict.fromkeys(file_ids)]
+    if not rows:
+        return
+    # Concurrent requests may attach the same file; let the database drop the duplicate
+    statement = (
+        insert(AssistantFile)
+        .prefix_with("IGNORE", dialect="mysql")
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    )
+    await db.execute(statement, rows)
+
+async def detach_files(db: ThreadedSession, user_assistant_id: int, file_ids: Iterable[str]) -> int:
+    """Remove attachments; returns how many existed. The caller commits."""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return 0
+    result = await db.execute(
+        delete(AssistantFile).where(
+            AssistantFile.user_assistant_id == user_assistant_id,
+            AssistantFile.file_id.in_(file_ids)
+        )
+    )
+    return result.rowcount
+
+async def is_file_attached_elsewhere(db: ThreadedSession, user_id: int, file_id: str, user_assistant_id: int) -> bool:
+    """Whether any other assistant of the user still has the file attached"""
+    result = await db.execute(
+        select(AssistantFile.user_assistant_id)
+        .join(UserAssistant, UserAssistant.id == AssistantFile.user_assistant_id)
+        .where(
+            AssistantFile.file_id == file_id,
+            AssistantFile.user_assistant_id != user_assistant_id,
+            UserAssistant.user_id == user_id
+        )
+        .limit(1)
+    )
+    return result.first() is not None
+
+async def get_assistants_with_file(db: ThreadedSession, user_id: int, file_id: str) -> List[UserAssistant]:
+    """The user's assistants that have the file attached"""
+    return await db.query(UserAssistant).join(
+        AssistantFile, AssistantFile.user_assistant_id == UserAssistant.id
+    ).filter(
+        AssistantFile.file_id == file_id,
+        UserAssistant.user_id == user_id
+    ).all()
@@ -0,0 +1,224 @@
+"""Bounded on-disk LRU cache of OpenAI file contents"""
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+@dataclass
+class BlobEntry:
+    file_id: str
+    size: int
+    content_type: str
+    filename: str
+    etag: str  # Strong ETag: quoted SHA-256 of the content
+
+def content_type_for(filename: str) -> str:
+    """Guess the content type of an assistant-generated file from its name"""
+    if filename.lower().endswith(IMAGE_EXTENSIONS):
+        content_type = f"image/{filename.split('.')[-1].lower()}"
+        return "image/jpeg" if content_type == "image/jpg" else content_type
+    return "application/octet-stream"
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def parse_byte_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into inclusive (start, end) offsets.
+
+    Returns None when the whole file should be served (no header, multiple
+    ranges or an unparseable header); raises RangeNotSatisfiable for
+    ranges outside the file.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            suffix_length = int(end_text)
+            if suffix_length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix_length, 0), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+async def iter_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Yield bytes ``start`` through ``end`` (inclusive) of a file, reading off the event loop"""
+    with open(path, "rb") as f:
+        await run_in_threadpool(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await run_in_threadpool(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class BlobCache:
+    """LRU cache of OpenAI file bytes stored under ``directory``.
+
+    Each file id maps to a ``.bin`` file plus a ``.json`` sidecar holding
+    its content type, filename and ETag, so the index survives restarts.
+    Concurrent misses for one file id share a single download, and the
+    least recently used blobs are deleted once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, directory: str = settings.BLOB_CACHE_DIR, max_bytes: int = settings.BLOB_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, BlobEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._loaded = False
+        self._load_lock: Optional[asyncio.Lock] = None
+
+    def path_for(self, file_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(file_id.encode()).hexdigest() + ".bin")
+
+    async def get(self, client: AsyncOpenAI, file_id: str) -> BlobEntry:
+        """Get a cached blob, downloading it from OpenAI on a miss"""
+        if not self._loaded:
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                if not self._loaded:
+                    await run_in_threadpool(self._load_index)
+
+        entry = self._entries.get(file_id)
+        if entry is not None and os.path.exists(self.path_for(file_id)):
+            self._entries.move_to_end(file_id)
+            return entry
+
+        future = self._in_flight.get(file_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(client, file_id))
+            self._in_flight[file_id] = future
+            future.add_done_callback(lambda f: self._forget_in_flight(file_id, f))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, client: AsyncOpenAI, file_id: str) -> BlobEntry:
+        path = self.path_for(file_id)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+
+        async def download():
+            nonlocal size
+            async with client.files.with_streaming_response.content(file_id) as response:
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.iter_bytes():
+                        digest.update(chunk)
+                        size += len(chunk)
+                        await run_in_threadpool(f.write, chunk)
+
+        async def describe():
+            try:
+                file_info = await client.files.retrieve(file_id)
+                filename = getattr(file_info, 'filename', None) or f'{file_id}.png'
+                return filename, content_type_for(filename)
+            except Exception:
+                # Default to PNG if we can't get file info
+                return f"{file_id}.png", "image/png"
+
+        try:
+            (_, (filename, content_type)) = await asyncio.gather(download(), describe())
+            entry = BlobEntry(
+                file_id=file_id,
+                size=size,
+                content_type=content_type,
+                filename=filename,
+                etag=f'"{digest.hexdigest()}"'
+            )
+            await run_in_threadpool(self._commit_blob, tmp_path, path, entry)
+        except BaseException:
+            await run_in_threadpool(self._remove, tmp_path)
+            raise
+
+        self._store(entry)
+        await self._evict()
+        return entry
+
+    def _commit_blob(self, tmp_path: str, path: str, entry: BlobEntry):
+        os.replace(tmp_path, path)
+        with open(path[:-len(".bin")] + ".json", "w") as f:
+            json.dump(asdict(entry), f)
+
+    def _store(self, entry: BlobEntry):
+        previous = self._entries.pop(entry.file_id, None)
+        if previous is not None:
+            self._total_bytes -= previous.size
+        self._entries[entry.file_id] = entry
+        self._total_bytes += entry.size
+
+    async def _evict(self):
+        doomed = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            doomed.append(self.path_for(entry.file_id))
+        for path in doomed:
+            await run_in_threadpool(self._remove, path, path[:-len(".bin")] + ".json")
+
+    @staticmethod
+    def _remove(*paths: str):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self):
+        """Rebuild the in-memory index from sidecars, oldest first"""
+        os.makedirs(self.directory, exist_ok=True)
+        sidecars = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                self._remove(path)  # Left over from an interrupted download
+            elif name.endswith(".json"):
+                sidecars.append((os.path.getmtime(path), path))
+        for _, path in sorted(sidecars):
+            try:
+                with open(path) as f:
+                    entry = BlobEntry(**json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Dropping unreadable blob cache entry {path}: {e}")
+                self._remove(path, path[:-len(".json")] + ".bin")
+                continue
+            self._store(entry)
+        self._loaded = True
+        logger.info(f"Blob cache loaded {len(self._entries)} entries ({self._total_bytes} bytes)")
+
+    def _forget_in_flight(self, file_id: str, future: asyncio.Future):
+        if self._in_flight.get(file_id) is future:
+            del self._in_flight[file_id]
+        if not future.cancelled():
+            future.exception()  # Mark as retrieved; waiters re-raise it themselves
+
+blob_cache = BlobCache()
@@ -0,0 +1,313 @@
+"""Background execution of chat runs"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+import asyncio
+import json
+import logging
+import uuid
+
+from sqlalchemy import update
+
+from models.database import ThreadedSession, new_session, ChatJob, UserAssistant
+from utils.config import settings
+from utils.openai_client import get_openai_client
+from utils.openai_governor import set_openai_user
+from utils.shared_cache import shared_cache
+from utils.thread_runs import Turn, submit_user_message
+from utils.websocket import manager
+
+logger = logging.getLogger(__name__)
+
+CHAT_JOB_TASK = "chat_jobs.run"
+JOB_EVENTS_CHANNEL = "chat-job-events"
+
+async def create_chat_job(
+    db: ThreadedSession,
+    db_assistant: UserAssistant,
+    content: str,
+    file_ids: Optional[List[str]] = None
+) -> ChatJob:
+    """Record a message to send on the assistant's current thread; the caller enqueues it"""
+    job = ChatJob(
+        id=str(uuid.uuid4()),
+        user_id=db_assistant.user_id,
+        user_assistant_id=db_assistant.id,
+        assistant_id=db_assistant.assistant_id,
+        thread_id=db_assistant.thread_id,
+        status="queued",
+        message=content,
+        file_ids=json.dumps(file_ids) if file_ids else None,
+        created_at=datetime.now(timezone.utc)
+    )
+    db.add(job)
+    await db.commit()
+    return job
+
+def format_job(job: ChatJob) -> dict:
+    """Format a job's status (and its reply, once completed) for the frontend"""
+    result = {
+        "job_id": job.id,
+        "status": job.status,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == "completed":
+        result["data"] = {
+            "message_id": job.message_id,
+            "content": job.content or "",
+            "attachments": json.loads(job.attachments) if job.attachments else None
+        }
+    elif job.status == "failed":
+        result["error"] = job.error
+    return result
+
+async def publish_job_event(assistant_id: str, event: dict):
+    """Send a job event to WebSocket clients of the assistant on every instance"""
+    await manager.broadcast_to_conversation(assistant_id, event)
+    await shared_cache.publish(JOB_EVENTS_CHANNEL, {"assistant_id": assistant_id, "event": event})
+
+def _relay_job_event(message: dict):
+    # Called from the shared cache listener for events published elsewhere (e.g. a Celery worker)
+    asyncio.ensure_future(manager.broadcast_to_conversation(message["assistant_id"], message["event"]))
+
+shared_cache.subscribe(JOB_EVENTS_CHANNEL, _relay_job_event)
+
+async def _claim_job(db: ThreadedSession, job_id: str) -> bool:
+    """Move a queued job to running; False if another worker already took it"""
+    result = await db.execute(
+        update(ChatJob)
+        .where(ChatJob.id == job_id, ChatJob.status == "queued")
+        .values(status="running", started_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def _load_job(job_id: str) -> Optional[Tuple[ChatJob, Optional[UserAssistant]]]:
+    """Claim a queued job and load it with its assistant, releasing the connection before the run"""
+    db = new_session()
+    try:
+        if not await _claim_job(db, job_id):
+            return None
+        job = await db.get(ChatJob, job_id)
+        db_assistant = await db.get(UserAssistant, job.user_assistant_id)
+        return job, db_assistant  # Attributes stay loaded after close (expire_on_commit=False)
+    finally:
+        await db.close()
+
+async def _update_running_job(job_id: str, values: dict) -> bool:
+    """Update a job that is still running; False if the sweeper already failed it"""
+    db = new_session()
+    try:
+        result = await db.execute(
+            update(ChatJob)
+            .where(ChatJob.id == job_id, ChatJob.status == "running")
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount == 1
+    finally:
+        await db.close()
+
+async def _mark_run_started(job_id: str, turn: Turn):
+    # The job may wait behind other turns on the thread; the sweeper measures from the run itself
+    await turn.started.wait()
+    await _update_running_job(job_id, {"started_at": datetime.now(timezone.utc)})
+
+async def execute_chat_job(job_id: str):
+    """Post a queued job's message and run its thread, storing the reply and streaming events.
+
+    No database connection is held during the run: the job is loaded and
+    claimed in one short session and its result written in another.
+    """
+    loaded = await _load_job(job_id)
+    if loaded is None:
+        return
+    job, db_assistant = loaded
+    set_openai_user(job.user_id)
+    await publish_job_event(job.assistant_id, {"type": "job_started", "job_id": job.id})
+
+    result = {"status": "failed", "error": "Run ended without a reply"}
+    final_event = None
+    run_started = None
+    try:
+        if db_assistant is None or db_assistant.thread_id != job.thread_id:
+            raise ValueError("The assistant's thread was replaced before the job ran")
+        # Shares the thread's run queue with interactive messages
+        turn = submit_user_message(
+            get_openai_client(), db_assistant, job.message or "",
+            json.loads(job.file_ids) if job.file_ids else None, stream=True
+        )
+        run_started = asyncio.create_task(_mark_run_started(job_id, turn))
+        async for event in turn.events():
+            if event["type"] == "complete":
+                result = {
+                    "status": "completed",
+                    "run_id": event["run_id"],
+                    "message_id": event["message_id"],
+                    "content": event["content"],
+                    "attachments": json.dumps(event["attachments"]) if event["attachments"] else None
+                }
+            elif event["type"] == "error":
+                result = {"status": "failed", "error": event["message"]}
+            if event["type"] in ("complete", "error"):
+                final_event = event
+            else:
+                await publish_job_event(job.assistant_id, {**event, "job_id": job.id})
+        result["conversation_id"] = turn.conversation_id
+    except Exception as e:
+        logger.error(f"Chat job {job_id} failed: {e}")
+        result = {"status": "failed", "error": f"Failed to run assistant: {str(e)}"}
+    finally:
+        if run_started is not None:
+            if not turn.started.is_set():
+                run_started.cancel()  # Only while waiting; a started update runs to completion
+            await asyncio.gather(run_started, return_exceptions=True)
+
+    if not await _update_running_job(job_id, {**result, "finished_at": datetime.now(timezone.utc)}):
+        # Keep the status clients may already have seen
+        logger.warning(f"Chat job {job_id} finished after it was failed as interrupted")
+        result = {"status": "failed", "error": "Interrupted"}
+    if result["status"] == "failed":
+        final_event = {"type": "error", "message": result["error"]}
+    # Published after the commit so the status endpoint agrees with the event
+    await publish_job_event(job.assistant_id, {**final_event, "job_id": job.id})
+
+async def fail_interrupted_chat_jobs() -> int:
+    """Fail running jobs that have outlived any run, i.e. whose worker died; returns how many"""
+    db = new_session()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.RUN_TIMEOUT_SECONDS + 60)
+        result = await db.execute(
+            update(ChatJob)
+            .where(ChatJob.status == "running", ChatJob.started_at < cutoff)
+            .values(status="failed", error="Interrupted", finished_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount
+    finally:
+        await db.close()
+
+async def recover_chat_jobs() -> List[str]:
+    """Fail jobs whose worker died mid-run and return the ids still waiting in the queued state"""
+    await fail_interrupted_chat_jobs()
+    db = new_session()
+    try:
+        return [job_id for (job_id,) in await db.query(ChatJob.id).filter(
+            ChatJob.status == "queued"
+        ).order_by(ChatJob.created_at).all()]
+    finally:
+        await db.close()
+
+class ChatJobQueue(ABC):
+    """Where queued chat jobs are sent for execution.
+
+    While started, jobs left running by a dead worker are failed every
+    ``CHAT_JOB_RECOVERY_INTERVAL_SECONDS``, not only at startup.
+    """
+
+    def __init__(self, recovery_interval: float = settings.CHAT_JOB_RECOVERY_INTERVAL_SECONDS):
+        self.recovery_interval = recovery_interval
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def enqueue(self, job_id: str):
+        ...
+
+    async def start(self):
+        if self.recovery_interval > 0 and (self._sweeper is None or self._sweeper.done()):
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.recovery_interval)
+            try:
+                failed = await fail_interrupted_chat_jobs()
+                if failed:
+                    logger.warning(f"Failed {failed} interrupted chat jobs")
+            except Exception as e:
+                logger.error(f"Failed to sweep interrupted chat jobs: {e}")
+
+class AsyncioJobQueue(ChatJobQueue):
+    """Run jobs on this instance's event loop with a fixed number of worker tasks.
+
+    Jobs still queued from before a restart are picked up again on start. On
+    Cloud Run this needs CPU allocated outside requests; otherwise use Celery.
+    """
+
+    def __init__(self, workers: int = settings.CHAT_JOB_WORKERS):
+        super().__init__()
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def enqueue(self, job_id: str):
+        if self._queue is None:
+            await self.start()
+        self._queue.put_nowait(job_id)
+
+    async def start(self):
+        if self._tasks:
+            return
+        await super().start()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            for job_id in await recover_chat_jobs():
+                self._queue.put_nowait(job_id)
+        except Exception as e:
+            logger.error(f"Failed to recover queued chat jobs: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        await super().stop()
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await execute_chat_job(job_id)
+            except Exception as e:
+                logger.error(f"Chat job {job_id} crashed: {e}")
+
+class CeleryJobQueue(ChatJobQueue):
+    """Send jobs to Celery workers (``celery -A celery_worker worker``)"""
+
+    async def start(self):
+        await super().start()
+        # Queued jobs are still in the broker; only runs orphaned by a dead worker need failing
+        try:
+            await fail_interrupted_chat_jobs()
+        except Exception as e:
+            logger.error(f"Failed to recover chat jobs: {e}")
+
+    async def enqueue(self, job_id: str):
+        from celery_worker import celery_app  # Only needed when this backend is configured
+        # Publishing to the broker blocks, so keep it off the event loop
+        await asyncio.to_thread(celery_app.send_task, CHAT_JOB_TASK, args=[job_id])
+
+def create_job_queue() -> ChatJobQueue:
+    if settings.CHAT_JOB_BACKEND == "celery":
+        return CeleryJobQueue()
+    if settings.CHAT_JOB_BACKEND != "asyncio":
+        logger.warning(f"Unknown CHAT_JOB_BACKEND {settings.CHAT_JOB_BACKEND!r}, using asyncio")
+    return AsyncioJobQueue()
+
+chat_job_queue = create_job_queue()
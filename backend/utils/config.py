@@ -5,6 +5,39 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
+    OPENAI_MAX_RETRIES: int = 2
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    OPENAI_HTTP2: bool = True
+
+    # OpenAI rate governor (limits of 0 are learned from x-ratelimit-* response headers)
+    OPENAI_RATE_GOVERNOR: bool = True
+    OPENAI_REQUESTS_PER_MINUTE: int = 0
+    OPENAI_TOKENS_PER_MINUTE: int = 0
+    OPENAI_RATE_LIMIT_HEADROOM: float = 0.9  # Fraction of the org limits to spend
+    OPENAI_RATE_LIMIT_MAX_RETRIES: int = 4  # 429 retries before the error reaches the caller
+    OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS: float = 30.0  # Longest a call queues for budget
+    OPENAI_RUN_TOKEN_ESTIMATE: int = 2000  # Tokens reserved when starting a run, corrected by its usage
+
+    # Assistants run polling
+    RUN_POLL_MIN_INTERVAL_SECONDS: float = 0.5
+    RUN_POLL_MAX_INTERVAL_SECONDS: float = 5.0
+    RUN_TIMEOUT_SECONDS: float = 600.0
+    THREAD_RUN_COALESCE_SECONDS: float = 0.3  # Window for batching a burst of messages into one run
+
+    # Background chat runs ("asyncio" runs them on this instance; "celery" sends them to celery_worker)
+    CHAT_JOB_BACKEND: str = "asyncio"
+    CHAT_JOB_WORKERS: int = 4
+    CHAT_JOB_RECOVERY_INTERVAL_SECONDS: float = 300.0  # How often jobs orphaned by a dead worker are failed
+    CELERY_BROKER_URL: Optional[str] = None  # Defaults to REDIS_URL
+
+    # Remote assistant state cache
+    ASSISTANT_CACHE_TTL_SECONDS: float = 300.0
+    ASSISTANT_CACHE_MAX_ENTRIES: int = 1024
+    ASSISTANT_FETCH_CONCURRENCY: int = 8
+    TOOL_RESOURCES_DEBOUNCE_SECONDS: float = 0.05  # Window for coalescing file attachment changes
     
     # Database
     DB_USER: str = "root"
@@ -12,14 +45,64 @@ class Settings(BaseSettings):
     DB_NAME: str = "multiagent_db"
     DB_HOST: str = "localhost"
     INSTANCE_CONNECTION_NAME: Optional[str] = None
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    RUN_MIGRATIONS_ON_STARTUP: bool = True  # Disable when migrations run as a separate deploy step
+
+    # Dashboard counters
+    STATS_RECONCILE_ENABLED: bool = True
+    STATS_RECONCILE_HOUR_UTC: int = 3  # Nightly recount of every user's counters
+    PROFILE_STATS_CACHE_TTL_SECONDS: float = 30.0  # Bounds staleness from writes racing a cache fill
+    PROFILE_STATS_CACHE_MAX_ENTRIES: int = 4096
     
     # JWT
     SECRET_KEY: str = "development-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    AUTH_CACHE_TTL_SECONDS: float = 60.0
+    AUTH_CACHE_MAX_ENTRIES: int = 4096
+
+    # Password hashing
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
     
-    # Redis
+    # File uploads
+    # Cloud Run rejects HTTP/1 request bodies over 32 MiB; this leaves 1 MiB for multipart overhead
+    UPLOAD_MAX_BYTES: int = 31 * 1024 * 1024
+    UPLOAD_DIRECT_MAX_BYTES: int = 25 * 1024 * 1024  # Larger files go through the Uploads API in parts
+    UPLOAD_PART_SIZE_BYTES: int = 8 * 1024 * 1024
+    UPLOAD_PART_CONCURRENCY: int = 4
+    UPLOAD_BATCH_MAX_FILES: int = 20
+    UPLOAD_BATCH_CONCURRENCY: int = 4
+
+    # Image thumbnails
+    THUMBNAIL_WORKERS: int = 1
+    THUMBNAIL_MAX_SIZE: int = 256
+    THUMBNAIL_JPEG_QUALITY: int = 80
+    THUMBNAIL_MAX_SOURCE_BYTES: int = 25 * 1024 * 1024
+
+    # On-disk cache of OpenAI file contents (Cloud Run's /tmp counts against instance memory)
+    BLOB_CACHE_DIR: str = "/tmp/openai-blob-cache"
+    BLOB_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Shared cache and coordination ("redis" shares state across instances; "memory" is per instance)
+    CACHE_BACKEND: str = "memory"
+    CACHE_KEY_PREFIX: str = "vma:"
+    CACHE_MEMORY_MAX_ENTRIES: int = 10000
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_SOCKET_TIMEOUT_SECONDS: float = 1.0
+
+    # Per-user request limits, counted in the shared cache
+    RATE_LIMIT_WINDOW_SECONDS: float = 60.0
+    LOGIN_RATE_LIMIT: int = 10
+    CHAT_RATE_LIMIT: int = 30
+
+    # Idempotency-Key results (pending entries outlive the longest run so a dead holder's key frees up)
+    IDEMPOTENCY_TTL_SECONDS: float = 3600.0
+    IDEMPOTENCY_PENDING_TTL_SECONDS: float = 660.0
     
     # CORS
     FRONTEND_URL: str = "http://localhost:5173"
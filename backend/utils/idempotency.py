@@ -0,0 +1,112 @@
+"""Idempotency-Key handling for endpoints that start expensive work"""
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import time
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from utils.config import settings
+from utils.shared_cache import shared_cache
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL_SECONDS = 0.5
+
+# Operations running on this instance: cache key -> (fingerprint, future of the stored result)
+_in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+def request_fingerprint(*parts) -> str:
+    """Digest of the request fields a retry must repeat exactly"""
+    return hashlib.sha256(json.dumps(jsonable_encoder(parts), sort_keys=True).encode()).hexdigest()
+
+def _check_fingerprint(stored_fingerprint: str, fingerprint: str):
+    if stored_fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request"
+        )
+
+def _capture(result) -> dict:
+    if isinstance(result, Response):
+        return {"status_code": result.status_code, "body": json.loads(result.body) if result.body else None}
+    return {"status_code": status.HTTP_200_OK, "body": jsonable_encoder(result)}
+
+def _replay(stored: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=stored["status_code"],
+        content=stored["body"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def _wait_for_result(cache_key: str, fingerprint: str) -> Optional[dict]:
+    """Wait for another instance's attempt; None if it failed and released the key"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_PENDING_TTL_SECONDS
+    while time.monotonic() < deadline:
+        entry = await shared_cache.get_json(cache_key)
+        if entry is None:
+            return None
+        _check_fingerprint(entry["fingerprint"], fingerprint)
+        if entry["state"] == "done":
+            return entry
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this Idempotency-Key is still in progress"
+    )
+
+async def run_idempotent(
+    scope: str,
+    user_id: int,
+    key: Optional[str],
+    fingerprint: str,
+    operation: Callable[[], Awaitable[Any]]
+):
+    """Run ``operation`` at most once per user and ``Idempotency-Key``.
+
+    A retry while the first attempt is running waits for it; a retry after it
+    succeeded gets its stored JSON response (for ``IDEMPOTENCY_TTL_SECONDS``).
+    Failed attempts are not stored, so a retry with the same key runs again.
+    Without a key the operation simply runs.
+    """
+    if key is None:
+        return await operation()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"
+        )
+    cache_key = f"idempotency:{scope}:{user_id}:{key}"
+
+    while True:
+        local = _in_flight.get(cache_key)
+        if local is not None:
+            _check_fingerprint(local[0], fingerprint)
+            stored = await asyncio.shield(local[1])
+        else:
+            pending = json.dumps({"state": "pending", "fingerprint": fingerprint})
+            if await shared_cache.add(cache_key, pending, settings.IDEMPOTENCY_PENDING_TTL_SECONDS):
+                break
+            stored = await _wait_for_result(cache_key, fingerprint)
+        if stored is not None:
+            _check_fingerprint(stored["fingerprint"], fingerprint)
+            return _replay(stored)
+        # The attempt we waited for failed; try to claim the key ourselves
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[cache_key] = (fingerprint, future)
+    try:
+        result = await operation()
+    except BaseException:
+        await shared_cache.delete(cache_key)
+        future.set_result(None)
+        raise
+    else:
+        stored = {"state": "done", "fingerprint": fingerprint, **_capture(result)}
+        await shared_cache.set_json(cache_key, stored, settings.IDEMPOTENCY_TTL_SECONDS)
+        future.set_result(stored)
+        return result
+    finally:
+        _in_flight.pop(cache_key, None)
@@ -0,0 +1,198 @@
+"""Local mirror of OpenAI thread messages"""
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+import json
+import logging
+
+from openai import AsyncOpenAI
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.database import ThreadedSession, new_session, Conversation, ConversationMessage, UserAssistant
+from utils.user_stats import update_user_stats, count_messages_today, invalidate_profile_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def message_parts(msg) -> Tuple[str, List[dict]]:
+    """Extract the text and image attachments from an OpenAI thread message"""
+    text = ""
+    attachments = []
+    for content in msg.content:
+        if content.type == 'text':
+            text += content.text.value
+        elif content.type == 'image_file':
+            attachments.append({
+                "file_id": content.image_file.file_id,
+                "type": "image"
+            })
+    return text, attachments
+
+def run_total_tokens(run) -> int:
+    """Total tokens billed for a run, or 0 if usage is not reported"""
+    usage = getattr(run, "usage", None)
+    return (getattr(usage, "total_tokens", None) or 0) if usage else 0
+
+async def get_or_create_conversation(db: ThreadedSession, db_assistant: UserAssistant) -> Conversation:
+    """Get the conversation that mirrors the assistant's current thread"""
+    conversation = await db.query(Conversation).filter(
+        Conversation.user_assistant_id == db_assistant.id,
+        Conversation.thread_id == db_assistant.thread_id
+    ).first()
+    if conversation is None:
+        conversation = Conversation(
+            user_id=db_assistant.user_id,
+            user_assistant_id=db_assistant.id,
+            thread_id=db_assistant.thread_id,
+            title=db_assistant.name
+        )
+        db.add(conversation)
+        await db.commit()
+        invalidate_profile_stats(db_assistant.user_id)
+        await db.refresh(conversation)
+    return conversation
+
+async def store_message(db: ThreadedSession, conversation: Conversation, msg) -> Optional[ConversationMessage]:
+    """Add an OpenAI thread message to the conversation unless it is already stored"""
+    exists = await db.query(ConversationMessage.id).filter(
+        ConversationMessage.conversation_id == conversation.id,
+        ConversationMessage.message_id == msg.id
+    ).first()
+    if exists:
+        return None
+
+    text, attachments = message_parts(msg)
+    row = ConversationMessage(
+        conversation_id=conversation.id,
+        message_id=msg.id,
+        role=msg.role,
+        content=text,
+        attachments=json.dumps(attachments) if attachments else None,
+        created_at=datetime.fromtimestamp(msg.created_at, tz=timezone.utc)
+    )
+    if not await db.run(_insert_once, row):
+        return None
+    conversation.last_message_id = msg.id
+    return row
+
+def _insert_once(session: Session, row: ConversationMessage) -> bool:
+    # Overlapping syncs of one thread can both pass the check above; the unique
+    # index rejects the second insert, and the savepoint keeps the rest of the sync
+    try:
+        with session.begin_nested():
+            session.add(row)
+    except IntegrityError:
+        return False
+    return True
+
+async def sync_thread_messages(
+    db: ThreadedSession,
+    client: AsyncOpenAI,
+    conversation: Conversation,
+    run_id: Optional[str] = None,
+    run_tokens: int = 0
+) -> list:
+    """Fetch messages newer than the conversation's cursor and store them.
+
+    ``run_tokens`` is recorded on the first new assistant message produced
+    by ``run_id``. Returns the newly stored OpenAI messages, oldest first.
+    """
+    params = {"thread_id": conversation.thread_id, "order": "asc", "limit": 100}
+    if conversation.last_message_id:
+        params["after"] = conversation.last_message_id
+
+    new_messages = []
+    new_rows = []
+    tokens = 0
+    async for msg in client.beta.threads.messages.list(**params):
+        row = await store_message(db, conversation, msg)
+        if row is not None:
+            new_messages.append(msg)
+            new_rows.append(row)
+            if run_tokens and not tokens and msg.role == "assistant" and getattr(msg, "run_id", None) == run_id:
+                row.token_count = tokens = run_tokens
+
+    conversation.last_synced_at = datetime.now(timezone.utc)
+    await update_user_stats(
+        db, conversation.user_id,
+        messages_today=count_messages_today(row.created_at for row in new_rows),
+        tokens=tokens
+    )
+    await db.commit()
+    if new_messages:
+        logger.info(f"Synced {len(new_messages)} messages for thread {conversation.thread_id}")
+    return new_messages
+
+async def ensure_synced(db: ThreadedSession, client: AsyncOpenAI, conversation: Conversation):
+    """Backfill a conversation from OpenAI the first time it is read"""
+    if conversation.last_synced_at is None:
+        await sync_thread_messages(db, client, conversation)
+
+async def record_user_message(
+    db: ThreadedSession,
+    client: AsyncOpenAI,
+    db_assistant: UserAssistant,
+    msg
+) -> Conversation:
+    """Mirror a just-posted user message, backfilling the thread first if needed"""
+    conversation = await get_or_create_conversation(db, db_assistant)
+    await ensure_synced(db, client, conversation)
+    row = await store_message(db, conversation, msg)
+    if row is not None:
+        await update_user_stats(db, conversation.user_id, messages_today=count_messages_today([row.created_at]))
+    await db.commit()
+    return conversation
+
+async def sync_conversation(
+    client: AsyncOpenAI,
+    conversation_id: int,
+    run_id: Optional[str] = None,
+    run_tokens: int = 0
+) -> list:
+    """Sync a conversation using its own session (for use after a response has started streaming)"""
+    db = new_session()
+    try:
+        conversation = await db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if conversation is None:
+            return []
+        return await sync_thread_messages(db, client, conversation, run_id, run_tokens)
+    finally:
+        await db.close()
+
+def format_message(row: ConversationMessage) -> dict:
+    """Format a stored message for the frontend"""
+    attachments = json.loads(row.attachments) if row.attachments else None
+    return {
+        "id": row.message_id,
+        "role": row.role,
+        "content": row.content,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "attachments": attachments or None
+    }
+
+async def get_message_page(
+    db: ThreadedSession,
+    conversation: Conversation,
+    before: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[ConversationMessage], Optional[int]]:
+    """Get the newest messages older than the ``before`` cursor, oldest first.
+
+    Returns the page and the cursor for the next (older) page, or None if
+    this page reaches the start of the conversation.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.query(ConversationMessage).filter(
+        ConversationMessage.conversation_id == conversation.id
+    )
+    if before is not None:
+        query = query.filter(ConversationMessage.id < before)
+    rows = await query.order_by(ConversationMessage.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    next_cursor = rows[0].id if has_more and rows else None
+    return rows, next_cursor
@@ -0,0 +1,64 @@
+"""Shared async OpenAI client with a pooled HTTP transport"""
+from typing import Optional
+import logging
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from utils.config import settings
+from utils.openai_governor import GovernedTransport
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[AsyncOpenAI] = None
+
+def _http2_enabled() -> bool:
+    """HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it"""
+    if not settings.OPENAI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.info("h2 not installed, OpenAI client using HTTP/1.1")
+        return False
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Create the pooled httpx transport shared by every OpenAI request"""
+    transport = httpx.AsyncHTTPTransport(
+        http2=_http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
+    if settings.OPENAI_RATE_GOVERNOR:
+        # Every call (including streamed runs) waits for rate budget and retries 429s
+        transport = GovernedTransport(transport)
+    return DefaultAsyncHttpxClient(
+        transport=transport,
+        timeout=httpx.Timeout(settings.OPENAI_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+def get_openai_client() -> AsyncOpenAI:
+    """Get the process-wide AsyncOpenAI client (FastAPI dependency)"""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            http_client=_build_http_client(),
+        )
+        logger.info(
+            f"OpenAI client initialized (max_connections={settings.OPENAI_MAX_CONNECTIONS}, "
+            f"keepalive={settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS})"
+        )
+    return _client
+
+async def close_openai_client():
+    """Close the shared client and release pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
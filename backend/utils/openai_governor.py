@@ -0,0 +1,348 @@
+"""Client-side rate governor for every OpenAI request"""
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Optional, Tuple
+import asyncio
+import logging
+import math
+import random
+import re
+import time
+
+import httpx
+from fastapi import HTTPException, status
+from openai import RateLimitError
+
+from utils.config import settings
+from utils.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+PAUSE_CHANNEL = "openai-pause"
+MAX_BACKOFF_SECONDS = 30.0
+
+# Whose behalf OpenAI calls in this context are made on; None for background work
+_openai_user: ContextVar[Optional[Any]] = ContextVar("openai_user", default=None)
+
+def set_openai_user(user_id: Optional[Any]):
+    """Attribute OpenAI calls made from the current task (and tasks it starts) to a user"""
+    _openai_user.set(user_id)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations such as ``20ms``, ``1s`` or ``6m0s``"""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+def _int_header(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """How long OpenAI asked us to wait, from ``retry-after(-ms)`` or the rate-limit reset headers"""
+    try:
+        return float(headers["retry-after-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        pass
+    resets = [_parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) for kind in ("requests", "tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+class TokenBucket:
+    """Budget of ``per_minute`` units refilled continuously; a limit of 0 means unlimited"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = 0.0
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.configure(per_minute)
+
+    @property
+    def limited(self) -> bool:
+        return self.capacity > 0
+
+    def configure(self, per_minute: float):
+        self._refill()
+        if per_minute == self.capacity:
+            return
+        self.level = per_minute if self.capacity <= 0 else min(self.level, per_minute)
+        self.capacity = per_minute
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available"""
+        if not self.limited:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float):
+        """Spend ``amount`` units; negative amounts refund over-estimates"""
+        if self.limited:
+            self._refill()
+            self.level = min(self.capacity, self.level - min(amount, self.capacity))
+
+    def sync(self, remaining: float):
+        """Lower the level to what the server reports is left (it counts every instance)"""
+        if self.limited:
+            self._refill()
+            self.level = min(self.level, remaining)
+
+class GovernorTimeout(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"No OpenAI budget within the wait limit; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class RateGovernor:
+    """Request and token budgets shared by every OpenAI call on this instance.
+
+    Calls take one request and their estimated tokens from two token
+    buckets sized to ``OPENAI_RATE_LIMIT_HEADROOM`` of the org limits, which
+    come from settings or are learned from OpenAI's ``x-ratelimit-*``
+    headers. The remaining counts in those headers cover every instance, so
+    each response also pulls the local buckets down to them. A 429 pauses
+    all calls, here and (through the shared cache) on other instances, for
+    its ``Retry-After``. While the budget is short, waiting calls are granted
+    round-robin by user so a busy user cannot starve the others.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = settings.OPENAI_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = settings.OPENAI_TOKENS_PER_MINUTE,
+        headroom: float = settings.OPENAI_RATE_LIMIT_HEADROOM,
+        max_wait: float = settings.OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS
+    ):
+        self.headroom = headroom
+        self.max_wait = max_wait
+        self.requests = TokenBucket(requests_per_minute * headroom)
+        self.tokens = TokenBucket(tokens_per_minute * headroom)
+        self.paused_until = 0.0  # time.monotonic() deadline from the last Retry-After
+        self._queues: "OrderedDict[Any, Deque[Tuple[int, asyncio.Future]]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _wait_time(self, cost: int) -> float:
+        return max(
+            self.paused_until - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(cost)
+        )
+
+    def _take(self, cost: int):
+        self.requests.take(1)
+        self.tokens.take(cost)
+
+    async def acquire(self, cost: int = 0):
+        """Wait for budget for one request estimated at ``cost`` tokens"""
+        if not self._queues and self._wait_time(cost) <= 0:
+            self._take(cost)
+            return
+
+        loop = asyncio.get_running_loop()
+        waiter = (cost, loop.create_future())
+        self._queues.setdefault(_openai_user.get(), deque()).append(waiter)
+        self._ensure_started()
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter[1].done():
+                return  # Granted just as the wait ran out
+            raise GovernorTimeout(max(1.0, self._wait_time(cost)))
+        finally:
+            # Granted waiters are already gone; cancelled or timed-out ones are dropped by the dispatcher
+            waiter[1].cancel()
+
+    def charge(self, tokens: int):
+        """Adjust the token budget once a call's real usage is known (negative refunds)"""
+        self.tokens.take(tokens)
+
+    def observe(self, headers: httpx.Headers):
+        """Learn limits and remaining budget from a response's rate-limit headers"""
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            limit = _int_header(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if limit:
+                bucket.configure(limit * self.headroom)
+                if remaining is not None:
+                    # Keep the headroom in reserve rather than spending down to zero
+                    bucket.sync(remaining - limit * (1 - self.headroom))
+
+    def pause(self, seconds: float, share: bool = True):
+        """Hold every call for ``seconds`` after OpenAI rejected one"""
+        until = time.monotonic() + seconds
+        if until <= self.paused_until:
+            return
+        self.paused_until = until
+        logger.warning(f"OpenAI rate limited, pausing calls for {seconds:.1f}s")
+        if share:
+            asyncio.ensure_future(shared_cache.publish(PAUSE_CHANNEL, {"until": time.time() + seconds}))
+
+    def _on_remote_pause(self, message: dict):
+        self.pause(message["until"] - time.time(), share=False)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant waiters round-robin by user; returns how long until the next can go"""
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            while queue and queue[0][1].done():
+                queue.popleft()
+            if not queue:
+                del self._queues[user]
+                continue
+            cost, future = queue[0]
+            delay = self._wait_time(cost)
+            if delay > 0:
+                # Nobody skips ahead of this user, or large requests would starve
+                return delay
+            queue.popleft()
+            self._take(cost)
+            future.set_result(None)
+            self._queues.move_to_end(user)
+        return None
+
+openai_governor = RateGovernor()
+shared_cache.subscribe(PAUSE_CHANNEL, openai_governor._on_remote_pause)
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Tokens a request is expected to spend; only starting a run uses the model"""
+    if request.method == "POST" and request.url.path.endswith("/runs"):
+        return settings.OPENAI_RUN_TOKEN_ESTIMATE
+    return 0
+
+def _busy_response(request: httpx.Request, retry_after: float) -> httpx.Response:
+    return httpx.Response(
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"retry-after": str(math.ceil(retry_after)), "x-should-retry": "false"},
+        json={"error": {
+            "message": "Request budget exhausted; retry later",
+            "type": "requests",
+            "code": "rate_limit_exceeded"
+        }},
+        request=request
+    )
+
+class GovernedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that takes budget from the governor and retries 429s.
+
+    Rate-limited requests are retried after ``Retry-After`` (or exponential
+    backoff with jitter) up to ``OPENAI_RATE_LIMIT_MAX_RETRIES`` times. The
+    final 429 is marked ``x-should-retry: false`` so the SDK does not repeat
+    the whole sequence on top. Only bodies already in memory are resent here;
+    streamed ones (file uploads) get a single attempt and the SDK's own retry,
+    which rebuilds the request, so they are never buffered.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        governor: RateGovernor = openai_governor,
+        max_retries: int = settings.OPENAI_RATE_LIMIT_MAX_RETRIES
+    ):
+        self.transport = transport
+        self.governor = governor
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cost = estimate_tokens(request)
+        replayable = isinstance(request.stream, httpx.ByteStream)
+        attempt = 0
+        while True:
+            try:
+                await self.governor.acquire(cost)
+            except GovernorTimeout as e:
+                logger.warning(f"OpenAI {request.method} {request.url.path}: {e}")
+                return _busy_response(request, e.retry_after)
+
+            response = await self.transport.handle_async_request(request)
+            self.governor.observe(response.headers)
+            if response.status_code != status.HTTP_429_TOO_MANY_REQUESTS:
+                return response
+
+            body = await response.aread()
+            if b"insufficient_quota" in body or attempt >= self.max_retries:
+                # Out of credit is not transient, and our retries are spent
+                response.headers["x-should-retry"] = "false"
+                return response
+
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = min(MAX_BACKOFF_SECONDS, 2 ** attempt) * random.uniform(0.5, 1.0)
+            self.governor.pause(delay)
+            if not replayable:
+                return response
+            await response.aclose()
+            # The request's budget was spent on the rejected attempt
+            attempt += 1
+            logger.info(f"Retrying OpenAI {request.method} {request.url.path} in {delay:.1f}s (attempt {attempt})")
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def rate_limit_retry_after(error: Exception) -> Optional[int]:
+    """Seconds to tell the caller to wait if ``error`` is an OpenAI rate limit, else None"""
+    if not isinstance(error, RateLimitError):
+        return None
+    delay = retry_after_seconds(error.response.headers)
+    return max(1, math.ceil(delay)) if delay is not None else 1
+
+def busy_error(retry_after: int) -> HTTPException:
+    """503 telling the caller when OpenAI capacity should be available again"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The assistant service is busy, please try again shortly",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def openai_http_error(error: Exception, detail: str, status_code: int = status.HTTP_400_BAD_REQUEST) -> HTTPException:
+    """HTTPException for a failed OpenAI call: 503 with Retry-After when OpenAI is rate limiting us"""
+    retry_after = rate_limit_retry_after(error)
+    if retry_after is None:
+        return HTTPException(status_code=status_code, detail=detail)
+    return busy_error(retry_after)
@@ -0,0 +1,26 @@
+"""Fixed-window request limits counted in the shared cache"""
+import math
+import time
+
+from fastapi import HTTPException, status
+
+from utils.config import settings
+from utils.shared_cache import shared_cache
+
+async def check_rate_limit(scope: str, key, limit: int, window: float = settings.RATE_LIMIT_WINDOW_SECONDS):
+    """Count a request for ``key`` against ``scope``, raising 429 past ``limit`` per window.
+
+    With the Redis backend the count is shared by all instances. A limit of 0 disables the check.
+    """
+    if limit <= 0:
+        return
+    now = time.time()
+    window_index = int(now // window)
+    count = await shared_cache.incr(f"rate:{scope}:{key}:{window_index}", ttl=window)
+    if count > limit:
+        retry_after = math.ceil((window_index + 1) * window - now)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please try again later",
+            headers={"Retry-After": str(max(1, retry_after))}
+        )
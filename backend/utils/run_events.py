@@ -0,0 +1,75 @@
+"""Chat events from streamed Assistants runs"""
+from typing import AsyncIterator
+
+from openai import AsyncOpenAI
+
+from utils.message_store import run_total_tokens
+from utils.run_poller import cancel_run
+
+async def stream_run_events(
+    client: AsyncOpenAI,
+    thread_id: str,
+    assistant_id: str
+) -> AsyncIterator[dict]:
+    """Create a streamed run and yield chat events as they arrive.
+
+    Yields ``run_created`` with the run id, ``text_delta`` and ``image_file``
+    events while the assistant is writing, then a single ``complete`` event
+    with the final message id, aggregated content, run id and token usage, or
+    an ``error`` event if the run does not complete.
+    """
+    content_parts = []
+    image_file_ids = []
+    message_id = None
+    run_id = None
+    total_tokens = 0
+
+    stream = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        stream=True
+    )
+    try:
+        async for event in stream:
+            if event.event == "thread.run.created":
+                run_id = event.data.id
+                yield {"type": "run_created", "run_id": run_id}
+            elif event.event == "thread.run.completed":
+                total_tokens = run_total_tokens(event.data)
+            elif event.event == "thread.message.delta":
+                for part in event.data.delta.content or []:
+                    if part.type == "text" and part.text and part.text.value:
+                        yield {"type": "text_delta", "content": part.text.value}
+                    elif part.type == "image_file" and part.image_file:
+                        yield {"type": "image_file", "file_id": part.image_file.file_id}
+            elif event.event == "thread.message.completed":
+                message_id = event.data.id
+                for content in event.data.content:
+                    if content.type == "text":
+                        content_parts.append(content.text.value)
+                    elif content.type == "image_file":
+                        image_file_ids.append(content.image_file.file_id)
+            elif event.event in (
+                "thread.run.failed", "thread.run.cancelled", "thread.run.expired",
+                "thread.run.incomplete", "thread.run.requires_action"
+            ):
+                if event.event == "thread.run.requires_action":
+                    # No tools are answered here, so the run would hold the thread until it expires
+                    await cancel_run(client, thread_id, event.data.id)
+                yield {"type": "error", "message": f"Run failed with status: {event.data.status}"}
+                return
+            elif event.event == "error":
+                yield {"type": "error", "message": str(event.data)}
+                return
+    finally:
+        # Release the connection when the consumer stops early, e.g. on a timeout
+        await stream.close()
+
+    yield {
+        "type": "complete",
+        "message_id": message_id,
+        "content": "\n".join(content_parts),
+        "attachments": [{"file_id": file_id, "type": "image"} for file_id in image_file_ids] or None,
+        "run_id": run_id,
+        "total_tokens": total_tokens
+    }
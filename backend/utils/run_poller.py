@@ -0,0 +1,160 @@
+"""Shared poller for in-flight Assistants runs"""
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import asyncio
+import logging
+import random
+
+from openai import AsyncOpenAI
+
+from utils.config import settings
+from utils.openai_governor import set_openai_user
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete", "requires_action")
+
+@dataclass
+class _TrackedRun:
+    client: AsyncOpenAI
+    thread_id: str
+    run_id: str
+    future: asyncio.Future
+    started_at: float
+    next_poll_at: float
+    attempts: int = 0
+
+class RunPoller:
+    """Track every in-flight run on this instance from one background task.
+
+    Waiters register a run and await a Future; the poller retrieves each run
+    on an exponential backoff schedule with jitter, starting from the
+    observed average run duration, and resolves the Future with the final run.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = settings.RUN_POLL_MIN_INTERVAL_SECONDS,
+        max_interval: float = settings.RUN_POLL_MAX_INTERVAL_SECONDS,
+        timeout: float = settings.RUN_TIMEOUT_SECONDS
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.expected_duration = 4 * min_interval  # EWMA of completed run durations
+        self._runs: Dict[str, _TrackedRun] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._runs)
+
+    async def wait_for_run(self, client: AsyncOpenAI, thread_id: str, run_id: str):
+        """Wait until the run reaches a terminal status and return it"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        tracked = _TrackedRun(
+            client=client,
+            thread_id=thread_id,
+            run_id=run_id,
+            future=loop.create_future(),
+            started_at=now,
+            next_poll_at=now + self._first_delay(),
+        )
+        self._runs[run_id] = tracked
+        self._ensure_started()
+        self._wakeup.set()
+        try:
+            return await tracked.future
+        finally:
+            self._runs.pop(run_id, None)
+
+    async def stop(self):
+        """Stop the background task and fail any remaining waiters"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for tracked in list(self._runs.values()):
+            if not tracked.future.done():
+                tracked.future.set_exception(RuntimeError("Run poller stopped"))
+        self._runs.clear()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._poll_loop())
+
+    def _first_delay(self) -> float:
+        # Most runs finish close to the running average, so skip the early polls
+        return min(self.max_interval, max(self.min_interval, 0.75 * self.expected_duration))
+
+    def _next_delay(self, tracked: _TrackedRun) -> float:
+        delay = min(self.max_interval, self.min_interval * (2 ** tracked.attempts))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        set_openai_user(None)  # Polls serve every waiter, not whoever started the task
+        while True:
+            self._wakeup.clear()
+            pending = [t for t in self._runs.values() if not t.future.done()]
+            if not pending:
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            due = [t for t in pending if t.next_poll_at <= now]
+            if due:
+                await asyncio.gather(*(self._poll(t) for t in due))
+                continue
+
+            next_poll_at = min(t.next_poll_at for t in pending)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_poll_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, tracked: _TrackedRun):
+        loop = asyncio.get_running_loop()
+        tracked.attempts += 1
+        try:
+            run = await tracked.client.beta.threads.runs.retrieve(
+                thread_id=tracked.thread_id,
+                run_id=tracked.run_id
+            )
+        except Exception as e:
+            logger.warning(f"Failed to poll run {tracked.run_id}: {e}")
+            run = None
+
+        if tracked.future.done():
+            return
+
+        elapsed = loop.time() - tracked.started_at
+        if run is not None and run.status in TERMINAL_RUN_STATUSES:
+            if run.status == "completed":
+                self.expected_duration = 0.8 * self.expected_duration + 0.2 * elapsed
+            tracked.future.set_result(run)
+        elif elapsed > self.timeout:
+            await self._cancel_run(tracked)
+            tracked.future.set_exception(
+                asyncio.TimeoutError(f"Run {tracked.run_id} did not finish within {self.timeout:.0f}s")
+            )
+        else:
+            tracked.next_poll_at = loop.time() + self._next_delay(tracked)
+
+    async def _cancel_run(self, tracked: _TrackedRun):
+        await cancel_run(tracked.client, tracked.thread_id, tracked.run_id)
+
+async def cancel_run(client: AsyncOpenAI, thread_id: str, run_id: str):
+    """Cancel a run so it stops holding its thread; failures are only logged"""
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Failed to cancel run {run_id}: {e}")
+
+run_poller = RunPoller()
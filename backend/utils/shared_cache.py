@@ -0,0 +1,335 @@
+"""Cache and coordination shared by all instances (Redis) or local to one (memory)"""
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from utils.config import settings
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process in published messages so it can skip its own
+INSTANCE_ID = uuid.uuid4().hex
+
+MessageHandler = Callable[[dict], None]
+
+class SharedCache(ABC):
+    """Key/value cache with TTLs, counters, locks and pub/sub.
+
+    Values are strings; ``get_json``/``set_json`` handle encoding. Messages
+    published to a channel are delivered to handlers on every instance
+    except the one that published them.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """Set ``key`` only if it is absent; returns whether it was set"""
+
+    @abstractmethod
+    async def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        """Add to a counter that expires ``ttl`` seconds after it was created"""
+
+    @abstractmethod
+    def lock(self, name: str, ttl: float, wait: Optional[float] = None):
+        """Async context manager yielding whether the lock was acquired.
+
+        The lock expires after ``ttl`` seconds in case its holder dies.
+        ``wait`` limits how long to wait for it (None waits indefinitely,
+        0 does not wait at all).
+        """
+
+    @abstractmethod
+    async def _publish(self, channel: str, data: str):
+        ...
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: float):
+        await self.set(key, json.dumps(value), ttl)
+
+    async def publish(self, channel: str, message: dict):
+        await self._publish(channel, json.dumps({"sender": INSTANCE_ID, "message": message}))
+
+    def subscribe(self, channel: str, handler: MessageHandler):
+        """Register a handler for messages other instances publish on ``channel``"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def _dispatch(self, channel: str, data: str):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            logger.warning(f"Ignoring malformed message on {channel}")
+            return
+        if payload.get("sender") == INSTANCE_ID:
+            return
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(payload.get("message"))
+            except Exception as e:
+                logger.error(f"Handler for {channel} failed: {e}")
+
+    async def start(self):
+        """Start receiving published messages"""
+
+    async def stop(self):
+        """Stop receiving messages and release connections"""
+
+class MemoryCache(SharedCache):
+    """Single-instance backend; also the fallback while Redis is unreachable"""
+
+    def __init__(self, max_entries: int = settings.CACHE_MEMORY_MAX_ENTRIES):
+        super().__init__()
+        self._entries = TTLCache(float("inf"), max_entries)
+        self._counters: Dict[str, list] = {}  # key -> [expires_at, count]
+        self._locks: Dict[str, list] = {}  # name -> [lock, holders and waiters]
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._entries.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str):
+        self._entries.pop(key)
+        self._counters.pop(key, None)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        if self._entries.get(key) is not None:
+            return False
+        self._entries.set(key, value, ttl=ttl)
+        return True
+
+    async def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        now = time.monotonic()
+        counter = self._counters.get(key)
+        if counter is None or counter[0] <= now:
+            if len(self._counters) >= settings.CACHE_MEMORY_MAX_ENTRIES:
+                self._counters = {k: c for k, c in self._counters.items() if c[0] > now}
+            counter = self._counters[key] = [now + ttl, 0]
+        counter[1] += amount
+        return counter[1]
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float, wait: Optional[float] = None) -> AsyncIterator[bool]:
+        # Holders in this process cannot die without releasing, so ttl is not needed
+        entry = self._locks.get(name)
+        if entry is None:
+            entry = self._locks[name] = [asyncio.Lock(), 0]
+        lock = entry[0]
+        entry[1] += 1  # Holders and waiters; the entry is only dropped once nobody uses it
+        try:
+            if wait == 0:
+                acquired = not lock.locked()
+                if acquired:
+                    await lock.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(lock.acquire(), wait)
+                    acquired = True
+                except asyncio.TimeoutError:
+                    acquired = False
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    lock.release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(name) is entry:
+                del self._locks[name]
+
+    async def _publish(self, channel: str, data: str):
+        # Nothing else shares this process's memory, and our own messages are skipped
+        pass
+
+class RedisCache(SharedCache):
+    """Redis backend shared by every instance.
+
+    While Redis is unreachable, operations fall back to a local
+    ``MemoryCache`` so requests keep working with per-instance state.
+    """
+
+    def __init__(self, url: str = settings.REDIS_URL, prefix: str = settings.CACHE_KEY_PREFIX):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+        self._fallback = MemoryCache()
+        self._degraded = False
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            import redis.asyncio as redis  # Only needed when this backend is configured
+            self._redis = redis.from_url(
+                self.url,
+                decode_responses=True,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS
+            )
+        return self._redis
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _failed(self, operation: str, error: Exception):
+        if not self._degraded:
+            logger.warning(f"Redis {operation} failed, using local cache until it recovers: {error}")
+            self._degraded = True
+
+    def _recovered(self):
+        if self._degraded:
+            logger.info("Redis reachable again")
+            self._degraded = False
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.redis.get(self._key(key))
+        except Exception as e:
+            self._failed("get", e)
+            return await self._fallback.get(key)
+        self._recovered()
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        try:
+            await self.redis.set(self._key(key), value, px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            self._failed("set", e)
+            await self._fallback.set(key, value, ttl)
+        else:
+            self._recovered()
+
+    async def delete(self, key: str):
+        # Always drop the fallback copy too, so a later outage cannot serve it
+        await self._fallback.delete(key)
+        try:
+            await self.redis.delete(self._key(key))
+        except Exception as e:
+            self._failed("delete", e)
+        else:
+            self._recovered()
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        try:
+            added = await self.redis.set(self._key(key), value, px=max(1, int(ttl * 1000)), nx=True)
+        except Exception as e:
+            self._failed("add", e)
+            return await self._fallback.add(key, value, ttl)
+        self._recovered()
+        return bool(added)
+
+    async def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                # SET NX starts the window; INCRBY alone would create a key without expiry
+                pipe.set(self._key(key), 0, px=max(1, int(ttl * 1000)), nx=True)
+                pipe.incrby(self._key(key), amount)
+                _, value = await pipe.execute()
+        except Exception as e:
+            self._failed("incr", e)
+            return await self._fallback.incr(key, ttl, amount)
+        self._recovered()
+        return value
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float, wait: Optional[float] = None) -> AsyncIterator[bool]:
+        lock = self.redis.lock(self._key(f"lock:{name}"), timeout=ttl)
+        try:
+            acquired = await lock.acquire(blocking=wait != 0, blocking_timeout=wait)
+        except Exception as e:
+            self._failed("lock", e)
+            lock = None
+        if lock is None:
+            async with self._fallback.lock(name, ttl, wait) as acquired:
+                yield acquired
+            return
+        self._recovered()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    await lock.release()
+                except Exception as e:
+                    # Expired or Redis went away; either way the lock is no longer ours
+                    logger.warning(f"Failed to release lock {name}: {e}")
+
+    async def _publish(self, channel: str, data: str):
+        try:
+            await self.redis.publish(self._key(channel), data)
+        except Exception as e:
+            self._failed("publish", e)
+
+    async def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def _listen(self):
+        delay = 1.0
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                channels = [self._key(channel) for channel in self._handlers]
+                if not channels:
+                    return
+                await pubsub.subscribe(*channels)
+                delay = 1.0
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._dispatch(message["channel"][len(self.prefix):], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed("subscribe", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+def create_shared_cache() -> SharedCache:
+    if settings.CACHE_BACKEND == "redis":
+        return RedisCache()
+    if settings.CACHE_BACKEND != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND {settings.CACHE_BACKEND!r}, using memory")
+    return MemoryCache()
+
+shared_cache = create_shared_cache()
@@ -0,0 +1,322 @@
+"""Per-thread queue that serializes runs and batches follow-up messages"""
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+
+from openai import AsyncOpenAI
+
+from models.database import ThreadedSession, new_session, UserAssistant, FileMetadata
+from utils.assistant_files import get_assistant_file_ids, attach_files
+from utils.config import settings
+from utils.openai_governor import openai_governor, rate_limit_retry_after
+from utils.message_store import record_user_message, sync_conversation, run_total_tokens
+from utils.run_events import stream_run_events
+from utils.run_poller import run_poller, cancel_run
+from utils.shared_cache import shared_cache
+from utils.tool_resources import tool_resources_reconciler
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_EVENTS = ("complete", "error")
+
+async def post_user_message(
+    db: ThreadedSession,
+    client: AsyncOpenAI,
+    db_assistant: UserAssistant,
+    content: str,
+    file_ids: Optional[List[str]] = None
+):
+    """Attach any new files to the assistant and post the user message to its thread.
+
+    Returns the created OpenAI message. The thread must not have an active
+    run, so call this from a ``ThreadRunQueue`` turn.
+    """
+    # Correctly initialize lists
+    message_content = [{"type": "text", "text": content}]
+    image_file_ids = []
+    file_ids_for_code_interpreter = []
+
+    all_assistant_file_ids = await get_assistant_file_ids(db, db_assistant.id)
+    combined_file_ids = list(set(all_assistant_file_ids + (file_ids or [])))
+
+    # Track new assistant files that need to be attached to the OpenAI assistant
+    new_assistant_files = []
+    if file_ids:
+        for file_id in file_ids:
+            if file_id not in all_assistant_file_ids:
+                new_assistant_files.append(file_id)
+
+    if combined_file_ids:
+        db_files = await db.query(FileMetadata).filter(
+            FileMetadata.file_id.in_(combined_file_ids),
+            FileMetadata.uploaded_by == db_assistant.user_id
+        ).all()
+        for f in db_files:
+            is_image = (f.mime_type and f.mime_type.startswith('image/')) or f.purpose == 'vision'
+            if is_image:
+                if f.file_id not in image_file_ids:
+                     image_file_ids.append(f.file_id)
+            elif f.purpose == 'assistants':
+
+                if f.file_id not in file_ids_for_code_interpreter:
+                    file_ids_for_code_interpreter.append(f.file_id)
+
+    # Update OpenAI assistant with new files (attach to code_interpreter tool_resources)
+    if new_assistant_files:
+        new_assistant_db_files = await db.query(FileMetadata).filter(
+            FileMetadata.file_id.in_(new_assistant_files),
+            FileMetadata.uploaded_by == db_assistant.user_id,
+            FileMetadata.purpose == 'assistants'
+        ).all()
+
+        if new_assistant_db_files:
+            try:
+                # Coalesced with concurrent changes to this assistant; skipped if already attached
+                await tool_resources_reconciler.add_files(
+                    client, db_assistant.assistant_id, [f.file_id for f in new_assistant_db_files]
+                )
+                print(f"DEBUG: Attached {len(new_assistant_db_files)} new files to assistant {db_assistant.assistant_id}")
+
+                # Update database to track the new files
+                await attach_files(db, db_assistant.id, [f.file_id for f in new_assistant_db_files])
+                await db.commit()
+
+            except Exception as e:
+                print(f"DEBUG: Failed to update assistant with new files: {str(e)}")
+                # Continue with the chat even if file attachment fails
+
+    for image_file_id in image_file_ids:
+        if file_ids and image_file_id in file_ids:
+            message_content.append({"type": "image_file", "image_file": {"file_id": image_file_id}})
+
+    return await client.beta.threads.messages.create(
+        thread_id=db_assistant.thread_id,
+        role="user",
+        content=message_content
+    )
+
+def reply_event(run, messages: list) -> dict:
+    """Build a ``complete`` event from a finished run and the thread messages synced after it"""
+    content_parts = []
+    image_file_ids = []
+    message_id = None
+    for msg in messages:
+        if msg.role != "assistant" or getattr(msg, "run_id", None) != run.id:
+            continue
+        message_id = msg.id
+        for content in msg.content:
+            if content.type == "text":
+                content_parts.append(content.text.value)
+            elif content.type == "image_file":
+                image_file_ids.append(content.image_file.file_id)
+    return {
+        "type": "complete",
+        "message_id": message_id,
+        "content": "\n".join(content_parts),
+        "attachments": [{"file_id": file_id, "type": "image"} for file_id in image_file_ids] or None,
+        "run_id": run.id,
+        "total_tokens": run_total_tokens(run)
+    }
+
+def error_event(message: str, error: Exception) -> dict:
+    """Build an ``error`` event, with ``retry_after`` when OpenAI was rate limiting us"""
+    event = {"type": "error", "message": message}
+    retry_after = rate_limit_retry_after(error)
+    if retry_after is not None:
+        event["retry_after"] = retry_after
+    return event
+
+class Turn:
+    """One message waiting for (or taking part in) a run on its thread"""
+
+    def __init__(self, post: Callable[[], Awaitable[int]], stream: bool):
+        loop = asyncio.get_running_loop()
+        self.post = post
+        self.conversation_id: Optional[int] = None  # Set once the message is posted
+        self.batch: List["Turn"] = []  # Turns whose messages share this turn's run
+        self.result: asyncio.Future = loop.create_future()  # The run's complete or error event
+        self.started = asyncio.Event()  # Set once the message is posted and its run is starting
+        self._events: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+
+    @property
+    def streaming(self) -> bool:
+        return self._events is not None
+
+    async def wait(self) -> dict:
+        """Wait for the run that answers this message and return its final event"""
+        return await asyncio.shield(self.result)
+
+    async def events(self) -> AsyncIterator[dict]:
+        """Yield the run's events, ending with its complete or error event"""
+        while True:
+            event = await self._events.get()
+            yield event
+            if event["type"] in TERMINAL_EVENTS:
+                return
+
+    def _emit(self, event: dict):
+        if self._events is not None:
+            self._events.put_nowait(event)
+
+    def _finish(self, event: dict):
+        if not self.result.done():
+            self.result.set_result(event)
+        self._emit(event)
+
+class ThreadRunQueue:
+    """Serialize runs per thread and fold waiting messages into one run.
+
+    OpenAI rejects new messages while a thread has an active run, so each
+    thread gets one drain task that repeatedly takes every queued turn,
+    posts their messages in arrival order and starts a single run for the
+    batch. Messages arriving during a run wait for the next batch, and
+    ``coalesce`` seconds are allowed for a burst to gather before each run.
+    A shared lock extends the serialization to other instances.
+    """
+
+    def __init__(self, coalesce: float = settings.THREAD_RUN_COALESCE_SECONDS):
+        self.coalesce = coalesce
+        self._pending: Dict[str, List[Turn]] = {}
+        self._draining: Dict[str, asyncio.Task] = {}
+
+    def submit(
+        self,
+        client: AsyncOpenAI,
+        thread_id: str,
+        assistant_id: str,
+        post: Callable[[], Awaitable[int]],
+        stream: bool = False
+    ) -> Turn:
+        """Queue a message for the thread's next run.
+
+        ``post`` adds the message to the thread and returns the id of the
+        conversation mirroring it; it is called when the thread is idle.
+        With ``stream`` the turn also receives the run's delta events.
+        """
+        turn = Turn(post, stream)
+        self._pending.setdefault(thread_id, []).append(turn)
+        if thread_id not in self._draining:
+            self._draining[thread_id] = asyncio.create_task(self._drain(client, thread_id, assistant_id))
+        return turn
+
+    async def _drain(self, client: AsyncOpenAI, thread_id: str, assistant_id: str):
+        try:
+            while self._pending.get(thread_id):
+                await asyncio.sleep(self.coalesce)
+                batch = self._pending.pop(thread_id)
+                try:
+                    await self._run_batch(client, thread_id, assistant_id, batch)
+                except Exception as e:
+                    logger.error(f"Run batch for thread {thread_id} failed: {e}")
+                    for turn in batch:
+                        turn._finish(error_event(f"Failed to run assistant: {str(e)}", e))
+        finally:
+            self._draining.pop(thread_id, None)
+
+    async def _run_batch(self, client: AsyncOpenAI, thread_id: str, assistant_id: str, batch: List[Turn]):
+        lock_ttl = settings.RUN_TIMEOUT_SECONDS + 60
+        async with shared_cache.lock(f"thread-run:{thread_id}", ttl=lock_ttl):
+            posted = []
+            conversation_id = None
+            for turn in batch:
+                try:
+                    conversation_id = turn.conversation_id = await turn.post()
+                except Exception as e:
+                    turn._finish(error_event(f"Failed to send message: {str(e)}", e))
+                    continue
+                posted.append(turn)
+            if not posted:
+                return
+            for turn in posted:
+                turn.batch = posted
+                turn.started.set()
+
+            if len(posted) > 1:
+                logger.info(f"Coalesced {len(posted)} messages into one run on thread {thread_id}")
+            if any(turn.streaming for turn in posted):
+                final = await self._stream_run(client, thread_id, assistant_id, posted)
+                if final["type"] == "complete" and conversation_id is not None:
+                    await sync_conversation(client, conversation_id, final["run_id"], final["total_tokens"])
+            else:
+                final = await self._poll_run(client, thread_id, assistant_id, conversation_id)
+            if final["type"] == "complete":
+                # Replace the governor's up-front estimate with what the run actually used
+                openai_governor.charge(final["total_tokens"] - settings.OPENAI_RUN_TOKEN_ESTIMATE)
+
+        for turn in posted:
+            turn._finish(final)
+
+    async def _stream_run(self, client: AsyncOpenAI, thread_id: str, assistant_id: str, turns: List[Turn]) -> dict:
+        run_id = None
+
+        async def relay() -> dict:
+            nonlocal run_id
+            async with aclosing(stream_run_events(client, thread_id, assistant_id)) as events:
+                async for event in events:
+                    if event["type"] == "run_created":
+                        run_id = event["run_id"]
+                    elif event["type"] in TERMINAL_EVENTS:
+                        return event
+                    else:
+                        for turn in turns:
+                            turn._emit(event)
+            return {"type": "error", "message": "Run ended without a reply"}
+
+        # Bounded like polled runs, so the run cannot outlive the thread lock's TTL
+        try:
+            return await asyncio.wait_for(relay(), settings.RUN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            if run_id is not None:
+                await cancel_run(client, thread_id, run_id)
+            return {"type": "error", "message": f"Run did not finish within {settings.RUN_TIMEOUT_SECONDS:.0f}s"}
+
+    async def _poll_run(self, client: AsyncOpenAI, thread_id: str, assistant_id: str, conversation_id: Optional[int]) -> dict:
+        # Nobody is streaming, so let the shared poller track the run
+        run = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+        print(f"DEBUG: Run created successfully: {run.id}")
+        run = await run_poller.wait_for_run(client, thread_id, run.id)
+        if run.status == "requires_action":
+            await cancel_run(client, thread_id, run.id)
+        if run.status != "completed":
+            return {"type": "error", "message": f"Run failed with status: {run.status}"}
+        new_messages = []
+        if conversation_id is not None:
+            # Mirror the reply locally; this fetches only messages after the batch's messages
+            new_messages = await sync_conversation(client, conversation_id, run.id, run_total_tokens(run))
+        return reply_event(run, new_messages)
+
+thread_run_queue = ThreadRunQueue()
+
+async def _post_and_record(
+    client: AsyncOpenAI,
+    user_assistant_id: int,
+    content: str,
+    file_ids: Optional[List[str]]
+) -> int:
+    # Uses its own session: the turn may outlive the request that submitted it
+    db = new_session()
+    try:
+        db_assistant = await db.get(UserAssistant, user_assistant_id)
+        msg = await post_user_message(db, client, db_assistant, content, file_ids)
+        conversation = await record_user_message(db, client, db_assistant, msg)
+        return conversation.id
+    finally:
+        await db.close()
+
+def submit_user_message(
+    client: AsyncOpenAI,
+    db_assistant: UserAssistant,
+    content: str,
+    file_ids: Optional[List[str]] = None,
+    stream: bool = False
+) -> Turn:
+    """Queue a user message for the next run on the assistant's thread (which must exist)"""
+    user_assistant_id = db_assistant.id
+    return thread_run_queue.submit(
+        client,
+        db_assistant.thread_id,
+        db_assistant.assistant_id,
+        lambda: _post_and_record(client, user_assistant_id, content, file_ids),
+        stream=stream
+    )
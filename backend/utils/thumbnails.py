@@ -0,0 +1,108 @@
+"""Image thumbnail generation in a process pool"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Optional
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+class Thumbnail(NamedTuple):
+    width: int  # Dimensions of the original image
+    height: int
+    data: bytes
+    media_type: str
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+def make_thumbnail(image_path: str, max_size: int, quality: int) -> Thumbnail:
+    """Decode an image file and render a thumbnail no larger than ``max_size`` on either side.
+
+    Runs in a worker process, which opens the file itself so the image bytes
+    never pass through the API process or the pool's pipe. JPEGs are decoded in draft mode, which lets
+    libjpeg scale by 1/2 to 1/8 during decoding instead of materializing the
+    full-resolution bitmap first.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (max_size, max_size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_size, max_size))
+
+        output = io.BytesIO()
+        if img.mode in ("RGBA", "LA", "P") and ("A" in img.mode or "transparency" in img.info):
+            # Keep transparency; JPEG cannot store it
+            img.save(output, format="PNG", optimize=True)
+            media_type = "image/png"
+        else:
+            img.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+            media_type = "image/jpeg"
+
+    return Thumbnail(width=width, height=height, data=output.getvalue(), media_type=media_type)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def get_thumbnail_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Forking the API process would copy its event loop, DB pool and sockets into each
+        # worker, and threads holding locks at fork time can leave them locked in the child
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context(method)
+        )
+    return _executor
+
+def copy_to_temp_file(fileobj) -> str:
+    """Copy a file object to a named temporary file in chunks and return its path"""
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="thumbnail-", delete=False) as tmp:
+        shutil.copyfileobj(fileobj, tmp, COPY_CHUNK_BYTES)
+    fileobj.seek(0)
+    return tmp.name
+
+async def generate_thumbnail(image_path: str, delete: bool = False) -> Optional[Thumbnail]:
+    """Render a thumbnail of an image file off the event loop; returns None if it cannot be decoded.
+
+    With ``delete`` the file is removed afterwards, whatever the outcome.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            get_thumbnail_executor(),
+            make_thumbnail,
+            image_path,
+            settings.THUMBNAIL_MAX_SIZE,
+            settings.THUMBNAIL_JPEG_QUALITY
+        )
+    except BrokenProcessPool as e:
+        # A crashed worker poisons the pool; start a fresh one for the next image
+        logger.error(f"Thumbnail worker pool broke: {e}")
+        shutdown_thumbnail_executor()
+        return None
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed: {e}")
+        return None
+    finally:
+        if delete:
+            try:
+                os.unlink(image_path)
+            except OSError as e:
+                logger.warning(f"Failed to remove thumbnail source {image_path}: {e}")
+
+def shutdown_thumbnail_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,115 @@
+"""Coalescing reconciler for assistant code_interpreter file attachments"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+import asyncio
+import logging
+
+from openai import AsyncOpenAI
+
+from utils.assistant_cache import assistant_cache
+from utils.config import settings
+from utils.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+def code_interpreter_file_ids(assistant) -> List[str]:
+    """Extract tool_resources.code_interpreter.file_ids from an OpenAI assistant"""
+    tool_resources = getattr(assistant, "tool_resources", None)
+    code_interpreter = getattr(tool_resources, "code_interpreter", None) if tool_resources else None
+    return list(getattr(code_interpreter, "file_ids", None) or [])
+
+@dataclass
+class _Change:
+    op: str  # add, remove or set
+    file_ids: List[str]
+    future: asyncio.Future
+
+class ToolResourcesReconciler:
+    """Apply file attachment changes to assistants in coalesced batches.
+
+    Callers submit add/remove/set changes and await the resulting file list.
+    Changes for one assistant that arrive within ``debounce`` seconds are
+    folded together and applied under a per-assistant lock with at most one
+    ``assistants.update``, which is skipped when the remote file set would
+    not change. Later changes win over earlier ones, in submission order.
+    A shared lock serializes the read-modify-write across instances.
+    """
+
+    def __init__(self, debounce: float = settings.TOOL_RESOURCES_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._pending: Dict[str, List[_Change]] = {}
+        self._scheduled: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def add_files(self, client: AsyncOpenAI, assistant_id: str, file_ids: Iterable[str]) -> List[str]:
+        """Attach files to the assistant; returns its resulting file_ids"""
+        return await self._submit(client, assistant_id, "add", file_ids)
+
+    async def remove_files(self, client: AsyncOpenAI, assistant_id: str, file_ids: Iterable[str]) -> List[str]:
+        """Detach files from the assistant; returns its resulting file_ids"""
+        return await self._submit(client, assistant_id, "remove", file_ids)
+
+    async def set_files(self, client: AsyncOpenAI, assistant_id: str, file_ids: Iterable[str]) -> List[str]:
+        """Replace the assistant's file set; returns its resulting file_ids"""
+        return await self._submit(client, assistant_id, "set", file_ids)
+
+    async def _submit(self, client: AsyncOpenAI, assistant_id: str, op: str, file_ids: Iterable[str]) -> List[str]:
+        change = _Change(op=op, file_ids=list(dict.fromkeys(file_ids)), future=asyncio.get_running_loop().create_future())
+        self._pending.setdefault(assistant_id, []).append(change)
+        if assistant_id not in self._scheduled:
+            self._scheduled[assistant_id] = asyncio.create_task(self._flush(client, assistant_id))
+        # A cancelled caller must not cancel the batch it joined
+        return await asyncio.shield(change.future)
+
+    async def _flush(self, client: AsyncOpenAI, assistant_id: str):
+        await asyncio.sleep(self.debounce)
+        lock = self._locks.setdefault(assistant_id, asyncio.Lock())
+        async with lock:
+            # Changes submitted from here on schedule the next flush, which waits for this lock
+            self._scheduled.pop(assistant_id, None)
+            changes = self._pending.pop(assistant_id, [])
+            if changes:
+                try:
+                    file_ids = await self._apply(client, assistant_id, changes)
+                except Exception as e:
+                    for change in changes:
+                        if not change.future.done():
+                            change.future.set_exception(e)
+                else:
+                    for change in changes:
+                        if not change.future.done():
+                            change.future.set_result(list(file_ids))
+        if assistant_id not in self._scheduled and assistant_id not in self._pending:
+            self._locks.pop(assistant_id, None)
+
+    async def _apply(self, client: AsyncOpenAI, assistant_id: str, changes: List[_Change]) -> List[str]:
+        # Long enough to outlive a retried update; a dead holder's lock expires after this
+        lock_ttl = settings.OPENAI_TIMEOUT_SECONDS * (settings.OPENAI_MAX_RETRIES + 1)
+        async with shared_cache.lock(f"assistant-files:{assistant_id}", ttl=lock_ttl):
+            # Another instance may have updated the assistant since we cached it
+            assistant_cache.drop_local(assistant_id)
+            current = code_interpreter_file_ids(await assistant_cache.get(client, assistant_id))
+            desired = list(current)
+            for change in changes:
+                if change.op == "add":
+                    desired += [file_id for file_id in change.file_ids if file_id not in desired]
+                elif change.op == "remove":
+                    desired = [file_id for file_id in desired if file_id not in change.file_ids]
+                else:
+                    desired = list(change.file_ids)
+
+            if set(desired) == set(current):
+                return current
+
+            logger.info(
+                f"Updating assistant {assistant_id} file_ids ({len(changes)} changes): "
+                f"+{sorted(set(desired) - set(current))} -{sorted(set(current) - set(desired))}"
+            )
+            updated = await client.beta.assistants.update(
+                assistant_id=assistant_id,
+                tool_resources={"code_interpreter": {"file_ids": desired}}
+            )
+            await assistant_cache.set(updated.id, updated)
+            return desired
+
+tool_resources_reconciler = ToolResourcesReconciler()
@@ -0,0 +1,149 @@
+"""Memory-bounded file uploads to OpenAI"""
+import asyncio
+import hashlib
+import logging
+import math
+import uuid
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Room for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware that rejects oversized upload bodies while they stream in.
+
+    Starlette spools multipart files to disk in small chunks, but would
+    otherwise accept a body of any size. Requests whose Content-Length is
+    too large are refused up front; chunked bodies are cut off as soon as
+    the running byte count passes the limit.
+    """
+
+    def __init__(self, app, path_prefix: str, max_bytes: int = settings.UPLOAD_MAX_BYTES):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_body_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+        self.detail = f"File size exceeds {max_bytes // (1024 * 1024)}MB limit"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and int(content_length) > self.max_body_bytes:
+            response = JSONResponse(
+                {"detail": self.detail},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # Raised inside form parsing, which FastAPI passes through as-is
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=self.detail
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def upload_size(file: UploadFile) -> int:
+    """Size of a spooled upload, without reading it into memory"""
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, 2)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+def check_upload_size(size: int):
+    if size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds {settings.UPLOAD_MAX_BYTES // (1024 * 1024)}MB limit"
+        )
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def _sha256_file(fileobj) -> str:
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+async def upload_sha256(file: UploadFile) -> str:
+    """SHA-256 hex digest of a spooled upload, hashed in chunks off the event loop"""
+    return await run_in_threadpool(_sha256_file, file.file)
+
+async def upload_to_openai(client: AsyncOpenAI, file: UploadFile, purpose: str, size: int):
+    """Upload a spooled file to OpenAI and return the created file object.
+
+    Small files are streamed from the spool file in a single request; files
+    above ``UPLOAD_DIRECT_MAX_BYTES`` go through the Uploads API as parts
+    sent in parallel. Either way at most a few parts are held in memory.
+    """
+    filename = file.filename or f"file_{uuid.uuid4().hex}"
+    await file.seek(0)
+    if size <= settings.UPLOAD_DIRECT_MAX_BYTES:
+        # httpx reads the file object in chunks while sending
+        return await client.files.create(
+            file=(filename, file.file, file.content_type or "application/octet-stream"),
+            purpose=purpose
+        )
+    return await upload_in_parts(client, file, filename, purpose, size)
+
+async def upload_in_parts(client: AsyncOpenAI, file: UploadFile, filename: str, purpose: str, size: int):
+    """Send a file through the Uploads API with bounded part concurrency"""
+    upload = await client.uploads.create(
+        bytes=size,
+        filename=filename,
+        mime_type=file.content_type or "application/octet-stream",
+        purpose=purpose
+    )
+    part_size = settings.UPLOAD_PART_SIZE_BYTES
+    part_count = math.ceil(size / part_size)
+    # Parts are read only once a slot is free, so memory stays at concurrency * part_size
+    semaphore = asyncio.Semaphore(settings.UPLOAD_PART_CONCURRENCY)
+    read_lock = asyncio.Lock()
+
+    async def send_part(index: int) -> str:
+        async with semaphore:
+            async with read_lock:
+                await file.seek(index * part_size)
+                data = await file.read(part_size)
+            part = await client.uploads.parts.create(upload.id, data=data)
+            return part.id
+
+    tasks = [asyncio.ensure_future(send_part(i)) for i in range(part_count)]
+    try:
+        part_ids = await asyncio.gather(*tasks)
+        completed = await client.uploads.complete(upload.id, part_ids=list(part_ids))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        try:
+            await client.uploads.cancel(upload.id)
+        except Exception as e:
+            logger.warning(f"Failed to cancel upload {upload.id}: {e}")
+        raise
+
+    logger.info(f"Uploaded {filename} ({size} bytes) to OpenAI in {part_count} parts")
+    return completed.file
@@ -0,0 +1,239 @@
+"""Incrementally maintained per-user dashboard counters"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+
+from sqlalchemy import case, exc, func, select, update
+from sqlalchemy.orm import Session
+
+from models.database import (
+    SessionLocal, ThreadedSession, run_db,
+    User, UserAssistant, UserStats, Conversation, ConversationMessage
+)
+from utils.config import settings
+from utils.shared_cache import shared_cache
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 500
+
+# Profile totals per user_id, dropped whenever a write changes them
+profile_stats_cache = TTLCache(settings.PROFILE_STATS_CACHE_TTL_SECONDS, settings.PROFILE_STATS_CACHE_MAX_ENTRIES)
+
+def invalidate_profile_stats(user_id: int):
+    """Drop a user's cached profile totals after a write that changes them"""
+    profile_stats_cache.pop(user_id)
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+def utc_day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+async def update_user_stats(
+    db: ThreadedSession,
+    user_id: int,
+    *,
+    assistants: int = 0,
+    active_threads: int = 0,
+    messages_today: int = 0,
+    tokens: int = 0,
+    last_assistant: Optional[UserAssistant] = None
+):
+    """Apply counter deltas in the caller's transaction; the caller commits.
+
+    Users without a stats row are left alone: their row is computed from the
+    source tables on first read, which already includes this write.
+    """
+    invalidate_profile_stats(user_id)
+    values = []
+    if assistants:
+        values.append((UserStats.assistant_count, UserStats.assistant_count + assistants))
+    if active_threads:
+        values.append((UserStats.active_thread_count, UserStats.active_thread_count + active_threads))
+    if messages_today:
+        today = utc_today()
+        # MySQL applies SET clauses left to right, so the day check must come before messages_day moves
+        values.append((UserStats.messages_today, case(
+            (UserStats.messages_day == today, UserStats.messages_today + messages_today),
+            else_=max(messages_today, 0)  # Removing messages from an earlier day leaves today at 0
+        )))
+        values.append((UserStats.messages_day, today))
+    if tokens:
+        values.append((UserStats.tokens_used, UserStats.tokens_used + tokens))
+    if last_assistant is not None:
+        values.append((UserStats.last_assistant_id, last_assistant.id))
+        values.append((UserStats.last_assistant_name, last_assistant.name))
+        values.append((UserStats.last_assistant_created_at, func.now()))
+    if not values:
+        return
+
+    await db.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .ordered_values(*values)
+        .execution_options(synchronize_session=False)
+    )
+
+async def refresh_last_assistant(db: ThreadedSession, user_id: int):
+    """Point last_assistant at the newest remaining assistant (after a delete has been flushed)"""
+    latest = await db.query(UserAssistant.id, UserAssistant.name, UserAssistant.created_at).filter(
+        UserAssistant.user_id == user_id
+    ).order_by(UserAssistant.id.desc()).first()
+    await db.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(
+            last_assistant_id=latest.id if latest else None,
+            last_assistant_name=latest.name if latest else None,
+            last_assistant_created_at=latest.created_at if latest else None
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+async def assistant_usage(db: ThreadedSession, user_assistant_id: int) -> Tuple[int, int]:
+    """Messages from today and tokens stored in an assistant's conversations.
+
+    Deleting the assistant deletes these rows, so its caller subtracts them
+    to keep the counters equal to what ``reconcile_user_stats`` would count.
+    """
+    result = await db.execute(
+        select(
+            func.count(case((ConversationMessage.created_at >= utc_day_start(utc_today()), ConversationMessage.id))),
+            func.coalesce(func.sum(ConversationMessage.token_count), 0)
+        ).join(
+            Conversation, ConversationMessage.conversation_id == Conversation.id
+        ).where(Conversation.user_assistant_id == user_assistant_id)
+    )
+    messages_today, tokens = result.one()
+    return messages_today, int(tokens)
+
+def count_messages_today(created_at_values) -> int:
+    """How many of the given message timestamps fall on the current UTC day"""
+    today = utc_today()
+    return sum(1 for created_at in created_at_values if created_at and created_at.astimezone(timezone.utc).date() == today)
+
+async def load_user_stats(db: ThreadedSession, user_id: int) -> UserStats:
+    """The user's counters, computing the row from the source tables the first time"""
+    stats = await db.get(UserStats, user_id)
+    if stats is None:
+        try:
+            await db.run(reconcile_user_stats, [user_id])
+        except exc.IntegrityError:
+            # A concurrent request created the row first
+            await db.rollback()
+        stats = await db.get(UserStats, user_id)
+    return stats
+
+def reconcile_user_stats(session: Session, user_ids: Optional[List[int]] = None) -> int:
+    """Recompute counters from the source tables and overwrite the stored rows.
+
+    Aggregates run per batch of users with GROUP BY, each batch in its own
+    transaction. Returns the number of users reconciled.
+    """
+    if user_ids is None:
+        user_ids = [user_id for (user_id,) in session.query(User.id).order_by(User.id)]
+    now = datetime.now(timezone.utc)
+    day_start = utc_day_start(now.date())
+
+    for i in range(0, len(user_ids), RECONCILE_BATCH_SIZE):
+        batch = user_ids[i:i + RECONCILE_BATCH_SIZE]
+        stats = {
+            user_id: UserStats(
+                user_id=user_id, assistant_count=0, active_thread_count=0, messages_today=0,
+                messages_day=now.date(), tokens_used=0, reconciled_at=now
+            )
+            for user_id in batch
+        }
+
+        for user_id, assistant_count, thread_count in session.query(
+            UserAssistant.user_id, func.count(UserAssistant.id), func.count(UserAssistant.thread_id)
+        ).filter(UserAssistant.user_id.in_(batch)).group_by(UserAssistant.user_id):
+            stats[user_id].assistant_count = assistant_count
+            stats[user_id].active_thread_count = thread_count
+
+        latest_ids = select(func.max(UserAssistant.id)).where(
+            UserAssistant.user_id.in_(batch)
+        ).group_by(UserAssistant.user_id)
+        for user_id, assistant_id, name, created_at in session.query(
+            UserAssistant.user_id, UserAssistant.id, UserAssistant.name, UserAssistant.created_at
+        ).filter(UserAssistant.id.in_(latest_ids)):
+            stats[user_id].last_assistant_id = assistant_id
+            stats[user_id].last_assistant_name = name
+            stats[user_id].last_assistant_created_at = created_at
+
+        for user_id, messages_today, tokens_used in session.query(
+            Conversation.user_id,
+            func.count(case((ConversationMessage.created_at >= day_start, ConversationMessage.id))),
+            func.coalesce(func.sum(ConversationMessage.token_count), 0)
+        ).join(
+            ConversationMessage, ConversationMessage.conversation_id == Conversation.id
+        ).filter(Conversation.user_id.in_(batch)).group_by(Conversation.user_id):
+            stats[user_id].messages_today = messages_today
+            stats[user_id].tokens_used = int(tokens_used)
+
+        for row in stats.values():
+            session.merge(row)
+        session.commit()
+
+    return len(user_ids)
+
+def run_reconciliation() -> int:
+    """Reconcile every user's counters in a fresh session (blocking)"""
+    session = SessionLocal()
+    try:
+        return reconcile_user_stats(session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+class StatsReconciler:
+    """Background task that reconciles all counters once a day.
+
+    Counter updates ride along with the writes they describe, so drift only
+    comes from failures between the two or from writes made outside the API.
+    The first instance to claim the day in the shared cache runs it; with the
+    memory backend every instance does, which is harmless since it is idempotent.
+    """
+
+    def __init__(self, hour_utc: int = settings.STATS_RECONCILE_HOUR_UTC):
+        self.hour_utc = hour_utc
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def seconds_until_next_run(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now(timezone.utc)
+        next_run = now.replace(hour=self.hour_utc, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.seconds_until_next_run())
+            try:
+                claims = await shared_cache.incr(f"stats-reconcile:{utc_today().isoformat()}", ttl=24 * 3600)
+                if claims > 1:
+                    continue
+                count = await run_db(run_reconciliation)
+                logger.info(f"Reconciled dashboard stats for {count} users")
+            except Exception as e:
+                logger.error(f"Dashboard stats reconciliation failed: {e}")
+
+stats_reconciler = StatsReconciler()
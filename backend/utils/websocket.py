@@ -1,5 +1,5 @@
 """WebSocket connection manager"""
-from typing import Dict, List
+from typing import Dict, Hashable, Optional, Set
 from fastapi import WebSocket
 import logging
 
@@ -7,36 +7,33 @@ logger = logging.getLogger(__name__)
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.conversation_connections: Dict[int, List[WebSocket]] = {}
+        self.active_connections: Set[WebSocket] = set()
+        self.conversation_connections: Dict[Hashable, Set[WebSocket]] = {}
 
-    async def connect(self, websocket: WebSocket, conversation_id: int = None):
+    async def connect(self, websocket: WebSocket, conversation_id: Optional[Hashable] = None):
         try:
             await websocket.accept()
-            self.active_connections.append(websocket)
-            
-            if conversation_id:
-                if conversation_id not in self.conversation_connections:
-                    self.conversation_connections[conversation_id] = []
-                self.conversation_connections[conversation_id].append(websocket)
-                
+            self.active_connections.add(websocket)
+
+            if conversation_id is not None:
+                self.conversation_connections.setdefault(conversation_id, set()).add(websocket)
+
             logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
         except Exception as e:
             logger.error(f"Error connecting WebSocket: {e}")
 
-    def disconnect(self, websocket: WebSocket, conversation_id: int = None):
+    def disconnect(self, websocket: WebSocket, conversation_id: Optional[Hashable] = None):
         try:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
-            
-            if conversation_id and conversation_id in self.conversation_connections:
-                if websocket in self.conversation_connections[conversation_id]:
-                    self.conversation_connections[conversation_id].remove(websocket)
-                
-                # Clean up empty conversation lists
-                if not self.conversation_connections[conversation_id]:
+            self.active_connections.discard(websocket)
+
+            if conversation_id is not None and conversation_id in self.conversation_connections:
+                connections = self.conversation_connections[conversation_id]
+                connections.discard(websocket)
+
+                # Clean up empty conversation sets
+                if not connections:
                     del self.conversation_connections[conversation_id]
-                    
+
             logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
         except Exception as e:
             logger.error(f"Error disconnecting WebSocket: {e}")
@@ -55,29 +52,31 @@ class ConnectionManager:
 
     async def broadcast(self, message: str):
         disconnected = []
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             try:
                 await connection.send_text(message)
             except Exception as e:
                 logger.error(f"Error broadcasting to connection: {e}")
                 disconnected.append(connection)
-        
+
         # Clean up disconnected connections
         for connection in disconnected:
             self.disconnect(connection)
 
-    async def broadcast_to_conversation(self, conversation_id: int, message: dict):
+    async def broadcast_to_conversation(self, conversation_id: Hashable, message: dict):
         if conversation_id not in self.conversation_connections:
             return
-        
+
         disconnected = []
-        for connection in self.conversation_connections[conversation_id]:
+        for connection in list(self.conversation_connections[conversation_id]):
             try:
                 await connection.send_json(message)
             except Exception as e:
                 logger.error(f"Error broadcasting to conversation {conversation_id}: {e}")
                 disconnected.append(connection)
-        
+
         # Clean up disconnected connections
         for connection in disconnected:
-            self.disconnect(connection, conversation_id)
\ No newline at end of file
+            self.disconnect(connection, conversation_id)
+
+manager = ConnectionManager()
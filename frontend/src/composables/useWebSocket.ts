@@ -40,6 +40,9 @@ export function useWebSocket(options: WebSocketOptions) {
   // Heartbeat
   let heartbeatTimer: NodeJS.Timeout | null = null
 
+  // Set by disconnect() so the close it causes does not trigger a reconnect
+  let closedByClient = false
+
   // Message handlers
   const messageHandlers = new Map<string, ((data: any) => void)[]>()
 
@@ -51,6 +54,7 @@ export function useWebSocket(options: WebSocketOptions) {
 
     isConnecting.value = true
     lastError.value = null
+    closedByClient = false
 
     try {
       ws.value = new WebSocket(url, protocols)
@@ -78,7 +82,7 @@ export function useWebSocket(options: WebSocketOptions) {
         emit('disconnected', event)
 
         // Attempt reconnection
-        if (reconnect && reconnectCount.value < reconnectAttempts) {
+        if (reconnect && !closedByClient && reconnectCount.value < reconnectAttempts) {
           reconnectCount.value++
           setTimeout(() => {
             connect()
@@ -128,6 +132,7 @@ export function useWebSocket(options: WebSocketOptions) {
   }
 
   const disconnect = () => {
+    closedByClient = true
     stopHeartbeat()
     if (ws.value) {
       ws.value.close()
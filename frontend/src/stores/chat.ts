@@ -1,7 +1,16 @@
 import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
 import { apiClient } from '@/utils/api'
-import type { ChatSession, Message, MessageFile, SendMessageData, StreamMessage } from '@/types'
+import type {
+  ChatSession,
+  Message,
+  MessageFile,
+  SendMessageData,
+  StreamCompleteMessage,
+  StreamErrorMessage,
+  StreamTextDelta,
+  StreamUserMessage,
+} from '@/types'
 import { useWebSocket } from '@/composables/useWebSocket'
 
 export const useChatStore = defineStore('chat', () => {
@@ -13,8 +22,9 @@ export const useChatStore = defineStore('chat', () => {
   const error = ref<string | null>(null)
   const streamingMessage = ref<string>('')
   
-  // WebSocket instance
+  // WebSocket instance, connected to the current session's assistant
   let ws: ReturnType<typeof useWebSocket> | null = null
+  let wsAssistantId: string | null = null
 
   // Getters
   const sessionsList = computed(() => sessions.value)
@@ -58,6 +68,7 @@ export const useChatStore = defineStore('chat', () => {
       if (response.success && response.data) {
         sessions.value.unshift(response.data)
         currentSession.value = response.data
+        initializeWebSocket(response.data.assistantId)
         return { success: true, data: response.data }
       } else {
         error.value = response.error?.message || 'Failed to create session'
@@ -80,6 +91,7 @@ export const useChatStore = defineStore('chat', () => {
       
       if (response.success && response.data) {
         currentSession.value = response.data
+        initializeWebSocket(response.data.assistantId)
         
         // Update in list if exists
         const index = sessions.value.findIndex(s => s.id === sessionId)
@@ -132,57 +144,63 @@ export const useChatStore = defineStore('chat', () => {
     currentSession.value.messages.push(userMessage)
 
     try {
-      // Check if WebSocket streaming is supported
-      const streamSupported = 'WebSocket' in window && ws?.isConnected.value
+      // The socket takes already-uploaded file ids, so messages with new files use the API
+      const streamSupported = 'WebSocket' in window && !files?.length &&
+        wsAssistantId === currentSession.value.assistantId && ws?.isConnected.value
 
       if (streamSupported) {
         // Use WebSocket for streaming
         return new Promise((resolve) => {
           let assistantMessage: Message | null = null
 
-          // Set up message handlers
-          const handleStreamMessage = (data: StreamMessage) => {
-            if (data.type === 'start') {
-              assistantMessage = {
-                id: data.messageId,
-                role: 'assistant',
-                content: '',
-                timestamp: new Date().toISOString(),
-              }
-              currentSession.value!.messages.push(assistantMessage)
-            } else if (data.type === 'token' && assistantMessage) {
-              assistantMessage.content += data.content
-              streamingMessage.value = assistantMessage.content
-            } else if (data.type === 'end') {
-              streamingMessage.value = ''
-              // Remove event listeners
-              ws?.off('stream-message', handleStreamMessage)
-              ws?.off('stream-error', handleStreamError)
-              resolve({ success: true })
-            }
+          const startAssistantMessage = () => {
+            const messages = currentSession.value!.messages
+            messages.push({
+              id: `temp-${Date.now()}`,
+              role: 'assistant',
+              content: '',
+              timestamp: new Date().toISOString(),
+            })
+            // Keep the reactive copy so updates render
+            return messages[messages.length - 1]
           }
 
-          const handleStreamError = (data: StreamMessage) => {
-            if (data.type === 'error') {
-              streamingMessage.value = ''
-              error.value = data.error
-              // Remove event listeners
-              ws?.off('stream-message', handleStreamMessage)
-              ws?.off('stream-error', handleStreamError)
-              resolve({ success: false, error: error.value })
-            }
+          const finish = (result: { success: boolean; error?: string }) => {
+            streamingMessage.value = ''
+            // Remove event listeners
+            ws?.off('text_delta', handleTextDelta)
+            ws?.off('complete', handleComplete)
+            ws?.off('error', handleStreamError)
+            resolve(result)
+          }
+
+          const handleTextDelta = (data: StreamTextDelta) => {
+            assistantMessage ??= startAssistantMessage()
+            assistantMessage.content += data.content
+            streamingMessage.value = assistantMessage.content
+          }
+
+          const handleComplete = (data: StreamCompleteMessage) => {
+            assistantMessage ??= startAssistantMessage()
+            assistantMessage.id = data.message_id || assistantMessage.id
+            assistantMessage.content = data.content
+            finish({ success: true })
+          }
+
+          const handleStreamError = (data: StreamErrorMessage) => {
+            error.value = data.message
+            finish({ success: false, error: error.value })
           }
 
           // Register event handlers
-          ws?.on('stream-message', handleStreamMessage)
-          ws?.on('stream-error', handleStreamError)
+          ws?.on('text_delta', handleTextDelta)
+          ws?.on('complete', handleComplete)
+          ws?.on('error', handleStreamError)
 
           // Send message via WebSocket
           ws?.send({
             type: 'send-message',
-            sessionId: currentSession.value.id,
             content,
-            files: messageFiles,
           })
         })
       } else {
@@ -287,17 +305,41 @@ export const useChatStore = defineStore('chat', () => {
     }
   }
 
-  // Initialize WebSocket connection
-  const initializeWebSocket = () => {
-    if (!ws) {
-      const wsUrl = import.meta.env.VITE_WS_URL || `ws://${window.location.host}/ws`
-      ws = useWebSocket({
-        url: wsUrl,
-        reconnect: true,
-        reconnectDelay: 3000,
-        reconnectAttempts: 5,
-      })
+  // Messages sent from the assistant's other tabs; this tab's own are already shown
+  const handleUserMessage = (data: StreamUserMessage) => {
+    if (isSending.value || !currentSession.value) return
+    currentSession.value.messages.push({
+      id: `temp-${Date.now()}`,
+      role: 'user',
+      content: data.content,
+      timestamp: new Date().toISOString(),
+    })
+  }
+
+  // Initialize WebSocket connection for an assistant (/ws/chat/{assistant_id}?token=...)
+  const initializeWebSocket = (assistantId: string) => {
+    if (ws && wsAssistantId === assistantId) return
+    disconnectWebSocket()
+
+    const token = localStorage.getItem('auth_token')
+    if (!token) return
+
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+    let baseUrl = (import.meta.env.VITE_WS_URL || `${protocol}//${window.location.host}/ws`).replace(/\/+$/, '')
+    if (!baseUrl.endsWith('/ws')) {
+      baseUrl += '/ws'
     }
+
+    ws = useWebSocket({
+      url: `${baseUrl}/chat/${encodeURIComponent(assistantId)}?token=${encodeURIComponent(token)}`,
+      reconnect: true,
+      reconnectDelay: 3000,
+      reconnectAttempts: 5,
+    })
+    ws.on('user_message', handleUserMessage)
+    wsAssistantId = assistantId
+    // Stores are not components, so the composable's onMounted never connects
+    ws.connect()
   }
 
   // Disconnect WebSocket
@@ -305,6 +347,7 @@ export const useChatStore = defineStore('chat', () => {
     if (ws) {
       ws.disconnect()
       ws = null
+      wsAssistantId = null
     }
   }
 
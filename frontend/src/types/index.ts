@@ -258,12 +258,23 @@ export interface FileUploadProgress {
   error?: string
 }
 
-// WebSocket types for chat streaming (Responses API)
+// WebSocket types for chat streaming (/ws/chat/{assistant_id}?token=...)
 export interface StreamConnectionMessage {
   type: 'connection'
   status: 'connected'
-  conversation_id: number
-  message_count: number
+  assistant_id: string
+  thread_id: string | null
+}
+
+export interface StreamUserMessage {
+  type: 'user_message'
+  content: string
+  file_ids: string[] | null
+}
+
+export interface StreamJobStarted {
+  type: 'job_started'
+  job_id: string
 }
 
 export interface StreamTextDelta {
@@ -273,27 +284,28 @@ export interface StreamTextDelta {
 
 export interface StreamCompleteMessage {
   type: 'complete'
+  message_id: string | null
   content: string
-  response_id?: string
+  attachments: { file_id: string; type: 'image' }[] | null
+  run_id: string
+  total_tokens: number
+  job_id?: string
 }
 
 export interface StreamErrorMessage {
   type: 'error'
   message: string
-}
-
-export interface StreamToolMessage {
-  type: 'tool_call_start' | 'tool_call_delta' | 'tool_call_complete'
-  tool_name?: string
-  content?: string
+  retry_after?: number
+  job_id?: string
 }
 
 export type StreamMessage = 
   | StreamConnectionMessage 
+  | StreamUserMessage 
+  | StreamJobStarted 
   | StreamTextDelta 
   | StreamCompleteMessage 
-  | StreamErrorMessage 
-  | StreamToolMessage
+  | StreamErrorMessage
 
 // Legacy WebSocket types (for migration)
 export interface LegacyStreamMessageStart {